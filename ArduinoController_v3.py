@@ -1,9 +1,19 @@
+import os
 import time
 import json
+import math
+import atexit
+import asyncio
+import bisect
+import struct
 import serial
 import glob
+import threading
 
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
 from serial.tools import list_ports 
+import test_events
 
 # ================== FUNZIONI DI SUPPORTO DI MODULO ================== 
 def _read_line_raw(ser, prefix, timeout=1.0): 
@@ -14,7 +24,7 @@ def _read_line_raw(ser, prefix, timeout=1.0):
             continue 
         if line.startswith(prefix): 
             return line 
-        return None 
+    return None 
     
 def _get_address(ser): 
     try: 
@@ -28,12 +38,9 @@ def _get_address(ser):
         
 def _init_serial_port(port): 
     try: 
+        # DTR/RTS restano attivi come li imposta l'apertura: con HUPCL disattivato (vedi
+        # _disable_hupcl) la riapertura non produce il fronte che resetta l'ATmega
         ser = serial.Serial(port=port, baudrate=9600, timeout=1) 
-        try: 
-            ser.setDTR(False) 
-            ser.setRTS(False) 
-        except Exception: 
-            pass 
         time.sleep(2) 
         ser.reset_input_buffer() 
         return ser 
@@ -41,116 +48,1280 @@ def _init_serial_port(port):
         return None 
     
 
-open_ports = {}   # port -> serial.Serial instance
-arduino_main = None
+# ================== PROTOCOLLO BINARIO ==================
+# Il firmware recente, dopo SET_PROTO BIN, risponde a GET_INPUT_PINS, GET_ANGLES
+# e GET_ENCODER_POS con frame binari invece che con righe di testo:
+#   SYNC (0xA5) | LEN | TYPE | PAYLOAD (LEN byte) | CRC8 (su LEN, TYPE, PAYLOAD)
+# Le righe di testo (ACK, ADDRESS, ...) restano invariate e non contengono mai 0xA5.
+# Il firmware vecchio non conosce SET_PROTO: si resta sui comandi di testo.
+FRAME_SYNC = 0xA5
+FRAME_PINS = 0x01       # <I   maschera dei 32 ingressi (bit i = ingresso i)
+FRAME_ANGLES = 0x02     # <HB  parola SPI + numero di bit ricevuti (0 = nessun dato)
+FRAME_ENC = 0x03        # <H   posizione encoder
+FRAME_SAMPLE = 0x04     # <IIHBH micros(), maschera ingressi, parola SPI, bit SPI, encoder (0xFFFF = n.d.)
+FRAME_SNAPSHOT = 0x05   # come FRAME_SAMPLE, risposta a GET_SNAPSHOT
 
-def detect_devices():
-    print("[BOTH][ARDUINO] Scansione porte USB...")
+ENCODER_COUNTS = 400    # impulsi encoder per giro
 
-    ports = glob.glob("/dev/ttyUSB*")
-    print(f"[BOTH][ARDUINO] Porte trovate: {ports}")
+TEXT_BAUDRATE = 9600
+BIN_BAUDRATE = 115200
+ENCODER_POLL_BYTES = 27 # "GET_ENCODER_POS\n" + "ENC:65535\r\n": un'andata e ritorno del polling
 
-    arduinos = {}
+def _crc8(data):
+    # CRC-8 polinomio 0x07 (stesso calcolo del firmware)
+    crc = 0
+    for byte in data:
+        crc ^= byte
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x07) & 0xFF if crc & 0x80 else (crc << 1) & 0xFF
+    return crc
 
-    for port in ports:
-        print(f"[ARDUINO] Controllo porta {port}...")
+def _encode_frame(ftype, payload):
+    body = bytes([len(payload), ftype]) + payload
+    return bytes([FRAME_SYNC]) + body + bytes([_crc8(body)])
 
-        # Se la porta è già aperta, la riuso
-        if port in open_ports and open_ports[port].isOpen():
-            ser = open_ports[port]
-            print(f"[ARDUINO]  ✔ Porta {port} già aperta, riutilizzo.")
-        else:
-            # Apro la porta per la prima volta
-            try:
-                ser = serial.Serial(port=port, baudrate=9600, timeout=1)
-                open_ports[port] = ser
-                print(f"[BOTH][ARDUINO]  ✔ Porta {port} aperta ora.")
-                time.sleep(2)
-            except Exception as e:
-                print(f"[BOTH][ARDUINO]  ❌ Errore apertura {port}: {e}")
+# ================== STATO DEI PIN ==================
+# Insieme dei pin attivi in un solo intero (bit i = pin i): confronti, differenze e
+# conteggi sono operazioni sull'intero, senza liste di 0/1 né set da ricostruire.
+# repr() è la lista dei pin attivi, come i vecchi log "Active DIO: [2, 14]".
+class PinState:
+    __slots__ = ("mask",)
+
+    def __init__(self, mask=0):
+        self.mask = mask
+
+    @classmethod
+    def from_pins(cls, pins):
+        # Da indici dei pin attivi: [0, 5] -> bit 0 e 5
+        mask = 0
+        for pin in pins:
+            mask |= 1 << pin
+        return cls(mask)
+
+    @classmethod
+    def from_bits(cls, bits):
+        # Da lista di 0/1 (risposta JSON di GET_INPUT_PINS)
+        mask = 0
+        for i, bit in enumerate(bits):
+            if bit:
+                mask |= 1 << i
+        return cls(mask)
+
+    def count(self):
+        return bin(self.mask).count("1")
+
+    __len__ = count
+
+    def __bool__(self):
+        return self.mask != 0
+
+    def __iter__(self):
+        # Indici dei pin attivi in ordine crescente
+        mask = self.mask
+        while mask:
+            low = mask & -mask
+            yield low.bit_length() - 1
+            mask ^= low
+
+    def __contains__(self, pin):
+        return (self.mask >> pin) & 1 == 1
+
+    def first(self):
+        return (self.mask & -self.mask).bit_length() - 1 if self.mask else None
+
+    def diff(self, other):
+        # Pin che differiscono tra i due stati
+        return PinState(self.mask ^ other.mask)
+
+    def __and__(self, other):
+        return PinState(self.mask & other.mask)
+
+    def __or__(self, other):
+        return PinState(self.mask | other.mask)
+
+    def __sub__(self, other):
+        return PinState(self.mask & ~other.mask)
+
+    __xor__ = diff
+
+    def __eq__(self, other):
+        if isinstance(other, PinState):
+            return self.mask == other.mask
+        return NotImplemented
+
+    def __hash__(self):
+        return hash(self.mask)
+
+    def bits(self, n=32):
+        return [(self.mask >> i) & 1 for i in range(n)]
+
+    def __repr__(self):
+        return repr(list(self))
+
+def _spi_to_bits(word, nbits):
+    # Stesso formato della risposta testuale ANGLES:0101...
+    if nbits == 0:
+        return []
+    return format(word, f"0{nbits}b")[-nbits:]
+
+class _StreamDecoder:
+    # Separa righe di testo e frame binari che arrivano sullo stesso flusso di byte.
+    # feed() restituisce una lista di (tipo_frame, payload) oppure (None, riga)
+    def __init__(self):
+        self.buf = bytearray()
+
+    def feed(self, data):
+        self.buf += data
+        items = []
+        while self.buf:
+            if self.buf[0] == FRAME_SYNC:
+                if len(self.buf) < 3:
+                    break
+                length = self.buf[1]
+                if len(self.buf) < length + 4:
+                    break
+                body = bytes(self.buf[1:length + 3])
+                if _crc8(body) == self.buf[length + 3]:
+                    items.append((body[1], body[2:]))
+                    del self.buf[:length + 4]
+                else:
+                    del self.buf[:1]            # frame corrotto: risincronizzo
                 continue
 
-        # Interrogo l'Arduino
+            nl = self.buf.find(b"\n")
+            sync = self.buf.find(bytes([FRAME_SYNC]))
+            if sync != -1 and (nl == -1 or sync < nl):
+                nl = sync                       # riga troncata da un frame
+            elif nl == -1:
+                break
+            line = self.buf[:nl].decode("ascii", errors="ignore").strip()
+            del self.buf[:nl + 1 if self.buf[nl:nl + 1] == b"\n" else nl]
+            if line:
+                items.append((None, line))
+        return items
+
+# ================== STREAMING ==================
+# Con START_STREAM <periodo_ms> la scheda invia campioni in continuo:
+# FRAME_SAMPLE in modalità binaria, righe "SMP:<micros>;<maschera>;<spi>;<bit>;<enc>" in testo.
+class Sample(namedtuple("Sample", "t t_board mask spi nbits enc")):
+    # t = istante host (time.time()) del campionamento: ricavato da t_board col clock
+    # sincronizzato della scheda, altrimenti istante di ricezione. t_board = micros()
+    __slots__ = ()
+
+    @property
+    def pins(self):
+        return PinState(self.mask)
+
+    @property
+    def angle_bits(self):
+        return _spi_to_bits(self.spi, self.nbits)
+
+def _decode_sample_frame(payload, t):
+    t_board, mask, spi, nbits, enc = struct.unpack("<IIHBH", payload)
+    return Sample(t, t_board, mask, spi, nbits, None if enc == 0xFFFF else enc)
+
+# ================== BUS CONDIVISO ==================
+# Stato dei pin SHARE_IO_1/2/3/6 e contatori delle commutazioni in un'unica lettura
+BusState = namedtuple("BusState", "t missing_cfg run_galvo run_pulse run_camera events")
+# Commutazione di un pin del bus registrata in modalità watch
+# (t = istante host, corretto col clock della scheda se sincronizzato;
+#  t_board = micros() della scheda o None se rilevata per polling)
+BusTransition = namedtuple("BusTransition", "t name level t_board")
+BUS_PINS = ("missing_cfg", "run_galvo", "run_pulse", "run_camera")
+
+def _decode_sample_line(line, t):
+    try:
+        t_board, mask, spi, nbits, enc = (int(v) for v in line.split(":", 1)[1].split(";"))
+    except ValueError:
+        return None
+    return Sample(t, t_board, mask, spi, nbits, None if enc < 0 else enc)
+
+# ================== SNAPSHOT CORRELATO ==================
+# Stato dei pin (o angolo SPI) e posizione encoder riferiti allo stesso istante.
+# skew = incertezza temporale (s) sull'istante di campionamento,
+# enc_tol = incertezza corrispondente in impulsi encoder (0 se latch simultaneo sulla scheda)
+Snapshot = namedtuple("Snapshot", "t enc pins angle_bits skew enc_tol")
+
+def _enc_delta(a, b):
+    # Distanza con segno da a a b tenendo conto del giro a ENCODER_COUNTS impulsi
+    half = ENCODER_COUNTS // 2
+    return (b - a + half) % ENCODER_COUNTS - half
+
+# ================== TRACKER ENCODER ==================
+# Storico (istante host, posizione) dell'encoder del main, alimentato dallo stream o,
+# senza stream, da un thread che interroga GET_ENCODER_POS. Le posizioni sono salvate
+# "srotolate" (oltre il giro) così l'interpolazione funziona anche a cavallo dello zero.
+# position_at(t) risponde dalla memoria: gli slave non passano più dalla seriale del main.
+class EncoderTracker:
+    def __init__(self, size=2048, max_age=0.25, speed_window=0.05):
+        self.max_age = max_age              # oltre questo ritardo lo storico è considerato fermo
+        self.speed_window = speed_window    # finestra (s) su cui stimare la velocità
+        self._lock = threading.Lock()
+        self._t = deque(maxlen=size)
+        self._pos = deque(maxlen=size)
+        self._stop = None
+
+    def add(self, t, enc):
+        with self._lock:
+            if self._t:
+                if t <= self._t[-1]:
+                    return
+                last = self._pos[-1]
+                enc = last + _enc_delta(last % ENCODER_COUNTS, enc)
+            self._t.append(t)
+            self._pos.append(enc)
+
+    def clear(self):
+        with self._lock:
+            self._t.clear()
+            self._pos.clear()
+
+    def position_at(self, t):
+        # (posizione, velocità in impulsi/s) all'istante host t; None se lo storico
+        # non basta o è fermo da più di max_age secondi
+        with self._lock:
+            n = len(self._t)
+            if n < 2 or t - self._t[-1] > self.max_age:
+                return None
+            i = bisect.bisect_right(self._t, t)
+            if i == 0:
+                return None                     # t precede lo storico
+            i = min(i, n - 1)
+            j = i - 1
+            while j > 0 and self._t[i] - self._t[j] < self.speed_window:
+                j -= 1
+            speed = (self._pos[i] - self._pos[j]) / (self._t[i] - self._t[j])
+            t0, p0 = self._t[i - 1], self._pos[i - 1]
+        return round(p0 + speed * (t - t0)) % ENCODER_COUNTS, speed
+
+    def start(self, read, interval):
+        # Interroga read() in continuo: solo senza stream (vedi start_encoder_tracking)
+        if self._stop is not None:
+            return
+        self._stop = threading.Event()
+        threading.Thread(target=self._poll_loop, args=(self._stop, read, interval),
+                         daemon=True, name="encoder-tracker").start()
+
+    def stop(self):
+        if self._stop is not None:
+            self._stop.set()
+            self._stop = None
+
+    def _poll_loop(self, stop, read, interval):
+        while not stop.is_set():
+            t0 = time.time()
+            enc = read()
+            t1 = time.time()
+            if enc is not None:
+                self.add((t0 + t1) / 2, enc)
+            # Pausa mai più corta dell'ultima andata e ritorno: la seriale resta libera
+            # per i comandi del test almeno metà del tempo
+            stop.wait(max(interval, t1 - t0))
+
+# ================== SINCRONIZZAZIONE CLOCK ==================
+# PING → PONG:<micros> : per ogni scambio l'istante in cui la scheda ha letto micros()
+# sta tra l'arrivo del comando e la partenza della risposta, quindi nella finestra
+# [t0 + invio comando, t1 - ricezione risposta] dell'host. Da ogni raffica si tiene lo
+# scambio più veloce (meno disturbato dal buffering USB) e sugli ultimi punti si stima
+# con i minimi quadrati host = h_ref + pendenza * (board - b_ref): la pendenza dà la deriva.
+MICROS_WRAP = 1 << 32       # micros() torna a zero ogni ~71.6 minuti
+
+class ClockSync:
+    def __init__(self, window=60):
+        self._lock = threading.Lock()
+        self._points = deque(maxlen=window)     # (board s, host s, finestra s)
+        self._last_us = None
+        self._fit = None                        # (b_ref, h_ref, pendenza)
+        self.uncertainty = None                 # s, metà della finestra più stretta
+        self.supported = None
+
+    @property
+    def synced(self):
+        return self._fit is not None
+
+    @property
+    def drift_ppm(self):
+        # > 0 se il quarzo della scheda è più veloce dell'orologio dell'host
+        return (1 / self._fit[2] - 1) * 1e6 if self._fit else None
+
+    def unwrap(self, us):
+        # micros() su 32 bit → microsecondi continui (il giro più vicino all'ultimo visto)
+        with self._lock:
+            if self._last_us is None:
+                self._last_us = us
+                return us
+            us += round((self._last_us - us) / MICROS_WRAP) * MICROS_WRAP
+            self._last_us = max(self._last_us, us)
+            return us
+
+    def add(self, host_lo, us, host_hi):
+        board = self.unwrap(us) / 1e6
+        with self._lock:
+            self._points.append((board, (host_lo + host_hi) / 2, host_hi - host_lo))
+            self._update()
+
+    def _update(self):
+        best = min(w for _, _, w in self._points)
+        points = [(b, h) for b, h, w in self._points if w <= 2 * best + 0.001]
+        n = len(points)
+        b_ref = sum(b for b, _ in points) / n
+        h_ref = sum(h for _, h in points) / n
+        var = sum((b - b_ref) ** 2 for b, _ in points)
+        slope = 1.0
+        if n >= 3 and points[-1][0] - points[0][0] >= 2.0:
+            slope = sum((b - b_ref) * (h - h_ref) for b, h in points) / var
+        self._fit = (b_ref, h_ref, slope)
+        self.uncertainty = best / 2
+
+    def to_host(self, us):
+        # micros() della scheda → time.time() dell'host (None se non sincronizzato)
+        fit = self._fit
+        if fit is None:
+            return None
+        b_ref, h_ref, slope = fit
+        return h_ref + slope * (self.unwrap(us) / 1e6 - b_ref)
+
+# ================== STATISTICHE DEL COLLEGAMENTO ==================
+# Per ogni scheda: latenza dei comandi (istogramma), timeout, byte scambiati, righe
+# scartate, riconnessioni. Leggibili durante il test con get_link_stats() ed esportate
+# in JSON a fine esecuzione se ARDUINO_STATS_FILE è impostata.
+LATENCY_BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+class LinkStats:
+    def __init__(self, address, port):
+        self.address = address
+        self.port = port
+        self.commands = {}          # comando -> contatori e istogramma
+        self.bytes_out = 0
+        self.bytes_in = 0
+        self.discarded_lines = 0
+        self.errors = 0
+        self.reconnects = 0
+        self.reconnect_times = []   # secondi tra perdita della porta e scheda di nuovo pronta
+
+    def _command(self, cmd):
+        entry = self.commands.get(cmd)
+        if entry is None:
+            entry = self.commands[cmd] = {"sent": 0, "answered": 0, "timeouts": 0,
+                                          "sum_ms": 0.0, "max_ms": 0.0,
+                                          "buckets": [0] * (len(LATENCY_BUCKETS_MS) + 1)}
+        return entry
+
+    def sent(self, data):
+        self.bytes_out += len(data)
+        self._command(_command_name(data))["sent"] += 1
+
+    def answered(self, cmd, ms):
+        entry = self._command(cmd)
+        entry["answered"] += 1
+        entry["sum_ms"] += ms
+        entry["max_ms"] = max(entry["max_ms"], ms)
+        entry["buckets"][bisect.bisect_left(LATENCY_BUCKETS_MS, ms)] += 1
+
+    def timed_out(self, cmd):
+        self._command(cmd)["timeouts"] += 1
+
+    def as_dict(self):
+        commands = {}
+        for cmd, entry in self.commands.items():
+            commands[cmd] = dict(entry, mean_ms=round(entry["sum_ms"] / entry["answered"], 3)
+                                 if entry["answered"] else None)
+        return {"address": self.address, "port": self.port, "bytes_out": self.bytes_out,
+                "bytes_in": self.bytes_in, "discarded_lines": self.discarded_lines,
+                "errors": self.errors, "reconnects": self.reconnects,
+                "reconnect_times_s": [round(t, 3) for t in self.reconnect_times],
+                "latency_buckets_ms": list(LATENCY_BUCKETS_MS) + ["inf"], "commands": commands}
+
+def _command_name(data):
+    if isinstance(data, str):
+        data = data.encode()
+    return data.split(b" ", 1)[0].strip().decode("ascii", errors="ignore")
+
+link_stats = {}     # address -> LinkStats
+
+def get_link_stats():
+    return {address: stats.as_dict() for address, stats in sorted(link_stats.items())}
+
+def export_link_stats(path):
+    with open(path, "w") as f:
+        json.dump(get_link_stats(), f, indent=2)
+
+def _export_link_stats_at_exit():
+    if link_stats:
+        # Istogrammi delle latenze anche al server (/metrics) sul canale eventi
+        test_events.metric("serial_link_stats", get_link_stats())
+    path = os.environ.get("ARDUINO_STATS_FILE")
+    if path and link_stats:
         try:
-            ser.reset_input_buffer()
-            ser.write(b"GET_ADDRESS\n")
-            time.sleep(0.2)
+            export_link_stats(path)
+        except OSError as e:
+            print(f"[LOG][ARDUINO] Impossibile salvare le statistiche seriali: {e}")
+
+atexit.register(_export_link_stats_at_exit)
+
+# ================== SMISTAMENTO RISPOSTE ==================
+# Un solo thread per porta legge tutto ciò che arriva dalla scheda e lo consegna a chi
+# lo aspetta. Ogni richiesta si mette in coda sul proprio prefisso (o tipo di frame)
+# prima di inviare il comando: la prima risposta con quel prefisso va alla richiesta più
+# vecchia ancora in attesa (il firmware risponde nell'ordine in cui riceve i comandi).
+# Le righe che nessuno aspetta restano in `unsolicited` invece di essere scartate.
+class _Request:
+    __slots__ = ("key", "until", "parts", "done")
 
-            line = ser.readline().decode(errors="ignore").strip()
+    def __init__(self, key, until=None):
+        self.key = key              # prefisso della riga (str) o tipo di frame (int)
+        self.until = until          # risposta su più righe: si raccoglie fino a questo testo
+        self.parts = []
+        self.done = threading.Event()
 
-            if line.startswith("ADDRESS:"):
-                addr = int(line.split(":")[1])
-                print(f"[BOTH][ARDUINO]  ✔ Arduino address {addr} risponde su {port}")
-                arduinos[addr] = ArduinoDevice(port=port, address=addr)
+class _ResponseRouter:
+    def __init__(self, size=256):
+        self._lock = threading.Lock()
+        self._pending = {}          # prefisso / tipo frame -> deque di _Request
+        self._open = None           # risposta su più righe in corso di raccolta
+        self.unsolicited = deque(maxlen=size)   # (istante, prefisso/tipo, riga o payload)
+
+    def expect(self, key, until=None):
+        req = _Request(key, until)
+        with self._lock:
+            self._pending.setdefault(key, deque()).append(req)
+        return req
+
+    def cancel(self, req):
+        with self._lock:
+            waiting = self._pending.get(req.key)
+            if waiting and req in waiting:
+                waiting.remove(req)
+            if self._open is req:
+                self._open = None
+
+    def dispatch(self, ftype, item, t):
+        # ftype None = riga di testo. Restituisce False se nessuno la aspettava
+        with self._lock:
+            if ftype is None and self._open is not None:
+                req = self._open
+                req.parts.append(item)
+                if req.until in item:
+                    self._open = None
+                    req.done.set()
+                return True
+            req = self._match(ftype, item)
+            if req is None:
+                self.unsolicited.append((t, ftype, item))
+                return False
+            req.parts.append(item)
+            if ftype is None and req.until and req.until not in item:
+                self._open = req
             else:
-                print(f"[ARDUINO]  ⚠ Nessuna risposta valida da {port}: '{line}'")
+                req.done.set()
+            return True
+
+    def _match(self, ftype, item):
+        if ftype is not None:
+            key = ftype
+        else:
+            # Vince il prefisso più lungo (es. "ACK:SPI AVVIATO" prima di un generico "ACK:")
+            prefixes = [k for k, w in self._pending.items()
+                        if w and isinstance(k, str) and item.startswith(k)]
+            if not prefixes:
+                return None
+            key = max(prefixes, key=len)
+        waiting = self._pending.get(key)
+        return waiting.popleft() if waiting else None
+
+    def fail_all(self):
+        # Porta chiusa o persa: sblocca subito chi è in attesa
+        with self._lock:
+            for waiting in self._pending.values():
+                while waiting:
+                    waiting.popleft().done.set()
+            self._open = None
+
+# Porte da scandire; con l'emulatore (arduino_emulator.py) si punta ai suoi link pty
+PORT_GLOB = os.environ.get("ARDUINO_PORT_GLOB", "/dev/ttyUSB*")
+# Con più Bucintoro in parallelo sullo stesso banco il server assegna a ogni test
+# le porte della propria postazione (ARDUINO_PORTS=porta1,porta2,... anche con pattern
+# glob): le porte delle altre postazioni non si toccano
+PORT_LIST = [port for port in os.environ.get("ARDUINO_PORTS", "").split(",") if port]
+
+def _station_ports():
+    if PORT_LIST:
+        return sorted({port for pattern in PORT_LIST for port in glob.glob(pattern)})
+    return sorted(glob.glob(PORT_GLOB))
+
+open_ports = {}          # port -> serial.Serial instance
+discovery_latency = {}   # port -> secondi tra apertura porta e risposta a GET_ADDRESS
+arduino_main = None
+
+# ================== CACHE PORTA -> ADDRESS ==================
+# Il cablaggio del banco non cambia: per ogni adattatore USB-seriale (identificato dal
+# numero di serie o dal percorso sysfs) si ricorda l'address dell'Arduino collegato
+# (None = porta che non è un Arduino, es. l'alimentatore). Per le porte in cache si verifica
+# solo l'address delle schede note, le altre si interrogano come nella scansione; la
+# scansione completa avviene se la cache manca, non corrisponde o manca il main (address 0).
+# Una porta che non risponde a GET_ADDRESS è "non Arduino" se lo dice l'adattatore USB,
+# se la scansione completa di scan_arduinos.py l'ha registrata così o dopo NOT_ARDUINO_AFTER
+# rilevazioni senza risposta ("silent"): un Arduino lento al boot va interrogato di nuovo,
+# ma l'alimentatore su un cavo USB-seriale clone non si sonda a ogni test.
+PORT_CACHE_FILE = os.environ.get("ARDUINO_PORT_CACHE",
+                                 os.path.expanduser("~/.cache/bucintoro/arduino_ports.json"))
+
+ARDUINO_USB_VIDS = {0x2341, 0x2A03, 0x1B4F,     # Arduino, Arduino.org, SparkFun
+                    0x1A86, 0x0403, 0x10C4}     # CH340, FTDI, CP210x dei cloni
+REQUIRED_ADDRESSES = (0,)                       # senza il main il test non parte: scansione completa
+NOT_ARDUINO_AFTER = 3                           # rilevazioni senza risposta prima di smettere di sondare
+
+def _port_vids(ports):
+    # port -> vendor id USB dell'adattatore (None se sconosciuto, es. pty dell'emulatore)
+    vids = {info.device: info.vid for info in list_ports.comports(include_links=True)}
+    return {port: vids.get(port) for port in ports}
+
+def _maybe_arduino(vid):
+    return vid is None or vid in ARDUINO_USB_VIDS
+
+def _not_arduino(entry, vid):
+    # Voce di cache di una porta da non sondare più
+    return entry["address"] is None and (not _maybe_arduino(vid) or
+                                         entry.get("silent", 0) >= NOT_ARDUINO_AFTER)
+
+def _update_port_cache(cache, results, identities, vids, trusted=False):
+    # trusted: scansione completa voluta (scan_arduinos.py), una porta muta è subito "non Arduino"
+    for port, addr, ser, latency, error in results:
+        if error:
+            continue
+        entry = {"address": addr, "port": port}
+        if addr is None:
+            previous = cache.get(identities[port])
+            silent = previous.get("silent", 0) if previous and previous["address"] is None else 0
+            entry["silent"] = NOT_ARDUINO_AFTER if trusted else silent + 1
+        cache[identities[port]] = entry
+    return cache
+
+def _port_identities(ports):
+    # port -> identità stabile dell'adattatore USB
+    usb = {}
+    for info in list_ports.comports(include_links=True):
+        if info.serial_number:
+            usb[info.device] = f"usb:{info.vid:04x}:{info.pid:04x}:{info.serial_number}"
+        elif info.location:
+            usb[info.device] = f"usb-path:{info.location}"
+    return {port: usb.get(port, f"path:{port}") for port in ports}
+
+def load_port_cache():
+    try:
+        with open(PORT_CACHE_FILE) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_port_cache(cache):
+    try:
+        os.makedirs(os.path.dirname(PORT_CACHE_FILE), exist_ok=True)
+        # Scrittura atomica: più test in parallelo possono aggiornare la cache insieme
+        tmp = f"{PORT_CACHE_FILE}.{os.getpid()}"
+        with open(tmp, "w") as f:
+            json.dump(cache, f, indent=2, sort_keys=True)
+        os.replace(tmp, PORT_CACHE_FILE)
+    except OSError as e:
+        print(f"[LOG][ARDUINO] Impossibile salvare la cache delle porte: {e}")
+
+def _disable_hupcl(ser):
+    # Senza HUPCL il DTR resta alto alla chiusura: alla riapertura successiva
+    # l'Arduino non si resetta e risponde subito
+    try:
+        import termios
+        attrs = termios.tcgetattr(ser.fd)
+        attrs[2] &= ~termios.HUPCL
+        termios.tcsetattr(ser.fd, termios.TCSANOW, attrs)
+    except Exception:
+        pass
+
+def _probe_port(port):
+    # Apre la porta (o riusa quella già aperta) e chiede l'indirizzo.
+    # Restituisce (port, address, ser, latenza, errore)
+    start = time.time()
+    if port in open_ports and open_ports[port].isOpen():
+        ser = open_ports[port]
+        ser.reset_input_buffer()
+    else:
+        ser = _init_serial_port(port)           # include i 2 s di boot dell'Arduino
+        if ser is None:
+            return port, None, None, time.time() - start, "apertura fallita"
+        _disable_hupcl(ser)
+        open_ports[port] = ser
+
+    addr = None
+    for _ in range(3):                          # il primo GET_ADDRESS può perdersi durante il boot
+        addr = _get_address(ser)
+        if addr is not None:
+            break
+    return port, addr, ser, time.time() - start, None
+
+def _probe_known_port(port):
+    # Scheda già in cache: la porta è stata chiusa con DTR attivo (HUPCL disattivato) e
+    # l'apertura lo lascia attivo, quindi nessun fronte di reset e risposta immediata;
+    # se la scheda si è resettata lo stesso (es. ricollegata) si aspetta il boot
+    start = time.time()
+    if port in open_ports and open_ports[port].isOpen():
+        return _probe_port(port)
+    try:
+        ser = serial.Serial(port=port, baudrate=9600, timeout=1)
+    except Exception:
+        return port, None, None, time.time() - start, "apertura fallita"
+    _disable_hupcl(ser)
+    open_ports[port] = ser
+    time.sleep(0.1)
+    ser.reset_input_buffer()
+    addr = _get_address(ser)
+    if addr is None:
+        time.sleep(max(0.0, 2 - (time.time() - start)))
+        return _probe_port(port)
+    return port, addr, ser, time.time() - start, None
 
-        except Exception as e:
-            print(f"[ARDUINO]  ❌ Errore comunicazione con {port}: {e}")
+_NOT_ARDUINO = "non è un Arduino (cache)"
+_UNKNOWN = object()
+
+def _probe_from_cache(ports, identities, cache, vids):
+    # Risultati come _probe_port, oppure None se una scheda non ha l'address atteso.
+    # Porte non in cache, o mute ma non ancora "non Arduino" (vedi _not_arduino): sondate da capo
+    expected = {}
+    for port in ports:
+        entry = cache.get(identities[port])
+        if entry is None or (entry["address"] is None and not _not_arduino(entry, vids[port])):
+            expected[port] = _UNKNOWN
+        else:
+            expected[port] = entry["address"]
+    to_probe = [port for port in ports if expected[port] is not None]
+    if not to_probe:
+        return None
+    probe = lambda port: _probe_port(port) if expected[port] is _UNKNOWN else _probe_known_port(port)
+    with ThreadPoolExecutor(max_workers=len(to_probe)) as pool:
+        probed = {r[0]: r for r in pool.map(probe, to_probe)}
+    results = []
+    for port in ports:
+        if expected[port] is None:
+            results.append((port, None, None, 0.0, _NOT_ARDUINO))
+        elif expected[port] is not _UNKNOWN and probed[port][1] != expected[port]:
+            return None
+        else:
+            results.append(probed[port])
+    found = {addr for port, addr, ser, latency, error in results if not error}
+    if not all(addr in found for addr in REQUIRED_ADDRESSES):
+        return None
+    return results
+
+def _scan_ports(ports):
+    # Tutte le porte vengono aperte e interrogate in parallelo: il tempo di boot
+    # (2 s per scheda) si paga una volta sola invece che una volta per porta
+    with ThreadPoolExecutor(max_workers=len(ports)) as pool:
+        return list(pool.map(_probe_port, ports))
+
+def detect_devices(binary=False, baudrate=None, use_cache=True):
+    print("[BOTH][ARDUINO] Scansione porte USB...")
+
+    ports = _station_ports()
+    print(f"[BOTH][ARDUINO] Porte trovate: {ports}")
+
+    arduinos = {}
+    if not ports:
+        print("[BOTH][ARDUINO] Rilevati 0 Arduino: []")
+        return arduinos
+
+    identities = _port_identities(ports)
+    vids = _port_vids(ports)
+    cache = load_port_cache() if use_cache else {}
+    results = None
+    if cache and any(identities[port] in cache for port in ports):
+        results = _probe_from_cache(ports, identities, cache, vids)
+        if results is None:
+            print("[LOG][ARDUINO] Cache delle porte non corrispondente o main mancante, scansione completa")
+        else:
+            print("[LOG][ARDUINO] Porte riconosciute dalla cache, verifica address completata")
+    if results is None:
+        results = _scan_ports(ports)
+    # Si aggiornano solo le porte interrogate: quelle delle altre postazioni restano in cache
+    cache = load_port_cache() if use_cache else {}
+    save_port_cache(_update_port_cache(cache, results, identities, vids, trusted=not use_cache))
+
+    for port, addr, ser, latency, error in results:
+        discovery_latency[port] = latency
+        if error == _NOT_ARDUINO:
+            print(f"[LOG][ARDUINO] Porta {port} saltata: {error}")
+            continue
+        if error:
+            print(f"[BOTH][ARDUINO]  ❌ Errore apertura {port}: {error}")
+            continue
+        if addr is None:
+            print(f"[ARDUINO]  ⚠ Nessuna risposta valida da {port} ({latency:.2f} s)")
+            continue
+        if addr in arduinos:
+            print(f"[BOTH][ARDUINO]  ⚠ Address {addr} duplicato su {port} (già su {arduinos[addr].port})")
+            continue
+        print(f"[BOTH][ARDUINO]  ✔ Arduino address {addr} risponde su {port} ({latency:.2f} s)")
+        # La porta è già aperta e la scheda ha già fatto il boot: la passo al device
+        arduinos[addr] = ArduinoDevice(port=port, address=addr, ser=ser)
+        arduinos[addr].discovery_latency = latency
+
+    if binary and arduinos:
+        # Negoziazione in parallelo: il firmware vecchio costa un timeout per scheda
+        with ThreadPoolExecutor(max_workers=len(arduinos)) as pool:
+            modes = list(pool.map(lambda dev: dev.enable_binary(baudrate), arduinos.values()))
+        for dev, ok in zip(arduinos.values(), modes):
+            mode = f"binario @ {dev.ser.baudrate}" if ok else "testo (firmware senza SET_PROTO)"
+            print(f"[LOG][ARDUINO] Address {dev.address}: protocollo {mode}")
 
     print(f"[BOTH][ARDUINO] Rilevati {len(arduinos)} Arduino: {list(arduinos.keys())}")
     return arduinos
 
     
+# ================== SUPERVISORE HOT-PLUG ==================
+# Se un adattatore USB-seriale si stacca a metà test il thread di lettura della scheda
+# se ne accorge e la segna come scollegata: da lì le richieste falliscono subito invece
+# di consumare ognuna il proprio timeout. Il supervisore controlla le porte ogni
+# interval secondi e, per ogni scheda scollegata, prova le porte libere: prima il vecchio
+# percorso, poi quelle che la cache associa a quell'address, infine quelle sconosciute.
+class PortSupervisor:
+    def __init__(self, devices, interval=0.5):
+        self.devices = list(devices.values()) if isinstance(devices, dict) else list(devices)
+        self.interval = interval
+        self._stop = None
+
+    def start(self):
+        if self._stop is None:
+            self._stop = threading.Event()
+            threading.Thread(target=self._loop, args=(self._stop,), daemon=True,
+                             name="arduino-supervisor").start()
+        return self
+
+    def stop(self):
+        if self._stop is not None:
+            self._stop.set()
+            self._stop = None
+        for dev in self.devices:
+            if dev.stats.reconnects:
+                times = ", ".join(f"{t:.1f} s" for t in dev.stats.reconnect_times)
+                print(f"[BOTH][ARDUINO] Address {dev.address}: {dev.stats.reconnects} riconnessioni ({times})")
+            elif not dev.connected and not dev.closed:
+                print(f"[BOTH][ARDUINO] Address {dev.address}: porta {dev.port} non più disponibile")
+
+    def _loop(self, stop):
+        while not stop.wait(self.interval):
+            down = [dev for dev in self.devices if not dev.connected and not dev.closed]
+            if down:
+                self._reattach(down)
+
+    def _reattach(self, down):
+        in_use = {dev.port for dev in self.devices if dev.connected}
+        free = [port for port in _station_ports() if port not in in_use]
+        if not free:
+            return
+        identities = _port_identities(free)
+        vids = _port_vids(free)
+        cache = load_port_cache()
+        for dev in down:
+            def rank(port):
+                # Porta di prima, poi stessa scheda in cache, porte nuove, porte mute da riprovare;
+                # mai le porte "non Arduino" (alimentatore)
+                cached = cache.get(identities[port])
+                if port == dev.port:
+                    return 0
+                if cached is None:
+                    return 2
+                if cached["address"] is None:
+                    return None if _not_arduino(cached, vids[port]) else 3
+                return 1 if cached["address"] == dev.address else None
+            candidates = sorted((p for p in free if rank(p) is not None), key=rank)
+            for port in candidates:
+                if dev.reconnect(port):
+                    free.remove(port)
+                    cache[identities[port]] = {"address": dev.address, "port": port}
+                    save_port_cache(cache)
+                    break
+
 # ================== CLASSE PER UN SINGOLO ARDUINO ==================
 class ArduinoDevice:
     main_device = None
 
-    def __init__(self, port, address):
+    def __init__(self, port, address, ser=None):
         self.port = port
         self.address = address
-        self.ser = serial.Serial(port=port, baudrate=9600, timeout=1)
-        time.sleep(2)
+        self.discovery_latency = None
+        self.binary = False
+        self.stats = link_stats[address] = LinkStats(address, port)
+        # Thread di lettura sempre attivo: smista risposte, campioni ed eventi del bus
+        self._reader = None
+        self._reader_stop = threading.Event()
+        self._router = _ResponseRouter()
+        self._write_lock = threading.Lock()
+        # Streaming: ring buffer dei campioni
+        self._streaming = False
+        self._samples = deque(maxlen=4096)
+        self._samples_cond = threading.Condition()
+        self._sample_count = 0
+        self.encoder = EncoderTracker()         # usato solo sul main
+        self.clock = ClockSync()
+        self._clock_stop = None
+        # Watch del bus condiviso
+        self._bus_state_supported = None
+        self._bus_transitions = []
+        self._bus_watching = False
+        self._bus_poller = None                 # thread di polling del bus (firmware senza BUS_WATCH)
+        self._bus_poller_stop = threading.Event()
+        self._snapshot_supported = None
+        self._snapshot_latched = False
+        # Per le operazioni composte da più richieste che devono restare consecutive
+        self._io_lock = threading.RLock()
+        # Collegamento: stato attivo sulla scheda, da ripristinare dopo una riconnessione
+        self._link_up = threading.Event()
+        self._link_up.set()
+        self._down_since = None
+        self.closed = False
+        self._binary_baudrate = None            # None = testo, 0 = binario senza cambio baud
+        self._noise_on = False
+        self._spi_on = False
+        self._encoder_on = False
+        self._stream_period = None
+        if ser is not None:
+            # Porta già aperta da detect_devices(): riaprirla resetterebbe la scheda
+            self.ser = ser
+        else:
+            self.ser = serial.Serial(port=port, baudrate=9600, timeout=1)
+            time.sleep(2)
         self.ser.reset_input_buffer()
+        self._start_reader()
 
     # --- Utility ---
-    def _read_line(self, prefix, timeout=1.0):
-        end = time.time() + timeout
-        while time.time() < end:
-            line = self.ser.readline().decode('ascii', errors='ignore').strip()
-            if line.startswith(prefix):
-                return line
-        return None
+    @property
+    def connected(self):
+        return self._link_up.is_set()
 
     def _write(self, msg):
-        self.ser.write(msg.encode() if isinstance(msg, str) else msg)
+        data = msg.encode() if isinstance(msg, str) else msg
+        if not self.connected:
+            self.stats.errors += 1
+            return
+        try:
+            with self._write_lock:
+                self.ser.write(data)
+        except (serial.SerialException, OSError):
+            self._link_lost()
+            return
+        self.stats.sent(data)
+
+    def _request(self, cmd, key, timeout=1.0, until=None):
+        # Invia cmd e attende la risposta con prefisso key (o il frame di tipo key).
+        # La registrazione e la scrittura avvengono sotto lo stesso lock: l'ordine delle
+        # richieste in coda coincide con quello in cui il firmware risponde, anche con più
+        # thread sulla stessa scheda. None allo scadere del timeout, subito se la porta è persa.
+        name = _command_name(cmd)
+        if not self.connected:
+            self.stats.timed_out(name)
+            return None
+        with self._write_lock:
+            req = self._router.expect(key, until)
+            t0 = time.perf_counter()
+            data = cmd.encode()
+            try:
+                self.ser.write(data)
+            except (serial.SerialException, OSError):
+                self._router.cancel(req)
+                self._link_lost()
+                self.stats.timed_out(name)
+                return None
+        self.stats.sent(data)
+        if not req.done.wait(timeout):
+            self._router.cancel(req)
+        if not req.done.is_set() or not req.parts:
+            self.stats.timed_out(name)
+            return None
+        self.stats.answered(name, (time.perf_counter() - t0) * 1000)
+        return "".join(req.parts) if until else req.parts[0]
+
+    def unsolicited(self, prefix=""):
+        # Righe arrivate senza che nessuno le aspettasse (ACK in ritardo, messaggi del firmware)
+        return [(t, item) for t, ftype, item in list(self._router.unsolicited)
+                if ftype is None and item.startswith(prefix)]
+
+    # --- Streaming ---
+    def _reader_loop(self):
+        decoder = _StreamDecoder()
+        while not self._reader_stop.is_set():
+            try:
+                data = self.ser.read(self.ser.in_waiting or 1)
+            except Exception:
+                break
+            if not data:
+                continue
+            t = time.time()
+            self.stats.bytes_in += len(data)
+            for ftype, item in decoder.feed(data):
+                if ftype == FRAME_SAMPLE:
+                    self._push_sample(_decode_sample_frame(item, t))
+                elif ftype is None and item.startswith("SMP:"):
+                    sample = _decode_sample_line(item, t)
+                    if sample:
+                        self._push_sample(sample)
+                elif ftype is None and item.startswith("BUSEV:"):
+                    self._push_bus_event(item, t)
+                elif not self._router.dispatch(ftype, item, t):
+                    self.stats.discarded_lines += 1
+        if not self._reader_stop.is_set():
+            self._link_lost()                   # porta sparita (adattatore USB scollegato)
+        self._router.fail_all()
+
+    def _link_lost(self):
+        if not self._link_up.is_set() or self.closed:
+            return
+        self._link_up.clear()
+        self._down_since = time.time()
+        self._router.fail_all()
+        print(f"[BOTH][ARDUINO] Address {self.address}: porta {self.port} persa, in attesa di riconnessione")
+
+    def reconnect(self, port):
+        # Riapre la scheda su port (stesso percorso o nuova enumerazione USB) e ripristina
+        # protocollo, noise, SPI, encoder e stream. False se lì non c'è questa scheda
+        old = open_ports.pop(self.port, None)
+        for ser in {old, self.ser}:
+            try: ser.close()
+            except: pass
+        open_ports.pop(port, None)
+        port, addr, ser, latency, error = _probe_port(port)
+        if addr != self.address:
+            if ser is not None:
+                open_ports.pop(port, None)
+                try: ser.close()
+                except: pass
+            return False
+        self._stop_reader()
+        self.ser = ser
+        self.port = self.stats.port = port
+        self.binary = False
+        self.clock = ClockSync()                # micros() riparte da zero dopo il reset
+        self._start_reader()
+        self._link_up.set()
+        self._restore_state()
+        downtime = time.time() - (self._down_since or time.time())
+        self.stats.reconnects += 1
+        self.stats.reconnect_times.append(downtime)
+        print(f"[BOTH][ARDUINO] Address {self.address} riconnesso su {port} in {downtime:.1f} s "
+              f"(riconnessione n. {self.stats.reconnects})")
+        return True
+
+    def _restore_state(self):
+        if self._binary_baudrate is not None:
+            self.enable_binary(self._binary_baudrate or None)
+        if self._noise_on:
+            self.start_noise()
+        if self._spi_on:
+            self.start_spi()
+        if self._encoder_on:
+            self.start_encoder()
+        if self._stream_period is not None:
+            # Lo storico resta: nel ring buffer c'è solo un buco di campioni
+            self._request(f"START_STREAM {self._stream_period}\n", "ACK:STREAM AVVIATO", timeout=0.5)
+        if self._bus_watching:
+            self._request("START_BUS_WATCH\n", "ACK:BUS_WATCH AVVIATO", timeout=0.5)
+        if self.clock.supported is None and self._clock_stop is not None:
+            self.sync_clock()
+
+    def _push_sample(self, sample):
+        if self.clock.synced:
+            sample = sample._replace(t=self.clock.to_host(sample.t_board))
+        with self._samples_cond:
+            self._samples.append(sample)
+            self._sample_count += 1
+            self._samples_cond.notify_all()
+        if sample.enc is not None:
+            self.encoder.add(sample.t, sample.enc)
+
+    def start_stream(self, period_ms=5, size=4096):
+        # Avvia l'invio continuo dei campioni e il thread che li raccoglie nel ring buffer
+        if self._streaming:
+            return True
+        with self._samples_cond:
+            self._samples = deque(maxlen=size)
+            self._sample_count = 0
+        # False con firmware senza streaming
+        self._streaming = bool(self._request(f"START_STREAM {period_ms}\n", "ACK:STREAM AVVIATO", timeout=0.5))
+        self._stream_period = period_ms if self._streaming else None
+        if self._streaming:
+            self.encoder.stop()                 # lo stream sostituisce il polling dell'encoder
+        return self._streaming
+
+    def stop_stream(self):
+        if not self._streaming:
+            return None
+        self._streaming = False
+        self._stream_period = None
+        return self._request("STOP_STREAM\n", "ACK:STREAM FERMATO", timeout=0.5)
+
+    def _start_reader(self):
+        self._reader_stop.clear()
+        self._reader = threading.Thread(target=self._reader_loop, daemon=True,
+                                        name=f"arduino{self.address}-reader")
+        self._reader.start()
+
+    def _stop_reader(self):
+        if self._reader is None:
+            return
+        self._reader_stop.set()
+        self._reader.join(timeout=2)
+        self._reader = None
+
+    def latest(self):
+        with self._samples_cond:
+            return self._samples[-1] if self._samples else None
+
+    def since(self, ts):
+        # Campioni ricevuti dopo l'istante ts (time.time() dell'host)
+        with self._samples_cond:
+            return [s for s in self._samples if s.t > ts]
+
+    def wait_for(self, predicate, timeout=1.0):
+        # Attende il primo campione in arrivo che soddisfa predicate; None allo scadere
+        end = time.time() + timeout
+        with self._samples_cond:
+            seen = self._sample_count
+            while True:
+                new = min(self._sample_count - seen, len(self._samples))
+                for i in range(len(self._samples) - new, len(self._samples)):
+                    if predicate(self._samples[i]):
+                        return self._samples[i]
+                seen = self._sample_count
+                remaining = end - time.time()
+                if remaining <= 0:
+                    return None
+                self._samples_cond.wait(remaining)
+
+    # --- Clock ---
+    def sync_clock(self, pings=5):
+        # Raffica di PING: aggiorna offset/deriva col più veloce. False se il firmware non
+        # ha PING (in tal caso i campioni restano con l'istante di ricezione)
+        if self.clock.supported is False:
+            return False
+        best = None
+        for _ in range(pings):
+            t0 = time.time()
+            response = self._request("PING\n", "PONG:", timeout=0.3)
+            t1 = time.time()
+            if not response:
+                continue
+            try:
+                us = int(response.split(":", 1)[1])
+            except ValueError:
+                self.stats.errors += 1
+                continue
+            # Tempo di trasmissione di comando e risposta (10 bit per byte)
+            byte_s = 10 / self.ser.baudrate
+            lo, hi = t0 + 5 * byte_s, t1 - (len(response) + 2) * byte_s
+            if hi < lo:
+                lo = hi = (t0 + t1) / 2
+            if best is None or hi - lo < best[2] - best[0]:
+                best = (lo, us, hi)
+        if best is None:
+            if self.clock.supported is None:
+                self.clock.supported = False
+                print(f"[LOG][ARDUINO] Address {self.address}: PING non supportato, timestamp di ricezione")
+            return False
+        self.clock.supported = True
+        self.clock.add(*best)
+        return True
+
+    def start_clock_sync(self, interval=1.0, pings=3):
+        # Prima sincronizzazione subito, poi una raffica ogni interval secondi
+        if self._clock_stop is not None:
+            return True
+        if not self.sync_clock(pings=5):
+            return False
+        self._clock_stop = threading.Event()
+        threading.Thread(target=self._clock_loop, args=(self._clock_stop, interval, pings),
+                         daemon=True, name=f"arduino{self.address}-clock").start()
+        return True
+
+    def stop_clock_sync(self):
+        if self._clock_stop is not None:
+            self._clock_stop.set()
+            self._clock_stop = None
+
+    def _clock_loop(self, stop, interval, pings):
+        while not stop.wait(interval):
+            self.sync_clock(pings)
+
+    # --- Protocollo ---
+    def enable_binary(self, baudrate=None):
+        # Chiede al firmware i frame binari (ed eventualmente un baudrate più alto).
+        # Se il firmware non risponde si resta in modalità testo.
+        cmd = f"SET_PROTO BIN {baudrate}\n" if baudrate else "SET_PROTO BIN\n"
+        if not self._request(cmd, "ACK:PROTO BIN", timeout=0.5):
+            self.binary = False
+            return False
+
+        if baudrate and baudrate != self.ser.baudrate:
+            # Il firmware cambia baudrate dopo l'ACK e torna a 9600/testo da solo
+            # se entro 1 s non riceve un comando valido alla nuova velocità
+            old_baudrate = self.ser.baudrate
+            self.ser.baudrate = baudrate
+            time.sleep(0.05)
+            self.ser.reset_input_buffer()
+            if self._query_int("GET_ADDRESS", "ADDRESS:", verbose=False) != self.address:
+                self.ser.baudrate = old_baudrate
+                time.sleep(1.1)
+                self.ser.reset_input_buffer()
+                self.binary = False
+                return False
+
+        self.binary = True
+        self._binary_baudrate = baudrate or 0
+        return True
+
+    def disable_binary(self):
+        self._binary_baudrate = None
+        if not self.binary:
+            return None
+        ack = self._request("SET_PROTO TEXT\n", "ACK:PROTO TEXT", timeout=0.5)
+        if self.ser.baudrate != TEXT_BAUDRATE:
+            self.ser.baudrate = TEXT_BAUDRATE
+            time.sleep(0.05)
+            self.ser.reset_input_buffer()
+        self.binary = False
+        return ack
 
     # --- Encoder ---
     def start_encoder(self): 
         # Avvia l'encoder SOLO sul main 
         if ArduinoDevice.main_device and self.address == ArduinoDevice.main_device.address: 
-            self._write("START_ENCODER\n") 
-            return self._read_line("ACK:Encoder AVVIATO") 
+            self._encoder_on = True
+            return self._request("START_ENCODER\n", "ACK:Encoder AVVIATO")
         return None
 
     def stop_encoder(self):
         if ArduinoDevice.main_device and self.address == ArduinoDevice.main_device.address:
-            self._write("STOP_ENCODER\n")
-            return self._read_line("ACK:Encoder FERMATO")
+            self._encoder_on = False
+            return self._request("STOP_ENCODER\n", "ACK:Encoder FERMATO")
         return None
 
+    def start_encoder_tracking(self, interval=None):
+        # Segue l'encoder del main in continuo: get_pos_encoder() ed encoder_at() di tutte le
+        # schede rispondono poi dalla memoria. Con lo stream attivo lo storico è già alimentato
+        # dal reader; il polling di GET_ENCODER_POS parte solo se lo stream non è disponibile,
+        # con un periodo mai più corto di un'andata e ritorno al baudrate attuale (~28 ms a 9600)
+        if ArduinoDevice.main_device and self.address == ArduinoDevice.main_device.address:
+            if self._streaming:
+                return True
+            round_trip = ENCODER_POLL_BYTES * 10 / self.ser.baudrate
+            self.encoder.start(self._read_encoder, max(interval or 0, round_trip))
+            return True
+        return False
+
+    def stop_encoder_tracking(self):
+        self.encoder.stop()
+
     def get_pos_encoder(self):
+        main = ArduinoDevice.main_device
+        if main is None:
+            return None
+        tracked = main.encoder_at(time.time())
+        if tracked is not None:
+            return tracked[0]
+        return main._read_encoder()
+
+    def _read_encoder(self):
+        # Lettura diretta GET_ENCODER_POS (solo sul main)
         if ArduinoDevice.main_device and self.address == ArduinoDevice.main_device.address:
-            self._write("GET_ENCODER_POS\n")
-            response = self._read_line("ENC:", timeout=0.5)
+            if self.binary:
+                payload = self._request("GET_ENCODER_POS\n", FRAME_ENC, timeout=0.5)
+                return struct.unpack("<H", payload)[0] if payload else None
+            response = self._request("GET_ENCODER_POS\n", "ENC:", timeout=0.5)
             if not response:
                 return None
             try:
                 return int(response.split(":",1)[1])
             except:
                 return None
-        if ArduinoDevice.main_device: 
-            return ArduinoDevice.main_device.get_pos_encoder() 
         return None
 
+    def encoder_at(self, t):
+        # Posizione encoder all'istante host t dallo storico del tracker (stream o polling).
+        # Restituisce (posizione, velocità in impulsi/s) oppure None se il main non è seguito
+        return self.encoder.position_at(t)
+
+    def get_snapshot(self, angles=False):
+        # Firmware recente: GET_SNAPSHOT restituisce ingressi, SPI ed encoder (letto dal
+        # bus condiviso) campionati nello stesso istante → enc_tol = 0.
+        # Altrimenti l'encoder del main viene interpolato sulla finestra della lettura.
+        e0 = None if self._snapshot_latched else self._encoder_before()
+        if self._snapshot_supported is not False:
+            t0 = time.time()
+            if self.binary:
+                payload = self._request("GET_SNAPSHOT\n", FRAME_SNAPSHOT, timeout=0.5)
+                sample = _decode_sample_frame(payload, 0) if payload else None
+            else:
+                line = self._request("GET_SNAPSHOT\n", "SNAP:", timeout=0.5)
+                sample = _decode_sample_line(line, 0) if line else None
+            t1 = time.time()
+            if sample is not None:
+                self._snapshot_supported = True
+                self._snapshot_latched = sample.enc is not None
+                t = (t0 + t1) / 2
+                if sample.enc is not None:
+                    return Snapshot(t, sample.enc, sample.pins, sample.angle_bits, 0.0, 0)
+                if self.clock.synced:
+                    # L'istante del campionamento è noto dal micros() della scheda: la
+                    # finestra si riduce all'incertezza della sincronizzazione
+                    t = self.clock.to_host(sample.t_board)
+                    t0, t1 = t - self.clock.uncertainty, t + self.clock.uncertainty
+                enc, tol = self._encoder_between(t0, t1, e0)
+                return Snapshot(t, enc, sample.pins, sample.angle_bits, (t1 - t0) / 2, tol)
+            if self._snapshot_supported is None:
+                self._snapshot_supported = False
+                print(f"[LOG][ARDUINO] Address {self.address}: GET_SNAPSHOT non supportato, uso interpolazione")
+                e0 = self._encoder_before()
+
+        # Firmware vecchio: lettura separata dei pin o dell'angolo
+        t0 = time.time()
+        if angles:
+            pins = PinState()
+            angle_bits = self._read_angle_bits()
+        else:
+            pins = self._read_input_pins()
+            angle_bits = []
+        if pins is None or angle_bits is None:
+            return None
+        t1 = time.time()
+        enc, tol = self._encoder_between(t0, t1, e0)
+        return Snapshot((t0 + t1) / 2, enc, pins, angle_bits, (t1 - t0) / 2, tol)
+
+    def _encoder_before(self):
+        # Senza stream sul main serve una lettura dell'encoder prima di quella dei pin
+        main = ArduinoDevice.main_device
+        if main is None or main.encoder_at(time.time()) is not None:
+            return None
+        return main.get_pos_encoder()
+
+    def _encoder_between(self, t0, t1, e0=None):
+        # Posizione encoder a metà della finestra [t0, t1] e incertezza in impulsi
+        main = ArduinoDevice.main_device
+        if main is None:
+            return None, 0
+        tracked = main.encoder_at((t0 + t1) / 2)
+        if tracked is not None:
+            enc, speed = tracked
+            return enc, math.ceil(abs(speed) * (t1 - t0) / 2)
+        # Lettura del main prima (e0) e dopo (e1): il valore vero è compreso tra le due
+        e1 = main.get_pos_encoder()
+        if e0 is None or e1 is None:
+            return (e1 if e0 is None else e0), 1
+        delta = _enc_delta(e0, e1)
+        return round(e0 + delta / 2) % ENCODER_COUNTS, math.ceil(abs(delta) / 2)
+
     # --- Noise ---
     def start_noise(self):
-        self._write("START_NOISE\n")
-        return self._read_line("ACK:Noise AVVIATO")
+        self._noise_on = True
+        return self._request("START_NOISE\n", "ACK:Noise AVVIATO")
 
     def stop_noise(self):
-        self._write("STOP_NOISE\n")
-        return self._read_line("ACK:Noise FERMATO")
+        self._noise_on = False
+        return self._request("STOP_NOISE\n", "ACK:Noise FERMATO")
 
     # --- GPIO ---
     def output_pins(self):
@@ -159,38 +1330,32 @@ class ArduinoDevice:
         else: 
             enc = None 
         time.sleep(0.002)
-        
-        self._write("GET_INPUT_PINS\n")
-        buf = ""
-        end = time.time() + 1.0
-        found_prefix = False
-
-        while time.time() < end:
-            chunk = self.ser.readline().decode(errors="replace")
-            if not chunk:
-                continue
 
-            if not found_prefix:
-                if chunk.startswith("INPUT:"):
-                    buf = chunk[len("INPUT:"):]
-                    found_prefix = True
-                else:
-                    continue
-            else:
-                buf += chunk
+        pins = self._read_input_pins()
+        if pins is None:
+            return PinState(), None
+        return pins, enc
 
-            start = buf.find('{')
-            end_json = buf.rfind('}')
-            if start != -1 and end_json != -1 and end_json > start:
-                candidate = buf[start:end_json+1].strip()
-                try:
-                    obj = json.loads(candidate)
-                    pins = obj.get("inputs", [])
-                    return pins, enc
-                except json.JSONDecodeError:
-                    pass
+    def _read_input_pins(self):
+        # GET_INPUT_PINS → PinState, None se non arriva risposta
+        if self.binary:
+            payload = self._request("GET_INPUT_PINS\n", FRAME_PINS, timeout=1.0)
+            if payload is None:
+                return None
+            return PinState(struct.unpack("<I", payload)[0])
 
-        return [], None
+        # Il JSON può arrivare spezzato su più righe: il router le raccoglie
+        # fino alla parentesi di chiusura
+        buf = self._request("GET_INPUT_PINS\n", "INPUT:", timeout=1.0, until="}")
+        if buf is None:
+            return None
+        start = buf.find('{')
+        end_json = buf.rfind('}')
+        try:
+            return PinState.from_bits(json.loads(buf[start:end_json+1].strip()).get("inputs", []))
+        except (json.JSONDecodeError, AttributeError, TypeError):
+            self.stats.errors += 1
+            return None
 
     def set_input_pin(self, pin):
         pin_map = {0:2, 1:3, 2:4, 3:5, 4:6, 5:7, 6:8, 7:9, 8:10, 9:11, 10:12, 11:13}
@@ -202,91 +1367,188 @@ class ArduinoDevice:
 
     # --- SPI ---
     def start_spi(self):
-        self._write("START_SPI\n")
-        return self._read_line("ACK:SPI AVVIATO")
+        self._spi_on = True
+        return self._request("START_SPI\n", "ACK:SPI AVVIATO")
 
     def stop_spi(self):
-        self._write("STOP_SPI\n")
-        return self._read_line("ACKSPI FERMATO")
+        self._spi_on = False
+        return self._request("STOP_SPI\n", "ACKSPI FERMATO")
 
     def get_angles(self):
-        self._write("GET_ANGLES\n")
-        response = self._read_line("ANGLES:", timeout=0.5)
-        if not response:
+        angle_bits = self._read_angle_bits()
+        if angle_bits is None:
             return [], None
-        #print(response)
-        parts = response.split(";")
-        angle_part = parts[0]
-        #enc_part = parts[1] if len(parts) > 1 else None
-
-        angle_bits = [] if angle_part == "ANGLES:NULL" else angle_part.split(":", 1)[1]
         time.sleep(0.002)
         encoder_pos = None
         if ArduinoDevice.main_device: 
             encoder_pos = ArduinoDevice.main_device.get_pos_encoder()
 
         return angle_bits, encoder_pos
-    
-    def get_missing_cfg(self):
-        self._write("GET_MISSING_CFG\n")
-        response = self._read_line("MISSING_CFG:", timeout=0.5)
+
+    def _read_angle_bits(self):
+        # GET_ANGLES → stringa di bit ('' / [] se nessun dato), None senza risposta
+        if self.binary:
+            payload = self._request("GET_ANGLES\n", FRAME_ANGLES, timeout=0.5)
+            if payload is None:
+                return None
+            return _spi_to_bits(*struct.unpack("<HB", payload))
+        response = self._request("GET_ANGLES\n", "ANGLES:", timeout=0.5)
         if not response:
             return None
-        try:
-            print(response)
-            return int(response.split(":", 1)[1])
-        except:
-            return None
+        #print(response)
+        parts = response.split(";")
+        angle_part = parts[0]
+        #enc_part = parts[1] if len(parts) > 1 else None
+
+        return [] if angle_part == "ANGLES:NULL" else angle_part.split(":", 1)[1]
+    
+    def get_missing_cfg(self):
+        return self._query_int("GET_MISSING_CFG", "MISSING_CFG:")
 
     def get_run_galvo(self):
-        self._write("GET_RUN_GALVO\n")
-        response = self._read_line("RUN_GALVO:", timeout=0.5)
-        if not response:
-            return None
-        try:
-            print(response)
-            return int(response.split(":", 1)[1])
-        except:
-            return None
+        return self._query_int("GET_RUN_GALVO", "RUN_GALVO:")
         
     def get_run_pulse(self):
-        self._write("GET_RUN_PULSE\n")
-        response = self._read_line("RUN_PULSE:", timeout=0.5)
-        if not response:
-            return None
-        try:
-            print(response)
-            return int(response.split(":", 1)[1])
-        except:
-            return None
+        return self._query_int("GET_RUN_PULSE", "RUN_PULSE:")
         
     def get_run_camera(self):
-        self._write("GET_RUN_CAMERA\n")
-        response = self._read_line("RUN_CAMERA:", timeout=0.5)
+        return self._query_int("GET_RUN_CAMERA", "RUN_CAMERA:")
+
+    def _query_int(self, cmd, prefix, verbose=True):
+        response = self._request(f"{cmd}\n", prefix, timeout=0.5)
         if not response:
             return None
         try:
-            print(response)
+            if verbose:
+                print(response)
             return int(response.split(":", 1)[1])
         except:
+            self.stats.errors += 1
             return None
         
-    def get_bus_events(self):
-        self._write("GET_BUS_EVENTS\n")
-        response = self._read_line("BUS:", timeout=0.5)
+    def get_bus_events(self, verbose=True):
+        response = self._request("GET_BUS_EVENTS\n", "BUS:", timeout=0.5)
         if not response:
             return None
 
         try:
-            print(response)
+            if verbose:
+                print(response)
             json_part = response.split("BUS:", 1)[1].strip()
             data = json.loads(json_part)
             return data
         except Exception:
+            self.stats.errors += 1
             return None
 
-    
+    def _read_bus_pins(self, events=True):
+        # ({pin: (livello, istante host)}, eventi) oppure None. GET_BUS_STATE legge tutto
+        # nello stesso istante; il firmware vecchio richiede quattro letture separate, ognuna
+        # col proprio istante, più GET_BUS_EVENTS se events
+        if self._bus_state_supported is not False:
+            response = self._request("GET_BUS_STATE\n", "BUS_STATE:", timeout=0.5)
+            t = time.time()
+            if response:
+                self._bus_state_supported = True
+                try:
+                    data = json.loads(response.split(":", 1)[1])
+                    return {name: (data.get(name), t) for name in BUS_PINS}, data.get("events")
+                except (ValueError, AttributeError):
+                    return None
+            if self._bus_state_supported is None:
+                self._bus_state_supported = False
+        pins = {}
+        with self._io_lock:
+            for name in BUS_PINS:
+                t0 = time.time()
+                level = self._query_int(f"GET_{name.upper()}", f"{name.upper()}:", verbose=False)
+                pins[name] = (level, (t0 + time.time()) / 2)
+            return pins, self.get_bus_events(verbose=False) if events else None
+
+    def get_bus_state(self):
+        # SHARE_IO_1/2/3/6 + contatori eventi con un solo GET_BUS_STATE;
+        # il firmware vecchio richiede le quattro letture separate + GET_BUS_EVENTS
+        result = self._read_bus_pins()
+        if result is None:
+            return None
+        pins, events = result
+        return BusState(max(t for level, t in pins.values()), *(pins[name][0] for name in BUS_PINS), events)
+
+    def start_bus_watch(self, poll_interval=0.02):
+        # Registra ogni commutazione dei pin del bus (es. durante la finestra di RUN).
+        # Il firmware recente le invia da solo (righe BUSEV:<pin>:<livello>:<micros>),
+        # altrimenti un thread rilegge i pin ogni poll_interval secondi, a partire dallo
+        # stato letto qui prima di restituire. Risoluzione reale del polling a 9600 baud:
+        # ~0.15 s per giro, sia con GET_BUS_STATE (risposta JSON coi contatori) sia con le
+        # quattro letture separate del firmware vecchio (senza GET_BUS_EVENTS): commutazioni
+        # più brevi di un giro possono sfuggire, poll_interval si somma al giro
+        self._bus_transitions = []
+        if self._request("START_BUS_WATCH\n", "ACK:BUS_WATCH AVVIATO", timeout=0.5):
+            self._bus_watching = True
+            return True
+        if self._bus_poller is not None:
+            return False
+        result = self._read_bus_pins(events=False)
+        last = {name: level for name, (level, t) in result[0].items()} if result else {}
+        self._bus_poller_stop.clear()
+        self._bus_poller = threading.Thread(target=self._bus_poll_loop, args=(poll_interval, last),
+                                            daemon=True, name=f"arduino{self.address}-buswatch")
+        self._bus_poller.start()
+        return False
+
+    def stop_bus_watch(self):
+        # Ferma il watch e restituisce la lista di BusTransition registrate
+        if self._bus_poller is not None:
+            # Si attende il giro in corso: le commutazioni lette dopo il return andrebbero perse
+            self._bus_poller_stop.set()
+            self._bus_poller.join(timeout=3)
+            self._bus_poller = None
+        elif self._bus_watching:
+            self._bus_watching = False
+            self._request("STOP_BUS_WATCH\n", "ACK:BUS_WATCH FERMATO", timeout=0.5)
+        return list(self._bus_transitions)
+
+    def _push_bus_event(self, line, t):
+        try:
+            _, name, level, t_board = line.split(":")
+            t_board = int(t_board)
+            if self.clock.synced:
+                t = self.clock.to_host(t_board)
+            self._bus_transitions.append(BusTransition(t, name.lower(), int(level), t_board))
+        except ValueError:
+            pass
+
+    def _bus_poll_loop(self, interval, last):
+        # last: pin -> ultimo livello letto; ogni commutazione ha l'istante della lettura del suo pin
+        while not self._bus_poller_stop.wait(interval):
+            result = self._read_bus_pins(events=False)
+            if result is None:
+                continue
+            for name, (level, t) in result[0].items():
+                if level is None:
+                    continue
+                if last.get(name) is not None and last[name] != level:
+                    self._bus_transitions.append(BusTransition(t, name, level, None))
+                last[name] = level
+
     def close(self):
+        if not self.connected:
+            # Porta persa: non c'è nulla da fermare sulla scheda
+            self.closed = True
+            self.stop_clock_sync()
+            self.stop_encoder_tracking()
+            self._stop_reader()
+            try: self.ser.close()
+            except: pass
+            return
+        try: self.stop_clock_sync()
+        except: pass
+        try: self.stop_encoder_tracking()
+        except: pass
+        try: self.stop_bus_watch()
+        except: pass
+        try: self.stop_stream()
+        except: pass
         try: self.stop_spi()
         except: pass
         try: self.stop_encoder()
@@ -295,6 +1557,11 @@ class ArduinoDevice:
         except: pass
         try: self.reset_pins()
         except: pass
+        try: self.disable_binary()
+        except: pass
+        self.closed = True
+        try: self._stop_reader()
+        except: pass
         try:
             self.ser.reset_input_buffer()
             self.ser.reset_output_buffer()
@@ -303,3 +1570,83 @@ class ArduinoDevice:
         try: self.ser.close()
         except: pass
 
+
+# ================== DRIVER ASYNCIO ==================
+# Ogni scheda ha la sua porta seriale: i comandi di schede diverse possono procedere
+# in parallelo. Le chiamate bloccanti di ArduinoDevice vengono eseguite in un thread
+# (asyncio.to_thread), quindi l'event loop non si blocca mai e gli script sincroni
+# esistenti continuano a usare ArduinoDevice direttamente. Le risposte sono smistate
+# dal thread di lettura della scheda: più comandi sulla stessa scheda possono sovrapporsi.
+def _async_command(name):
+    async def command(self, *args, **kwargs):
+        return await asyncio.to_thread(self._call, name, *args, **kwargs)
+    command.__name__ = name
+    return command
+
+class AsyncArduinoDevice:
+    def __init__(self, device):
+        self.device = device
+        self.port = device.port
+        self.address = device.address
+
+    def _call(self, name, *args, **kwargs):
+        return getattr(self.device, name)(*args, **kwargs)
+
+    # --- Encoder ---
+    start_encoder = _async_command("start_encoder")
+    stop_encoder = _async_command("stop_encoder")
+    get_pos_encoder = _async_command("get_pos_encoder")
+    # --- Noise ---
+    start_noise = _async_command("start_noise")
+    stop_noise = _async_command("stop_noise")
+    # --- GPIO ---
+    output_pins = _async_command("output_pins")
+    set_input_pin = _async_command("set_input_pin")
+    reset_pins = _async_command("reset_pins")
+    get_snapshot = _async_command("get_snapshot")
+    # --- SPI ---
+    start_spi = _async_command("start_spi")
+    stop_spi = _async_command("stop_spi")
+    get_angles = _async_command("get_angles")
+    # --- Bus condiviso ---
+    get_missing_cfg = _async_command("get_missing_cfg")
+    get_run_galvo = _async_command("get_run_galvo")
+    get_run_pulse = _async_command("get_run_pulse")
+    get_run_camera = _async_command("get_run_camera")
+    get_bus_events = _async_command("get_bus_events")
+    get_bus_state = _async_command("get_bus_state")
+    # --- Clock ---
+    sync_clock = _async_command("sync_clock")
+    start_clock_sync = _async_command("start_clock_sync")
+    stop_clock_sync = _async_command("stop_clock_sync")
+    # --- Streaming ---
+    start_stream = _async_command("start_stream")
+    stop_stream = _async_command("stop_stream")
+    close = _async_command("close")
+
+    async def wait_for(self, predicate, timeout=1.0):
+        # Legge solo il ring buffer riempito dal thread di lettura
+        return await asyncio.to_thread(self.device.wait_for, predicate, timeout)
+
+
+class ArduinoGroup:
+    # Gruppo di schede su cui inviare lo stesso comando in parallelo:
+    #   results = await group.gather("start_noise")      -> {address: risultato}
+    #   results = group.run("get_snapshot")              -> da codice sincrono
+    def __init__(self, devices):
+        self.devices = [d if isinstance(d, AsyncArduinoDevice) else AsyncArduinoDevice(d)
+                        for d in devices]
+
+    async def gather(self, command, *args, **kwargs):
+        results = await asyncio.gather(
+            *(getattr(d, command)(*args, **kwargs) for d in self.devices),
+            return_exceptions=True)
+        return {d.address: r for d, r in zip(self.devices, results)}
+
+    async def each(self, func):
+        # func(device_async) è una coroutine: utile per test diversi su ogni scheda
+        results = await asyncio.gather(*(func(d) for d in self.devices), return_exceptions=True)
+        return {d.address: r for d, r in zip(self.devices, results)}
+
+    def run(self, command, *args, **kwargs):
+        return asyncio.run(self.gather(command, *args, **kwargs))
@@ -11,9 +11,11 @@
 # Version: 2 (updated for 3-bit Arduino addressing)
 
 import time
+import asyncio
+from datetime import datetime
 import check_temperature
 from encoder_simulation_v3 import check_encoder_phases
-from ArduinoController_v3 import detect_devices, ArduinoDevice
+from ArduinoController_v3 import detect_devices, ArduinoDevice, ArduinoGroup, PortSupervisor, BIN_BAUDRATE
 from I2C_test_v2 import run_I2C_test
 import sys
 import threading
@@ -25,8 +27,11 @@ from send_config_PLC import send_configuration_PLC
 from check_LUT_v4 import check_camera, check_galvo
 from plc_simulator import go2Run, send_stop_request
 from cfg_mode import set_device_to_cfg
+import test_events
+from test_events import report
 
 sys.stdout.reconfigure(encoding='utf-8')    # To print special characters
+test_events.install()                       # [REPORT]/[LOG]/[BOTH] -> canale eventi del server
 
 # ==========================
 # CONFIGURAZIONE
@@ -37,13 +42,18 @@ URL_API = sys.argv[3]
 URL_BACKEND = sys.argv[4] 
 IP_PLC = sys.argv[5]
 
+# Check LUT di un modulo camera, con la durata inviata al server (gira in un thread per modulo)
+def check_camera_step(address, arduino):
+    with test_events.step("camera_lut"):
+        check_camera(address, arduino)
+
 # ==========================
 # TEST START
 # ==========================
 if __name__ == "__main__":
     print("[BOTH]======== START OF THE COMPLETE TEST ========\n")
 
-    arduinos = detect_devices()
+    arduinos = detect_devices(binary=True, baudrate=BIN_BAUDRATE)
     if MASTER_ADDRESS not in arduinos:
         print("[BOTH][ERROR] Arduino con address 0 NON trovato! Impossibile continuare.")
         sys.exit(1)
@@ -53,6 +63,12 @@ if __name__ == "__main__":
 
     print(f"[BOTH][MAIN] Uso Arduino address 0 come master (porta {arduino_main.port})")
     arduino_list = [arduinos[addr] for addr in sorted(arduinos.keys())]
+    # Stop dal server: noise fermato e uscite azzerate su tutte le schede (close)
+    test_events.on_stop(ArduinoGroup(arduino_list).run, "close")
+    # Riapre da solo le schede il cui adattatore USB si stacca durante il test
+    supervisor = PortSupervisor(arduinos).start()
+    # Offset/deriva del clock di ogni scheda: i campioni hanno l'istante host del campionamento
+    ArduinoGroup(arduino_list).run("start_clock_sync")
 
     Tmonitor_thread = threading.Thread(target=check_temperature.monitor_temperature, args=(URL_API,stop_event))
     Tmonitor_thread.daemon = True                                   # Thread ends when main program ends
@@ -61,6 +77,11 @@ if __name__ == "__main__":
     print("[BOTH]Starting noise and encoder simulation...\n")
     #arduino_main.start_encoder() 
     arduino_main.start_noise()
+    # Stream continuo dal main: serve per correlare l'encoder con i pin letti sugli altri Arduino
+    if not arduino_main.start_stream():
+        print("[LOG][MAIN] Streaming non supportato dal firmware, encoder letto in polling")
+    # Tracker dell'encoder: gli slave leggono la posizione dalla memoria, non dalla seriale del main
+    arduino_main.start_encoder_tracking()
 
     time.sleep(2)
 
@@ -72,7 +93,7 @@ if __name__ == "__main__":
         print(f"[BOTH]\033[1m\033[91mERROR\033[0m: Encoder Test Result: \033[1m\033[91mFAILED\033[0m!")
         print(f"[BOTH]{err_phase}\n")
         print("[BOTH]Exiting...")
-        print("[REPORT] Pulse | Test: Encoder Test | Result: FAILED")
+        report("Pulse", "Encoder Test", "FAILED")
         # Stopping noise and encoder simulation
         arduino_main.stop_noise()
         stop_event.set()
@@ -87,18 +108,20 @@ if __name__ == "__main__":
     else:
         print("[BOTH] \033[1m\033[92m[OK]\033[0m Encoder phases Test Result: \033[1m\033[92mPASSED\033[0m!\n")
         print("[BOTH]All phases are working correctly.\n")
-        print("[REPORT] Pulse | Test: Encoder Test | Result: PASSED")
+        report("Pulse", "Encoder Test", "PASSED")
 
     # ==========================
     # CHECK SHARED BUS PINS
     # ==========================
-    missing_cfg = arduino_main.get_missing_cfg()
-    time.sleep(0.5)
-    run_galvo_pin = arduino_main.get_run_galvo()
-    time.sleep(0.5)
-    run_pulse_pin = arduino_main.get_run_pulse()
-    time.sleep(0.5)
-    run_camera_pin = arduino_main.get_run_camera()
+    bus_state = arduino_main.get_bus_state()
+    if bus_state is None:
+        missing_cfg = run_galvo_pin = run_pulse_pin = run_camera_pin = None
+    else:
+        print(f"[LOG] Shared bus: {bus_state._asdict()}")
+        missing_cfg = bus_state.missing_cfg
+        run_galvo_pin = bus_state.run_galvo
+        run_pulse_pin = bus_state.run_pulse
+        run_camera_pin = bus_state.run_camera
     if missing_cfg is None or run_camera_pin is None or run_galvo_pin is None or run_pulse_pin is None: 
         print("[BOTH] Impossibile to read at leat one pin from the shared bus!")
 
@@ -109,7 +132,7 @@ if __name__ == "__main__":
 
     if run_pulse_pin != 1:
         print(f"[BOTH]\033[1m\033[91mERROR\033[0m: Shared pin SHARE_IO_3 (Stop_Run_Pulse) \033[1m\033[91mBROKEN\033[0m!")
-        print("[REPORT] Shared Bus | Test: SHARE_IO_3 | Result:FAILED")
+        report("Shared Bus", "SHARE_IO_3", "FAILED")
         '''Commentato per non rendere bloccante il controllo sul bus parallelo
         arduino_main.stop_noise()
         stop_event.set()
@@ -117,7 +140,7 @@ if __name__ == "__main__":
         sys.exit()'''
     if run_galvo_pin != 1:
         print(f"[BOTH]\033[1m\033[91mERROR\033[0m: Shared pin SHARE_IO_2 (Stop_Run_Galvo) \033[1m\033[91mBROKEN\033[0m!")
-        print("[REPORT] Shared Bus | Test: SHARE_IO_2 | Result:FAILED")
+        report("Shared Bus", "SHARE_IO_2", "FAILED")
         '''Commentato per non rendere bloccante il controllo sul bus parallelo
         arduino_main.stop_noise()
         stop_event.set()
@@ -125,7 +148,7 @@ if __name__ == "__main__":
         sys.exit()'''
     if run_camera_pin != 1:
         print(f"[BOTH]\033[1m\033[91mERROR\033[0m: Shared pin SHARE_IO_6 (Stop_Run_Camere) \033[1m\033[91mBROKEN\033[0m!")
-        print("[REPORT] Shared Bus | Test: SHARE_IO_6 | Result:FAILED")
+        report("Shared Bus", "SHARE_IO_6", "FAILED")
         '''Commentato per non rendere bloccante il controllo sul bus parallelo
         arduino_main.stop_noise()
         stop_event.set()
@@ -142,15 +165,17 @@ if __name__ == "__main__":
     else:
         Nmodule_camere = int(sys.argv[1])
         Nmodule_galvo = int(sys.argv[2])
-        camera_addresses, galvo_addresses = run_I2C_test(Nmodule_camere, Nmodule_galvo)
+        with test_events.step("i2c"):
+            camera_addresses, galvo_addresses = run_I2C_test(Nmodule_camere, Nmodule_galvo)
 
         addresses_C = camera_addresses[:Nmodule_camere]
         for address in addresses_C:
-            send_configuration_camera(URL_API,address)
+            with test_events.step("config_camera"):
+                send_configuration_camera(URL_API,address)
             time.sleep(10)
             if not send_config_camera.isDeviceFound:
                 print(f"[BOTH]\033[1m\033[91mERROR\033[0m: Device with address {address} not found! Exiting...")
-                print(f"[REPORT] Timing Controller {address}| Test: Device Reachable | Result: FAILED")
+                report(f"Timing Controller {address}", "Device Reachable", "FAILED", address=address)
                 # Stopping noise and encoder simulation
                 arduino_main.stop_noise()
                 sys.exit()
@@ -163,11 +188,12 @@ if __name__ == "__main__":
 
         addresses_G = galvo_addresses[:Nmodule_galvo]
         for address_G in addresses_G:
-            send_configuration_galvo(URL_API,address_G)
+            with test_events.step("config_galvo"):
+                send_configuration_galvo(URL_API,address_G)
             time.sleep(10)
             if not send_config_galvo.isGalvoFound:
                 print(f"[BOTH]\033[1m\033[91mERROR\033[0m: Device with address {address_G} not found! Exiting...")
-                print(f"[REPORT] Galvo Controller {address_G} | Test: Device Reachable | Result: FAILED")
+                report(f"Galvo Controller {address_G}", "Device Reachable", "FAILED", address=address_G)
                 # Stopping noise and encoder simulation
                 arduino_main.stop_noise()
                 sys.exit()
@@ -182,11 +208,12 @@ if __name__ == "__main__":
         # CONFIGURAZIONE DEL MODULO PULSE
         # ==========================
 
-        send_configuration_pulse(URL_API,10)                                          # Send configuration to Pulse device
+        with test_events.step("config_pulse"):
+            send_configuration_pulse(URL_API,10)                                      # Send configuration to Pulse device
         time.sleep(10)
         if not send_config_pulse.isPulseFound:
             print("[BOTH]\033[1m\033[91mERROR\033[0m: Pulse device not found! Exiting...")
-            print(f"[REPORT] Pulse | Test: Device Reachable | Result: FAILED")
+            report("Pulse", "Device Reachable", "FAILED")
             # Stopping noise and encoder simulation
             arduino_main.stop_noise()
             sys.exit()
@@ -204,21 +231,22 @@ if __name__ == "__main__":
         if missing_cfg != 1:
             print("[BOTH]\033[1m\033[91mERROR\033[0m: Missing cfg is not 1 after the configuration! Value:", missing_cfg)
             #print("[BOTH]Exiting...")
-            print("[REPORT] Shared Bus | Test: MissingCfg Functionality  Result: FAILED")
+            report("Shared Bus", "MissingCfg Functionality", "FAILED")
             '''arduino_main.stop_noise()
             stop_event.set()
             Tmonitor_thread.join()
             sys.exit()'''
         else:
             print("[BOTH]\033[1m\033[92m[OK]\033[0m Missing cfg at 1 after the configuration.")
-            print("[REPORT] Shared Bus | Test: MissingCfg Functionality | Result: PASSED")
+            report("Shared Bus", "MissingCfg Functionality", "PASSED")
 
         
         # ==========================
         # CONFIGURAZIONE DEL PLC
         # ==========================
 
-        send_configuration_PLC()
+        with test_events.step("config_plc"):
+            send_configuration_PLC()
         time.sleep(5)
         if not send_config_PLC.isPLCConfigured:
             print("[BOTH]\033[1m\033[91mERROR\033[0m: PLC configuration failed! Exiting...")
@@ -237,16 +265,20 @@ if __name__ == "__main__":
         # ==========================
 
         print("[LOG][PLC] Checking the conditions to go to RUN mode...")
-        errors = go2Run()                                                            # Send start command to backend
+        # Registro ogni commutazione dei pin del bus condiviso durante la finestra di RUN
+        arduino_main.start_bus_watch()
+        test_events.on_stop(send_stop_request)                                       # Stop dal server: backend fuori dal RUN
+        with test_events.step("go2run"):
+            errors = go2Run()                                                        # Send start command to backend
         if errors != 0:
             print("[BOTH]\033[1m\033[91mERROR\033[0m: Cannot go to RUN mode! Exiting...")
-            print("[REPORT] Pulse | Test: Go2Run | Result: FAILED")
+            report("Pulse", "Go2Run", "FAILED")
             # Stopping noise and encoder simulation
             arduino_main.stop_noise()
             send_stop_request()
             sys.exit()
         elif errors == 0:
-            print("[REPORT] Pulse | Test: Go2Run | Result: PASSED")
+            report("Pulse", "Go2Run", "PASSED")
         elif stop_event.is_set():
             print("[BOTH]\033[1m\033[91mERROR\033[0m: Temperature critical limit reached during the test! Exiting...")
             # Stopping noise and encoder simulation
@@ -266,7 +298,7 @@ if __name__ == "__main__":
         sharedpin_commutation = [name for name in ("galvo", "camera") if not events[name]]
         if sharedpin_commutation:
             print(f"[BOTH]\033[1m\033[91mERROR\033[0m: No commutation on pin: run {', '.join(sharedpin_commutation)} after going to RUN!")
-            print("[REPORT] Shared Bus | Test: RunPins Functionality | Result: FAILED")
+            report("Shared Bus", "RunPins Functionality", "FAILED")
             '''send_stop_request()  
             stop_event.set()
             arduino_main.stop_noise()
@@ -281,13 +313,14 @@ if __name__ == "__main__":
         # ==========================
 
         time.sleep(3)
-        for i, arduino in enumerate(arduino_list): 
-            if i >= len(addresses_C): 
-                break
-            camera_addr = addresses_C[i]
-            check_camera(camera_addr, arduino)
-            time.sleep(5)
-            arduino.reset_pins()
+        # Ogni modulo camera ha il suo Arduino: i check LUT girano in parallelo
+        camera_arduinos = arduino_list[:len(addresses_C)]
+        camera_addr_of = {arduino.address: addresses_C[i] for i, arduino in enumerate(camera_arduinos)}
+        camera_group = ArduinoGroup(camera_arduinos)
+        asyncio.run(camera_group.each(
+            lambda dev: asyncio.to_thread(check_camera_step, camera_addr_of[dev.address], dev.device)))
+        time.sleep(5)
+        camera_group.run("reset_pins")
         stop_event.set()
         Tmonitor_thread.join()
 
@@ -300,7 +333,8 @@ if __name__ == "__main__":
             if i >= len(addresses_G): 
                 break
             galvo_addr = addresses_G[i]
-            check_galvo(galvo_addr, arduino)
+            with test_events.step("galvo_check"):
+                check_galvo(galvo_addr, arduino)
             time.sleep(5)
         Tmonitor_thread = threading.Thread(target=check_temperature.monitor_temperature, args=(URL_API,stop_event))
         time.sleep(10)
@@ -308,6 +342,8 @@ if __name__ == "__main__":
         time.sleep(2)
         set_device_to_cfg(URL_API,10)        
         time.sleep(2)                                  
+        for transition in arduino_main.stop_bus_watch():
+            print(f"[LOG] Shared bus: {transition.name} -> {transition.level} at {datetime.fromtimestamp(transition.t).strftime('%H:%M:%S.%f')[:-3]}")
         events = arduino_main.get_bus_events()
         if not events:
             print("[BOTH]\033[1m\033[91mERROR\033[0m: Impossible to read from shared bus!")
@@ -315,18 +351,21 @@ if __name__ == "__main__":
         sharedpin_commutation = [name for name in ("galvo", "pulse", "camera") if not events[name]]
         if sharedpin_commutation:
             print(f"[BOTH]\033[1m\033[91mERROR\033[0m: No commutation on pin: run {', '.join(sharedpin_commutation)} after going to RUN!")
-            print("[REPORT] Shared Bus | Test: RunPins Functionality | Result: FAILED")
+            report("Shared Bus", "RunPins Functionality", "FAILED")
             '''stop_event.set()
             arduino_main.stop_noise()
             Tmonitor_thread.join()
             sys.exit()'''
         else:
             print("[BOTH]\033[1m\033[92m[OK]\033[0m Commutation detected on run pins after going to RUN")
-            print("[REPORT] Shared Bus | Test: RunPins Functionality | Result: PASSED")
+            report("Shared Bus", "RunPins Functionality", "PASSED")
 
         # Stopping noise and encoder simulation
         stop_event.set()
         Tmonitor_thread.join()
+        arduino_main.stop_encoder_tracking()
+        arduino_main.stop_stream()
         arduino_main.stop_noise()
 
+    supervisor.stop()
     print(f"[BOTH]======== END OF THE COMPLETE TEST ========")
\ No newline at end of file
@@ -10,11 +10,13 @@
 import time
 import socketio
 import sys
+from test_events import report
 
 ack_counter_cam = 0
 ack_counter_galvo = 0
 error_i2c = False
 connected_dev = []
+dev_address = {}                    # device_name -> address, per i report
 
 camera_addresses = []
 galvo_addresses = []
@@ -93,6 +95,7 @@ def run_I2C_test(expected_camere, expected_galvo):
         def on_device_config(data):
             print("[BOTH]Device configuration received:", device_name)
             connected_dev.append(device_name)
+            dev_address[device_name] = address
             global ack_counter_cam
             global ack_counter_galvo
             if 20 <= address <= 29:
@@ -117,7 +120,7 @@ def run_I2C_test(expected_camere, expected_galvo):
     
     print("Reachable devices: ", connected_dev)
     for dev in connected_dev:
-        print(f"[REPORT] {dev} | Test: Device Reachable | Result: PASSED")
+        report(dev, "Device Reachable", "PASSED", address=dev_address[dev])
 
     if ack_counter_cam != expected_camere:
         error_i2c = True
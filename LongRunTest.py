@@ -1,10 +1,15 @@
 import pyvisa
 from pyvisa.constants import StopBits, Parity
-from PowerSupplyController import init_serial
 import time
 import os, sys
+import fcntl
+import tempfile
+import threading
 import subprocess
 from datetime import datetime
+import test_events
+
+test_events.install()                       # [REPORT]/[LOG]/[BOTH] -> canale eventi del server
 
 # ==========================
 # CONFIGURAZIONE
@@ -20,9 +25,12 @@ URL_BACKEND = sys.argv[5]
 IP_PLC = sys.argv[6] 
 wait_before_test = 90
 
-# Alimentazioni
-CH2 = 2   # 24V
-CH3 = 3   # 8V
+# Alimentazioni: canali assegnati dal server alla postazione del test (PSU_CHANNELS=24V,8V)
+try:
+    CH2, CH3 = [int(ch) for ch in os.environ.get("PSU_CHANNELS", "2,3").split(",")]   # 24V, 8V
+except ValueError:
+    print(f"[BOTH]ERROR: PSU_CHANNELS must list two channels (24V,8V), got '{os.environ['PSU_CHANNELS']}'")
+    sys.exit()
 
 VOLTAGE_CH2 = 24
 VOLTAGE_CH3 = 8
@@ -35,8 +43,6 @@ CYCLE_TIME =  15  # tempo tra un ciclo e l'altro
 script_path = 'Complete_Test_Bucintoro_v2.py'
 error_lines = []
 
-ser = init_serial()#(port='/dev/ttyUSB0', baudrate=9600, timeout=1)
-
 # ==========================
 # POWER SUPPLY INIT
 # ==========================
@@ -56,33 +62,76 @@ psu.write_termination = '\r\n'
 psu.read_termination = '\r\n'
 psu.timeout = 2000
 
-psu.write("*IDN?")
-print("[BOTH]Connected to:", psu.read())
-
 # ==========================
 # FUNZIONI PSU
 # ==========================
 
+# Con due Bucintoro in parallelo l'alimentatore è condiviso tra i due processi:
+# ogni comando (e la sua risposta) si fa tenendo il lock del file.
+# flock non esclude i thread dello stesso processo (hook di stop): serve anche il lock locale
+psu_lock = open(os.path.join(tempfile.gettempdir(), "bucintoro_psu.lock"), "w")
+psu_thread_lock = threading.Lock()
+
+def psu_command(cmd, query=False):
+    with psu_thread_lock:
+        fcntl.flock(psu_lock, fcntl.LOCK_EX)
+        try:
+            return psu.query(cmd) if query else psu.write(cmd)
+        finally:
+            fcntl.flock(psu_lock, fcntl.LOCK_UN)
+
+print("[BOTH]Connected to:", psu_command("*IDN?", query=True))
+
+# PSU_SHARED=1 dal server quando un'altra postazione usa lo stesso alimentatore:
+# l'uscita generale non si spegne, si azzerano solo i canali di questo test
+PSU_SHARED = os.environ.get("PSU_SHARED") == "1"
+
 def set_output(state: bool):
+    if PSU_SHARED and not state:
+        set_voltage(CH2, 0)
+        set_voltage(CH3, 0)
+        return
     cmd = 1 if state else 0
-    psu.write(f"OUT{cmd}")
+    psu_command(f"OUT{cmd}")
 
 def set_voltage(channel, voltage: float):
-    psu.write(f"VSET{channel}:{voltage}")
+    psu_command(f"VSET{channel}:{voltage}")
 
 def read_current(channel):
-    val = psu.query(f"IOUT{channel}?")
+    val = psu_command(f"IOUT{channel}?", query=True)
     return float(val.replace("A","").strip())
 
 # Set current limits
-psu.write(f"ISET{CH2}:{CURRENT_LIMIT_CH2}")
-psu.write(f"ISET{CH3}:{CURRENT_LIMIT_CH3}")
+psu_command(f"ISET{CH2}:{CURRENT_LIMIT_CH2}")
+psu_command(f"ISET{CH3}:{CURRENT_LIMIT_CH3}")
 
 # Start with both channels OFF
 set_voltage(CH2, 0)
 set_voltage(CH3, 0)
 set_output(False)
 
+# Eventi di Complete_Test: inoltrati al server così come sono, le righe di errore
+# contano come failure del ciclo
+def on_cycle_event(event):
+    global failures
+    test_events.send(event)
+    if "ERROR" in event.get("text", ""):
+        print(f"[LOG]Cycle {cycle_count}: {test_events.format_line(event)}")
+        failures += 1
+
+# Stop dal server: il Complete_Test del ciclo riceve anche lui SIGTERM e ferma schede e backend,
+# si aspetta che esca (ha metà del tempo di stop) e poi si spengono le alimentazioni
+def stop_cycle():
+    if process is not None:
+        test_events.stop_process(process, CYCLE_STOP_TIMEOUT)
+    set_voltage(CH2, 0)
+    set_voltage(CH3, 0)
+    set_output(False)
+
+CYCLE_STOP_TIMEOUT = test_events.STOP_TIMEOUT / 2
+process = None
+test_events.on_stop(stop_cycle)
+
 # ==========================
 # TEST LOOP
 # ==========================
@@ -117,7 +166,7 @@ while time.time() < end_time:
         # ==========================
         # RUN CompleteTest.py
         # ==========================
-        process = subprocess.Popen(
+        process, events_reader = test_events.spawn(
             [
                 'python', '-u', script_path, 
                 str(N_camere), 
@@ -126,6 +175,8 @@ while time.time() < end_time:
                 URL_BACKEND, 
                 IP_PLC
             ],
+            on_cycle_event,
+            env=dict(os.environ, **{test_events.STOP_TIMEOUT_VAR: str(CYCLE_STOP_TIMEOUT)}),
             stdout=subprocess.PIPE,
             stderr=subprocess.STDOUT,
             text=True
@@ -140,6 +191,7 @@ while time.time() < end_time:
                 if "ERROR" in cleaned_line:
                     print(f"[LOG]Cycle {cycle_count}: {cleaned_line}")
                     failures += 1
+        events_reader.join()
 
         # POWER OFF
 
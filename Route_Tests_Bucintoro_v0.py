@@ -7,18 +7,27 @@
 # Version: 0
 
 # Import necessary libraries
-from flask import Flask, request, jsonify, send_file, render_template
+from flask import Flask, request, jsonify, send_file, render_template, Response
 from flask_socketio import SocketIO, emit
-import fitz # PyMuPDF
 import subprocess
 import os
 from datetime import datetime
-from ansi_to_html import ansi_to_html, remove_ansi_codes
 from URL import get_urls ###
+from job_manager import TestJob, JobManager, JOB_TITLES
+from report_pdf import render_report
+from results_db import ResultsStore
+from station_metrics import StationMetrics
+import time
 
 app = Flask(__name__, static_folder='static')
 socketio = SocketIO(app)
-test_in_progress = False
+# At the end of every job the PDF report is rendered once: the downloads serve that file
+def finish_job(job):
+    job.pdf_path = render_report(job)
+
+results = ResultsStore()                                  # database di tutti i test eseguiti (Bucintoro_Reports/bucintoro_results.db)
+metrics = StationMetrics()                                # contatori e istogrammi della postazione (/metrics)
+jobs = JobManager(socketio, on_finish=finish_job, store=results, metrics=metrics)         # test in esecuzione e storico dei job
 
 # HTML for the web interface
 @app.route('/')
@@ -26,31 +35,24 @@ def index():
     return render_template('Run_Tests_Bucintoro.html')
 
 # ============================
-# AUTO-LOOP TEST
+# TEST JOBS
 # ============================
 
-stop_loop_test_flag = {'stop_auto_loop_test': False}
-@app.route('/run_test_loop_bucintoro', methods=['POST'])
-def run_test_bucintoro():
-    global test_in_progress
-    global stop_loop_test_flag
-    global log_path, logContent, log_filename
-    global report_path
-    global reportContent
-    global report_filename, main_serial, camera_serials, galvo_serials
-
-    # flag for test execution: prevent from launching the test when it's already executing
-    if test_in_progress:
-        return jsonify({'output': 'Bucintoro Test already executing...'})
-    
+REPORTS_DIR = os.path.join("/home/pi/New/ScriptSara", "Bucintoro_Reports")
+
+# Builds the job for one of the test scripts from the request of the web interface and starts it
+# in background: the response (HTTP 202) only carries the job id, the browser follows the test through
+# /jobs/<id> or the Socket.IO events. Jobs on different station slots run in parallel, a job whose
+# slot, backend or PLC is busy waits in the queue.
+def start_test_job(kind, script_path, report_prefix, log_prefix, summarize=None):
     data = request.get_json()
     environment = data.get("env", "standard")           # Getting the environment from the interface (standard / custom)
-    custom_data = None 
+    custom_data = None
     print(environment)
-    if environment == "custom": 
-        custom_data = { 
-            "BACKEND_IP": data.get("BACKEND_IP"), 
-            "IP_PLC": data.get("IP_PLC") 
+    if environment == "custom":
+        custom_data = {
+            "BACKEND_IP": data.get("BACKEND_IP"),
+            "IP_PLC": data.get("IP_PLC")
             }
     urls = get_urls(environment, custom_data)           # Getting the correct URLS
     if environment == "custom":
@@ -64,462 +66,275 @@ def run_test_bucintoro():
     # Number of modules connected + serial numbers
     num_camere = data.get('numCamere', 1)
     num_galvo = data.get('numGalvo', 1)
-    main_serial = data.get('mainSerial', 1)
-    camera_serials = data.get('cameraSerials', [])
-    galvo_serials = data.get('galvoSerials', [])
+    args = [num_camere, num_galvo]
+    if kind == "longrun":
+        args.append(data.get('time2run', 60))
+    args += [urls["URL_API"], urls["URL_BACKEND"], urls["IP_PLC"]]
 
-    test_in_progress = True                     
-    stop_loop_test_flag['stop_auto_loop_test'] = False
-    script_path = 'Run_Tests_Bucintoro_v4.py'
-
-    # Setup report/log
-    full_output = ""
+    # Setup report/log (the slot is in the name: two jobs can start in the same second)
+    slot = data.get('slot') or None
     timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-    report_filename = f"Bucintoro_test_{timestamp}.txt"
-    log_filename = f"Bucintoro_log_{timestamp}.txt"
-    desktop_path = os.path.join("/home/pi/New/ScriptSara", "Bucintoro_Reports")
-    os.makedirs(desktop_path, exist_ok=True)
-    report_path = os.path.join(desktop_path, report_filename)
-    report_lines = []
-    log_path = os.path.join(desktop_path, log_filename)
-    log_lines = []
-    summary = {}
-
+    if slot:
+        timestamp = f"{slot}_{timestamp}"
+    os.makedirs(REPORTS_DIR, exist_ok=True)
+    report_path = os.path.join(REPORTS_DIR, f"{report_prefix}_{timestamp}.txt")
+    log_path = os.path.join(REPORTS_DIR, f"{log_prefix}_{timestamp}.txt")
+
+    params = {
+        'env': environment,
+        'numCamere': num_camere,
+        'numGalvo': num_galvo,
+        'mainSerial': data.get('mainSerial', 1 if kind != "longrun" else ""),
+        'cameraSerials': data.get('cameraSerials', []),
+        'galvoSerials': data.get('galvoSerials', []),
+    }
+    job = TestJob(
+        kind, script_path, args, report_path, log_path,
+        params=params,
+        log_header=log_header(params),
+        # Statistiche delle seriali Arduino (latenze, timeout...) salvate accanto al report
+        env={'ARDUINO_STATS_FILE': report_path.replace('.txt', '_arduino_stats.json')},
+        summarize=summarize,
+        slot=slot,
+        needs={f"backend:{urls['URL_BACKEND']}", f"plc:{urls['IP_PLC']}"}
+    )
     try:
-        
-        process = subprocess.Popen(
-            [
-                'python', '-u', script_path, 
-                str(num_camere), 
-                str(num_galvo), 
-                urls["URL_API"], 
-                urls["URL_BACKEND"], 
-                urls["IP_PLC"]
-            ],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT,
-            text=True
-        )
-        while True:
-            if stop_loop_test_flag['stop_auto_loop_test']:
-                process.terminate()
-                full_output += "I2C test stopped by user.\n"
-                log_lines.append("I2C test stopped by user.")
-                break
-            line = process.stdout.readline()
-            if not line and process.poll() is not None:
-                break
-            if line:
-                cleaned_line = line.strip()
-                if cleaned_line.startswith("[REPORT]"):
-                    cleaned_line = cleaned_line.replace("[REPORT]", "")
-                    cleaned_line = remove_ansi_codes(cleaned_line)
-                    report_lines.append(cleaned_line)
-                elif cleaned_line.startswith("[LOG]"):
-                    cleaned_line = cleaned_line.replace("[LOG]", "")
-                    cleaned_line = remove_ansi_codes(cleaned_line)
-                    log_lines.append(cleaned_line)
-                elif cleaned_line.startswith("[BOTH]"):
-                    cleaned_line = cleaned_line.replace("[BOTH]", "")
-                    display_line = ansi_to_html(cleaned_line)
-                    cleaned_line = remove_ansi_codes(cleaned_line)
-                    log_lines.append(cleaned_line)
-                    print(display_line)
-                    socketio.emit('test_output', {'line': display_line})
-                    socketio.sleep(0)
-                else:
-                    print(cleaned_line)
-
-    except Exception as e:
-        full_output += f"Error during execution of the test: {str(e)}\n"
-        print(full_output)
-    finally:
-        test_in_progress = False
-        logContent = "\n".join(log_lines)
-        reportContent = "\n".join(report_lines)
-    return jsonify({'output': full_output, 'reportPath': report_path, 'logPath': log_path})
+        jobs.submit(job)
+    except ValueError as e:
+        return jsonify({'output': str(e)}), 400
+    return jsonify({'jobId': job.id, 'status': job.status, 'reportPath': report_path, 'logPath': log_path}), 202
+
+# Header of the log file, written when the job starts: the log is then streamed to disk line by line
+def log_header(params):
+    header = "===== Bucintoro Test Log =====\n"
+    header += f"Main Module Serial Number:  {params['mainSerial']}\n"
+    header += "\nCamera Modules Serial Numbers:\n"
+
+    for i, serial in enumerate(params['cameraSerials'], start=1):
+        header += f"- Camera {i}: {serial}\n"
+    header += "\nGalvo Modules Serial Numbers:\n"
+
+    for i, serial in enumerate(params['galvoSerials'], start=1):
+        header += f"- Galvo {i}: {serial}\n"
+    header += "\n--------- Log Output ---------\n\n"
+    return header
+
+# Stop routes of the web interface: cancel the job started by that button (jobId in the body),
+# otherwise the last active job of that kind
+def stop_test_job(kind):
+    data = request.get_json(silent=True) or {}
+    job = jobs.get(data['jobId']) if data.get('jobId') else jobs.latest(kind=kind, active=True)
+    if job is None or not job.active:
+        return jsonify({'status': f'No {JOB_TITLES[kind]} running.'})
+    jobs.cancel(job.id)
+    return jsonify({'status': f'{job.title} stopping...', 'jobId': job.id})
+
+# Per-device / per-test PASS and FAIL counters of the long run, replaces the report of the single cycles.
+# The counters are updated at every report during the run (job.stats, also live on /jobs/<id>/stats)
+def long_run_summary(stats):
+    summary = []
+    summary.append({"type": "report", "text": "=========== LONG RUN SUMMARY ===========\n"})
+
+    for device, address, test_name, counts in stats.rows():
+        summary.append({
+            "type": "report", "device": device, "address": address, "test": test_name,
+            "result": f"PASS:{counts.passed} FAIL:{counts.failed}"
+        })
+    return summary
+
+# ============================
+# AUTO-LOOP TEST
+# ============================
+
+@app.route('/run_test_loop_bucintoro', methods=['POST'])
+def run_test_bucintoro():
+    return start_test_job("loop", 'Run_Tests_Bucintoro_v4.py', "Bucintoro_test", "Bucintoro_log")
 
 @app.route('/stop_test_loop_bucintoro', methods=['POST'])
 def stop_test_bucintoro():
-    global stop_loop_test_flag
-    stop_loop_test_flag['stop_auto_loop_test'] = True
-    return jsonify({'status': 'Bucintoro Auto Loop Test stopping...'})
+    return stop_test_job("loop")
 
 # ============================
 # COMPLETE TEST
 # ============================
 
-stop_complete_test_flag = {'stop_complete_test': False}
 @app.route('/run_complete_test_bucintoro', methods=['POST'])
 def run_complete_test_bucintoro():
-    global test_in_progress
-    global stop_complete_test_flag
-    global report_path, log_path
-    global reportContent, logContent
-    global report_filename, log_filename, main_serial, camera_serials, galvo_serials
-
-    # flag for test execution: prevent from launching the test when it's already executing
-    if test_in_progress:
-        return jsonify({'output': 'Complete Simulation Test already executing...'})
-    
-    data = request.get_json()
-    environment = data.get("env", "standard")           # Getting the environment (standard/custom)
-    print(environment)
-    custom_data = None 
-    if environment == "custom": 
-        custom_data = { 
-            "BACKEND_IP": data.get("BACKEND_IP"), 
-            "IP_PLC": data.get("IP_PLC") 
-            }
-    urls = get_urls(environment, custom_data)           # Getting the correct URLS
-    if environment == "custom":
-        plc_ip = custom_data.get("IP_PLC")
-        if plc_ip:
-            print(f"Configuring eth0 with custom IP: {plc_ip}")
-            subprocess.run(
-                ["sudo", "/home/pi/New/ScriptSara/set_custom_network.sh", plc_ip],
-                check=True
-            )
-    # Number of modules connected + serial numbers
-    num_camere = data.get('numCamere', 1)
-    num_galvo = data.get('numGalvo', 1)
-    main_serial = data.get('mainSerial', 1)
-    camera_serials = data.get('cameraSerials', [])
-    galvo_serials = data.get('galvoSerials', [])
-
-    test_in_progress = True                             
-    stop_complete_test_flag['stop_complete_test'] = False
-    script_path = 'Complete_Test_Bucintoro_v2.py'
-
-    # Setup report/log
-    full_output = ""
-    timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-    report_filename = f"Complete_Bucintoro_test_{timestamp}.txt"
-    log_filename = f"Complete_Bucintoro_log_{timestamp}.txt"
-    desktop_path = os.path.join("/home/pi/New/ScriptSara", "Bucintoro_Reports")
-    os.makedirs(desktop_path, exist_ok=True)
-    report_path = os.path.join(desktop_path, report_filename)
-    log_path =  os.path.join(desktop_path, log_filename)
-    report_lines = []
-    log_lines = []
-
-    try:
-        
-        process = subprocess.Popen(
-            [
-                'python', '-u', script_path, 
-                str(num_camere), 
-                str(num_galvo), 
-                urls["URL_API"], 
-                urls["URL_BACKEND"], 
-                urls["IP_PLC"]
-            ],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT,
-            text=True
-        )
-        while True:
-            if stop_complete_test_flag['stop_complete_test']:
-                process.terminate()
-                full_output += " \u26A0 Complete Simulation Test stopped by user.\n"
-                log_lines.append("Complete Simulation Test stopped by user.")
-                break
-            line = process.stdout.readline()
-            if not line and process.poll() is not None:
-                break
-            if line:
-                cleaned_line = line.strip()
-                if cleaned_line.startswith("[REPORT]"):
-                    cleaned_line = cleaned_line.replace("[REPORT]", "")
-                    cleaned_line = remove_ansi_codes(cleaned_line)
-                    report_lines.append(cleaned_line)
-                elif cleaned_line.startswith("[LOG]"):
-                    cleaned_line = cleaned_line.replace("[LOG]", "")
-                    cleaned_line = remove_ansi_codes(cleaned_line)
-                    log_lines.append(cleaned_line)
-                elif cleaned_line.startswith("[BOTH]"):
-                    cleaned_line = cleaned_line.replace("[BOTH]", "")
-                    display_line = ansi_to_html(cleaned_line)
-                    cleaned_line = remove_ansi_codes(cleaned_line)
-                    log_lines.append(cleaned_line)
-                    print(display_line)
-                    socketio.emit('test_output', {'line': display_line})                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                               
-                    socketio.sleep(0)
-                else:
-                    print(cleaned_line)
-
-    except Exception as e:
-        full_output += f"Error during execution of the test: {str(e)}\n"
-        print(full_output)
-    finally:
-        test_in_progress = False
-        reportContent = "\n".join(report_lines)
-        logContent = "\n".join(log_lines)
-    return jsonify({'output': full_output, 'reportPath': report_path, 'logPath': log_path})
+    return start_test_job("complete", 'Complete_Test_Bucintoro_v2.py', "Complete_Bucintoro_test", "Complete_Bucintoro_log")
 
 @app.route('/stop_complete_test_bucintoro', methods=['POST'])
 def stop_complete_test_bucintoro():
-    global stop_complete_test_flag
-    stop_complete_test_flag['stop_complete_test'] = True
-    return jsonify({'status': 'Complete Simulation Test stopping...'})
+    return stop_test_job("complete")
 
 # ============================
 # LONG RUN TEST
 # ============================
-stop_longrun_test_flag = {'stop_longrun_test': False}
+
 @app.route('/run_long_test_bucintoro', methods=['POST'])
 def run_long_test_bucintoro():
-    global test_in_progress
-    global stop_longrun_test_flag
-    global log_path, logContent, log_filename
-    global report_path, reportContent, report_filename
-    global main_serial, camera_serials, galvo_serials
-
-    # flag for test execution: prevent from launching the test when it's already executing
-    if test_in_progress:
-        return jsonify({'output': 'Long Run Test already executing...'})
-
-    data = request.get_json()
+    return start_test_job("longrun", 'LongRunTest.py', "LongRun_test", "LongRun_log", summarize=long_run_summary)
 
-    # Getting the environment (standard/custom)
-    environment = data.get("env", "standard")
-    custom_data = None
-    if environment == "custom":
-        custom_data = {
-            "BACKEND_IP": data.get("BACKEND_IP"),
-            "IP_PLC": data.get("IP_PLC")
-        }
-
-    urls = get_urls(environment, custom_data)
-
-    # Configura eth0 se custom
-    if environment == "custom":
-        plc_ip = custom_data.get("IP_PLC")
-        if plc_ip:
-            print(f"Configuring eth0 with custom IP: {plc_ip}")
-            subprocess.run(
-                ["sudo", "/home/pi/New/ScriptSara/set_custom_network.sh", plc_ip],
-                check=True
-            )
-
-    # Number of modules connected+ serial numbers
-    num_camere = data.get('numCamere', 1)
-    num_galvo = data.get('numGalvo', 1)
-    time2run = data.get('time2run', 60)
-
-    main_serial = data.get('mainSerial', "")
-    camera_serials = data.get('cameraSerials', [])
-    galvo_serials = data.get('galvoSerials', [])
-
-    # Setup report/log
-    test_in_progress = True
-    stop_longrun_test_flag['stop_longrun_test'] = False
-    script_path = 'LongRunTest.py'
-    full_output = ""
-    timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+@app.route('/stop_long_test_bucintoro', methods=['POST'])
+def stop_long_test_bucintoro():
+    return stop_test_job("longrun")
 
-    report_filename = f"LongRun_test_{timestamp}.txt"
-    log_filename = f"LongRun_log_{timestamp}.txt"
-    desktop_path = os.path.join("/home/pi/New/ScriptSara", "Bucintoro_Reports")
-    os.makedirs(desktop_path, exist_ok=True)
-    report_path = os.path.join(desktop_path, report_filename)
-    log_path = os.path.join(desktop_path, log_filename)
-    report_lines = []
-    log_lines = []
+# ============================
+# JOB STATUS / RESULTS
+# ============================
 
-    try:
-        process = subprocess.Popen(
-            [
-                'python', '-u', script_path,
-                str(num_camere),
-                str(num_galvo),
-                str(time2run),
-                urls["URL_API"],
-                urls["URL_BACKEND"],
-                urls["IP_PLC"]
-            ],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT,
-            text=True
-        )
-
-        while True:
-            if stop_longrun_test_flag['stop_longrun_test']:
-                process.terminate()
-                full_output += "\u26A0 Long Run Test stopped by user.\n"
-                log_lines.append("Long Run Test stopped by user.")
-                break
-
-            line = process.stdout.readline()
-            if not line and process.poll() is not None:
-                break
-
-            if line:
-                cleaned_line = line.strip()
-
-                if cleaned_line.startswith("[REPORT]"):
-                    cleaned_line = cleaned_line.replace("[REPORT]", "")
-                    cleaned_line = remove_ansi_codes(cleaned_line)
-                    report_lines.append(cleaned_line)
-
-                elif cleaned_line.startswith("[LOG]"):
-                    cleaned_line = cleaned_line.replace("[LOG]", "")
-                    cleaned_line = remove_ansi_codes(cleaned_line)
-                    log_lines.append(cleaned_line)
-
-                elif cleaned_line.startswith("[BOTH]"):
-                    cleaned_line = cleaned_line.replace("[BOTH]", "")
-                    display_line = ansi_to_html(cleaned_line)
-                    cleaned_line = remove_ansi_codes(cleaned_line)
-                    log_lines.append(cleaned_line)
-                    print(display_line)
-                    socketio.emit('test_output', {'line': display_line})
-                    socketio.sleep(0)
-
-                else:
-                    print(cleaned_line)
-
-    except Exception as e:
-        full_output += f"Error during execution of the Long Run Test: {str(e)}\n"
-        print(full_output)
-
-    finally:
-        test_in_progress = False
-        stats = {}  # es: {"Galvo 30": {"PASS": 2, "FAIL": 1}}
-
-        for line in report_lines:
-            if "|" not in line:
-                continue
-
-            parts = [p.strip() for p in line.split("|")]
-            if len(parts) != 3:
-                continue
-
-            device = parts[0] 
-            test_name = parts[1].replace("Test:", "").strip()                    
-            result = parts[2].replace("Result:", "").strip().upper()
-
-            if device not in stats: 
-                stats[device] = {} 
-                
-            if test_name not in stats[device]: 
-                stats[device][test_name] = {"PASS": 0, "FAIL": 0}
-
-            if result == "PASSED":
-                stats[device][test_name]["PASS"] += 1
-            elif result == "FAILED":
-                stats[device][test_name]["FAIL"] += 1
-        summary_lines = []
-        summary_lines.append("=========== LONG RUN SUMMARY ===========\n")
-
-        for device, counts in sorted(stats.items()):
-            for test_name in sorted(stats[device].keys()): 
-                counts = stats[device][test_name] 
-                summary_lines.append( 
-                    f"{device} | Test: {test_name} | Result: PASS:{counts['PASS']} FAIL:{counts['FAIL']}" 
-                )
-
-        reportContent = "\n".join(summary_lines)
-        logContent = "\n".join(log_lines)
-    return jsonify({'output': full_output, 'reportPath': report_path, 'logPath': log_path})
+@app.route('/jobs')
+def list_jobs():
+    return jsonify([job.as_dict() for job in jobs.list()])
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job.as_dict())
+
+# Report and log lines of the job; ?since=N returns only the log lines after the first N
+# so that polling clients download each line once. Only the last log lines are kept in memory:
+# 'first' tells from which line the answer starts (the whole log is in /download-log)
+@app.route('/jobs/<job_id>/results')
+def job_results(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    since = request.args.get('since', 0, type=int)
+    first, log_lines = job.log_since(since)
+    return jsonify({
+        'id': job.id,
+        'status': job.status,
+        'report': list(job.report_lines),
+        'reports': list(job.reports),
+        'log': log_lines,
+        'first': first,
+        'next': first + len(log_lines),
+    })
+
+# Station slots and the job holding each of them
+@app.route('/station')
+def station_status():
+    usage = jobs.allocator.usage()
+    return jsonify([{'slot': name, 'jobId': usage[name]} for name in jobs.allocator.slots])
+
+# Per-device / per-test statistics, updated live at every report (also pushed on the 'job_stats' event)
+@app.route('/jobs/<job_id>/stats')
+def job_stats(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify({'id': job.id, 'status': job.status, 'stats': job.stats.as_dict()})
+
+# A browser that connects or reconnects sends the next sequence number it expects for each job
+# it has already seen: it gets back the console lines it missed of those jobs and of the running ones
+@socketio.on('replay')
+def replay_console(data):
+    known = (data or {}).get('jobs') or {}
+    for job in jobs.list():
+        if job.active or job.id in known:
+            batch = jobs.console.replay(job, int(known.get(job.id, 0)))
+            if batch['lines']:
+                emit('test_output', batch)
+
+@app.route('/jobs/<job_id>/cancel', methods=['POST'])
+def cancel_job(job_id):
+    job = jobs.cancel(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify({'status': f'{job.title} stopping...' if job.active else job.status, 'jobId': job.id})
 
+# ============================
+# STATION METRICS (Prometheus)
+# ============================
 
-@app.route('/stop_long_test_bucintoro', methods=['POST'])
-def stop_long_test_bucintoro():
-    global stop_longrun_test_flag
-    stop_longrun_test_flag['stop_longrun_test'] = True
-    return jsonify({'status': 'Long Run Test stopping...'})
+# Throughput, step durations, failures, serial/HTTP latency, DUT temperature and queue depth
+# of the station in the Prometheus text format, for a local scraper
+@app.route('/metrics')
+def station_metrics():
+    return Response(metrics.render(jobs.list()), content_type='text/plain; version=0.0.4; charset=utf-8')
 
+# ============================
+# RESULTS HISTORY (SQLite)
+# ============================
 
-# Route to download the report file
+# Start of the period of the history queries: ?days=N (last N days), otherwise everything
+def history_since():
+    days = request.args.get('days', type=float)
+    return time.time() - days * 86400 if days else None
+
+# Runs newest first with PASS/FAIL counters: ?kind=loop|complete|longrun, ?serial=, ?days=, ?limit=, ?offset=
+@app.route('/history')
+def history():
+    return jsonify(results.history(
+        kind=request.args.get('kind'),
+        serial=request.args.get('serial'),
+        since=history_since(),
+        limit=min(request.args.get('limit', 50, type=int), 500),
+        offset=request.args.get('offset', 0, type=int),
+    ))
+
+# One run with the serial numbers of its modules and all its results
+@app.route('/history/<run_id>')
+def history_run(run_id):
+    run = results.run(run_id)
+    if run is None:
+        return jsonify({'error': 'Run not found'}), 404
+    return jsonify(run)
+
+# Everything known about one module: the runs it was tested in and the counters of each test
+@app.route('/serial/<serial>')
+def serial_history(serial):
+    return jsonify({
+        'serial': serial,
+        'tests': results.serial(serial, since=history_since()),
+        'runs': results.history(serial=serial, since=history_since(), limit=100),
+    })
+
+# Failed / total steps per day (?bucket=seconds), filtered by ?device=, ?test=, ?serial=, ?days=
+@app.route('/trends/failures')
+def failure_trends():
+    return jsonify(results.failure_trend(
+        device=request.args.get('device'),
+        test=request.args.get('test'),
+        serial=request.args.get('serial'),
+        since=history_since(),
+        bucket=max(request.args.get('bucket', 86400, type=int), 60),
+    ))
+
+# Job of the downloads: ?job=<id>, otherwise the last finished one
+def job_for_download():
+    job_id = request.args.get('job')
+    if job_id:
+        return jobs.get(job_id)
+    return jobs.latest(active=False)
+
+
+# Route to download the report file: the PDF rendered at the end of the job, served with
+# ETag / Last-Modified so that a repeated download is answered with 304
 @app.route('/download-report')
 def download_report():
-    global reportContent, report_path
-    pdf_path = report_path.replace('.txt', '.pdf')
-    if report_path and reportContent:
-        os.makedirs(os.path.dirname(pdf_path), exist_ok=True)
-
-        doc = fitz.open()
-        page = doc.new_page()
-        font_size = 12
-        line_height = 16
-        start_x, y = 50, 50
-        col_widths = [130, 120, 140, 110]  # Widths for Device, Serial Number, Test, Result columns
-        col_titles = ["Device", "Serial Number", "Test", "Result"]
-
-        page.insert_text((start_x, y), "========================== Bucintoro Test Report ==========================", fontsize=font_size)
-        y += line_height
-        x = start_x
-        for i, title in enumerate(col_titles):
-            page.insert_text((x, y), title, fontsize=font_size)
-            x += col_widths[i]
-        y += line_height/2
-        
-        page.draw_line((start_x, y), (start_x + sum(col_widths), y))
-        y += line_height
-
-        rows = []
-        for line in reportContent.splitlines():
-            if "|" in line:
-                parts = line.split("|")
-                if len(parts) == 3:
-                    device_name = parts[0].strip()
-                    test_name = parts[1].replace("Test:", "").strip()
-                    result = parts[2].replace("Result:", "").strip()
-                    part = device_name.split()
-                    device_id = part[-1] if part[-1].isdigit() else None
-                    # Default: se non c’è device ID numerico → usa main_serial
-                    serialN = main_serial
-                    if device_id is not None:
-                        device_id = int(device_id)
-                        # Determina se è camera o galvo
-                        if "Timing Controller" in device_name:
-                            idx = device_id - 20
-                            serial_list = camera_serials
-                        else:
-                            idx = device_id - 30
-                            serial_list = galvo_serials
-                        # Se l’indice è valido → assegna il seriale corretto
-                        if 0 <= idx < len(serial_list):
-                            serialN = serial_list[idx]
-                        else:
-                            # Se l’indice NON è valido, NON assegnare nulla
-                            # (serialN rimane main_serial SOLO se device_id non era numerico)
-                            serialN = ""
-                    rows.append([device_name, str(serialN), test_name, result])
-        rows.sort(key=lambda x: x[0])
-        for row_data in rows:
-            x = start_x
-            for i, data in enumerate(row_data):
-                page.insert_text((x, y), data, fontsize=font_size)
-                x += col_widths[i]
-            y += line_height
-        doc.save(pdf_path)
-        doc.close()
-        return send_file(pdf_path, as_attachment=True)
+    job = job_for_download()
+    if job is not None and not job.active and job.pdf_path is None and job.reports:
+        finish_job(job)                     # job finished before the PDF was rendered
+    if job is not None and job.pdf_path and os.path.exists(job.pdf_path):
+        return send_file(job.pdf_path, as_attachment=True, conditional=True, etag=True)
 
     return "Error: Report file not found.", 404
 
-# Route to download the log file
+# Route to download the log file: the file written during the run (gzip if it was rotated)
 @app.route('/download-log')
 def download_log():
-    global logContent, log_path
-    if log_path and logContent:
-        with open(log_path, 'w') as log_file:
-            log_file.write("===== Bucintoro Test Log =====\n")
-            log_file.write(f"Main Module Serial Number:  {main_serial}\n")    
-            log_file.write("\nCamera Modules Serial Numbers:\n")
-
-            for i, serial in enumerate(camera_serials, start=1):
-                log_file.write(f"- Camera {i}: {serial}\n")
-            log_file.write("\nGalvo Modules Serial Numbers:\n")
-            
-            for i, serial in enumerate(galvo_serials, start=1):
-                log_file.write(f"- Galvo {i}: {serial}\n")
-            log_file.write("\n--------- Log Output ---------\n\n")
-
-            log_file.write(logContent)
-        return send_file(log_path, as_attachment=True)
+    job = job_for_download()
+    if job is not None and job.log_file is not None:
+        filename = os.path.basename(job.log_path)
+        mimetype = 'text/plain'
+        if job.log_file.gzipped:
+            filename += '.gz'
+            mimetype = 'application/gzip'
+        return Response(job.log_file.stream(), mimetype=mimetype,
+                        headers={'Content-Disposition': f'attachment; filename={filename}'})
     return "Error: Log file not found.", 404
 
 # Run the Flask application
@@ -7,7 +7,7 @@
 
 from encoder_simulation_v3 import check_encoder_phases
 import I2C_test_v2, check_temperature
-from ArduinoController_v3 import detect_devices, ArduinoDevice
+from ArduinoController_v3 import detect_devices, ArduinoDevice, ArduinoGroup, PortSupervisor, BIN_BAUDRATE
 from I2C_test_v2 import run_I2C_test
 from gpio_autoloop_test_v8 import run_gpio_test
 from galvo_loop_test_v5 import run_galvo_test
@@ -16,6 +16,10 @@ import time
 import serial
 import sys
 import threading
+import test_events
+from test_events import report
+
+test_events.install()                       # [REPORT]/[LOG]/[BOTH] -> canale eventi del server
 
 # ==========================
 # CONFIGURAZIONE
@@ -27,7 +31,7 @@ URL_BACKEND = sys.argv[4]
 IP_PLC = sys.argv[5]
 if __name__ == "__main__":
     print("[BOTH]======== START OF THE SINGLE TESTS ========\n")
-    arduinos = detect_devices()
+    arduinos = detect_devices(binary=True, baudrate=BIN_BAUDRATE)
     if MASTER_ADDRESS not in arduinos:
         print("[BOTH][ERROR] Arduino con address 0 NON trovato! Impossibile continuare.")
         sys.exit(1)
@@ -37,6 +41,10 @@ if __name__ == "__main__":
 
     print(f"[BOTH][MAIN] Uso Arduino address 0 come master (porta {arduino_main.port})")
     arduino_list = [arduinos[addr] for addr in sorted(arduinos.keys())]
+    # Stop dal server: noise fermato e uscite azzerate su tutte le schede (close)
+    test_events.on_stop(ArduinoGroup(arduino_list).run, "close")
+    # Riapre da solo le schede il cui adattatore USB si stacca durante il test
+    supervisor = PortSupervisor(arduinos).start()
     
     Tmonitor_thread = threading.Thread(target=check_temperature.monitor_temperature, args=(URL_API,stop_event))
     Tmonitor_thread.daemon = True                                # Thread ends when main program ends
@@ -56,7 +64,7 @@ if __name__ == "__main__":
         print(f"[BOTH]\033[1m\033[91mERROR\033[0m: Encoder Test FAILED!")
         print(f"[BOTH]{err_phase}\n")
         print("[BOTH]Exiting...")
-        print("[REPORT] Pulse | Test: Encoder Test | Result: FAILED")
+        report("Pulse", "Encoder Test", "FAILED")
         # Stopping noise and encoder simulation
         arduino_main.stop_noise()
         Tmonitor_thread.join()
@@ -70,18 +78,20 @@ if __name__ == "__main__":
     else:
         print("[BOTH] \033[1m\033[92m[OK]\033[0m Encoder phases Test Result: \033[1m\033[92mPASSED\033[0m!\n")
         print("[BOTH]All phases are working correctly.\n")
-        print("[REPORT] Pulse | Test: Encoder Test | Result: PASSED")
+        report("Pulse", "Encoder Test", "PASSED")
 
     # ==========================
     # CHECK SHARED BUS PINS
     # ==========================
-    missing_cfg = arduino_main.get_missing_cfg()
-    time.sleep(0.5)
-    run_galvo_pin = arduino_main.get_run_galvo()
-    time.sleep(0.5)
-    run_pulse_pin = arduino_main.get_run_pulse()
-    time.sleep(0.5)
-    run_camera_pin = arduino_main.get_run_camera()
+    bus_state = arduino_main.get_bus_state()
+    if bus_state is None:
+        missing_cfg = run_galvo_pin = run_pulse_pin = run_camera_pin = None
+    else:
+        print(f"[LOG] Shared bus: {bus_state._asdict()}")
+        missing_cfg = bus_state.missing_cfg
+        run_galvo_pin = bus_state.run_galvo
+        run_pulse_pin = bus_state.run_pulse
+        run_camera_pin = bus_state.run_camera
     if missing_cfg is None or run_camera_pin is None or run_galvo_pin is None or run_pulse_pin is None: 
         print("[BOTH] Impossibile to read at leat one pin from the shared bus!")
 
@@ -92,7 +102,7 @@ if __name__ == "__main__":
 
     if run_pulse_pin != 1:
         print(f"[BOTH]\033[1m\033[91mERROR\033[0m: Shared pin SHARE_IO_3 (Stop_Run_Pulse) \033[1m\033[91mBROKEN\033[0m!")
-        print("[REPORT] Shared Bus | Test: SHARE_IO_3 | Result:FAILED")
+        report("Shared Bus", "SHARE_IO_3", "FAILED")
         '''Commentato per non rendere bloccante il controllo sul bus parallelo
         arduino_main.stop_noise()
         stop_event.set()
@@ -100,7 +110,7 @@ if __name__ == "__main__":
         sys.exit()'''
     if run_galvo_pin != 1:
         print(f"[BOTH]\033[1m\033[91mERROR\033[0m: Shared pin SHARE_IO_2 (Stop_Run_Galvo) \033[1m\033[91mBROKEN\033[0m!")
-        print("[REPORT] Shared Bus | Test: SHARE_IO_2 | Result:FAILED")
+        report("Shared Bus", "SHARE_IO_2", "FAILED")
         ''' Commentato per non rendere bloccante il controllo sul bus parallelo
         arduino_main.stop_noise()
         stop_event.set()
@@ -108,7 +118,7 @@ if __name__ == "__main__":
         sys.exit()'''
     if run_camera_pin != 1:
         print(f"[BOTH]\033[1m\033[91mERROR\033[0m: Shared pin SHARE_IO_6 (Stop_Run_Camere) \033[1m\033[91mBROKEN\033[0m!")
-        print("[REPORT] Shared Bus | Test: SHARE_IO_6 | Result:FAILED")
+        report("Shared Bus", "SHARE_IO_6", "FAILED")
         '''Commentato per non rendere bloccante il controllo sul bus parallelo
         arduino_main.stop_noise()
         stop_event.set()
@@ -133,7 +143,8 @@ if __name__ == "__main__":
     else:
         Nmodule_camere = int(sys.argv[1])
         Nmodule_galvo = int(sys.argv[2])
-        camera_addresses, galvo_addresses = run_I2C_test(Nmodule_camere, Nmodule_galvo)
+        with test_events.step("i2c"):
+            camera_addresses, galvo_addresses = run_I2C_test(Nmodule_camere, Nmodule_galvo)
         time.sleep(20)
         if I2C_test_v2.error_i2c:
             print("[BOTH]\033[1m\033[91mERROR\033[0m: I2C Test FAILED! Exiting...")
@@ -153,7 +164,8 @@ if __name__ == "__main__":
                 break               # non ci sono più moduli camera da testare
             print("[BOTH]\n") 
             camera_addr = addresses_C[i]
-            run_gpio_test(URL_BACKEND,camera_addr, arduino)
+            with test_events.step("gpio_autoloop"):
+                run_gpio_test(URL_BACKEND,camera_addr, arduino)
             time.sleep(150)
             arduino.reset_pins()
         
@@ -168,12 +180,14 @@ if __name__ == "__main__":
                 break
             print("[BOTH]\n")
             galvo_addr = addresses_G[i]
-            run_galvo_test(URL_BACKEND,galvo_addr,arduino)
+            with test_events.step("galvo_loop"):
+                run_galvo_test(URL_BACKEND,galvo_addr,arduino)
             time.sleep(20)
             
     # Stopping Noise and Encoder simulation
     stop_event.set()
     Tmonitor_thread.join()
     arduino_main.stop_noise()
+    supervisor.stop()
 
     print("[BOTH]======== END OF THE AUTOLOOP TEST ========")
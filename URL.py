@@ -4,6 +4,7 @@
 # Date: 2025-10-20
 
 import requests
+import test_events
 
 # URL.py
 # Centralized configuration for all Bucintoro environments.
@@ -41,6 +42,7 @@ def get_urls(env: str, custom_data=None):
 def get_main_status(URL_API):
     try:
         response = requests.get(URL_API)
+        test_events.metric("http_duration_seconds", response.elapsed.total_seconds(), endpoint="main_status")
         if response.status_code == 200:
             main_status = response.json()
             #print("Main status received:", data)
@@ -49,5 +51,6 @@ def get_main_status(URL_API):
             print(f"Error fetching main status: {response.status_code}")
             return None
     except requests.exceptions.RequestException as e:
+        test_events.metric("http_duration_seconds", None, endpoint="main_status")
         print(f"Request error: {e}")
         return None
\ No newline at end of file
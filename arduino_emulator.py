@@ -0,0 +1,377 @@
+# Emulatore del firmware Arduino (ATmega) usato dai test Bucintoro, su pseudo-terminale (pty)
+# Permette di eseguire ArduinoController_v3, check_LUT_v4 e gpio_autoloop_test senza il banco fisico:
+# ogni scheda emulata apre un pty e risponde agli stessi comandi del firmware reale
+# (testo, frame binari, streaming e snapshot), con un encoder simulato in rotazione,
+# LUT dei pin configurabile, guasti iniettabili (corti, pin aperti, latenza, righe perse)
+# e ritmo di trasmissione limitato dal baudrate.
+# Uso:
+#   python arduino_emulator.py --boards 3 --dir /tmp/arduino_emu
+#   export ARDUINO_PORT_GLOB="/tmp/arduino_emu/ttyUSB*"      (poi detect_devices() trova le schede emulate)
+# Date: 2026-10-18
+# Version: 0
+
+import os
+import pty
+import tty
+import json
+import time
+import random
+import struct
+import argparse
+import threading
+
+from ArduinoController_v3 import (_encode_frame, FRAME_PINS, FRAME_ANGLES, FRAME_ENC,
+                                  FRAME_SAMPLE, FRAME_SNAPSHOT, ENCODER_COUNTS, TEXT_BAUDRATE)
+
+# Stessa LUT di check_LUT_v4: intervallo encoder -> ingresso Arduino attivo
+DEFAULT_LUT = [
+    ((1, 10), 0), ((13, 23), 2), ((26, 36), 5), ((39, 49), 8), ((52, 62), 1), ((65, 75), 3),
+    ((78, 88), 6), ((91, 101), 9), ((104, 114), 12), ((117, 127), 4), ((130, 140), 7),
+    ((143, 153), 10), ((156, 166), 13), ((169, 179), 14), ((182, 192), 17), ((195, 204), 11),
+    ((207, 216), 24), ((219, 228), 15), ((231, 240), 18), ((243, 252), 20), ((255, 264), 25),
+    ((267, 276), 16), ((279, 288), 19), ((291, 300), 21), ((303, 312), 26), ((315, 324), 29),
+    ((327, 336), 22), ((339, 348), 27), ((351, 360), 30), ((363, 372), 23), ((375, 384), 28),
+    ((387, 396), 31),
+]
+
+# Parola SPI inviata dal modulo Galvo per intervallo encoder (galvo_lut di check_LUT_v4)
+DEFAULT_GALVO_LUT = [((0, 50), 32767), ((140, 190), 28993), ((260, 280), 30000)]
+
+# Uscite Arduino (SET_OUTPUT n) -> indice ingresso del modulo camera
+OUTPUT_PIN_MAP = {2: 0, 3: 1, 4: 2, 5: 3, 6: 4, 7: 5, 8: 6, 9: 7, 10: 8, 11: 9, 12: 10, 13: 11}
+
+
+# ================== BANCO SIMULATO ==================
+class EmulatedRig:
+    # Stato condiviso tra le schede: encoder che ruota e pin del bus condiviso
+    def __init__(self, rpm=60.0):
+        self.rpm = rpm
+        self.t0 = time.time()
+        self.encoder_running = True
+        self.frozen_pos = 0
+        self.bus = {"missing_cfg": 0, "run_galvo": 1, "run_pulse": 1, "run_camera": 1}
+        self.bus_events = {"galvo": 0, "pulse": 0, "camera": 0}
+        self.bus_watchers = set()       # schede con START_BUS_WATCH attivo
+        self.lock = threading.Lock()
+
+    def encoder_pos(self):
+        if not self.encoder_running:
+            return self.frozen_pos
+        counts_per_s = self.rpm / 60.0 * ENCODER_COUNTS
+        return int((time.time() - self.t0) * counts_per_s) % ENCODER_COUNTS
+
+    def set_bus_pin(self, name, value):
+        # Ogni commutazione di un pin RUN incrementa il contatore eventi (come il firmware)
+        with self.lock:
+            changed = self.bus.get(name) != value
+            if changed and name.startswith("run_"):
+                self.bus_events[name[len("run_"):]] += 1
+            self.bus[name] = value
+            watchers = list(self.bus_watchers) if changed else []
+        for board in watchers:
+            board._send(f"BUSEV:{name.upper()}:{value}:{board.micros()}", droppable=False)
+
+
+class EmulatedArduino:
+    def __init__(self, rig, address, lut=None, galvo_lut=None, link=None):
+        self.rig = rig
+        self.address = address
+        self.lut = DEFAULT_LUT if lut is None else lut
+        self.galvo_lut = DEFAULT_GALVO_LUT if galvo_lut is None else galvo_lut
+        self.baudrate = TEXT_BAUDRATE
+        self.binary = False
+        self.noise = False
+        self.spi = False
+        self.outputs = 0                 # uscite Arduino attive (SET_OUTPUT)
+        self.static_inputs = 0           # ingressi forzati da chi usa l'emulatore
+        self.stream_period = None
+        self.t_boot = time.time()
+        # Guasti iniettabili
+        self.shorts = []                 # coppie (a, b): se a è attivo lo è anche b
+        self.opens = set()               # ingressi sempre a 0
+        self.latency = 0.0               # ritardo (s) prima di ogni risposta
+        self.drop_rate = 0.0             # probabilità di perdere una risposta
+        self.clock_ppm = 0.0             # deriva del quarzo rispetto all'host
+        self.commands = 0
+
+        self.link = link
+        self._write_lock = threading.Lock()
+        self._open_pty()
+
+    def _open_pty(self):
+        self.master_fd, slave_fd = pty.openpty()
+        tty.setraw(slave_fd)
+        self._slave_fd = slave_fd        # tenuto aperto: il pty resta valido tra un'apertura e l'altra
+        self.port = os.ttyname(slave_fd)
+        if self.link:
+            if os.path.lexists(self.link):
+                os.remove(self.link)
+            os.symlink(self.port, self.link)
+            self.port = self.link
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._serve, daemon=True,
+                                        name=f"emu-arduino{self.address}")
+        self._thread.start()
+
+    # --- Stato simulato ---
+    def micros(self):
+        return int((time.time() - self.t_boot) * (1 + self.clock_ppm * 1e-6) * 1e6) & 0xFFFFFFFF
+
+    def input_mask(self):
+        mask = self.static_inputs
+        if self.noise:
+            pos = self.rig.encoder_pos()
+            for (start, end), pin in self.lut:
+                if start <= pos <= end:
+                    mask |= 1 << pin
+        for a, b in self.shorts:
+            if mask >> a & 1 or mask >> b & 1:
+                mask |= (1 << a) | (1 << b)
+        for pin in self.opens:
+            mask &= ~(1 << pin)
+        return mask & 0xFFFFFFFF
+
+    def camera_inputs(self):
+        # Maschera degli ingressi del modulo camera pilotati dalle uscite Arduino
+        return sum(1 << in_pin for out_pin, in_pin in OUTPUT_PIN_MAP.items()
+                   if self.outputs >> out_pin & 1)
+
+    def spi_word(self):
+        # (parola, numero di bit): 0 bit se lo SPI non è attivo o fuori dagli intervalli
+        if not self.spi:
+            return 0, 0
+        pos = self.rig.encoder_pos()
+        for (start, end), word in self.galvo_lut:
+            if start <= pos <= end:
+                return word, 16
+        return 0, 0
+
+    def sample_payload(self):
+        word, nbits = self.spi_word()
+        return struct.pack("<IIHBH", self.micros(), self.input_mask(), word, nbits,
+                           self.rig.encoder_pos())
+
+    # --- I/O ---
+    def _send(self, data, droppable=True):
+        if isinstance(data, str):
+            data = (data + "\r\n").encode()
+        if droppable and self.drop_rate and random.random() < self.drop_rate:
+            return
+        if self.latency:
+            time.sleep(self.latency)
+        with self._write_lock:
+            # 10 bit per byte (start + 8 + stop) al baudrate corrente
+            time.sleep(len(data) * 10 / self.baudrate)
+            try:
+                os.write(self.master_fd, data)
+            except OSError:
+                self._stop.set()
+
+    def _serve(self):
+        buf = b""
+        while not self._stop.is_set():
+            try:
+                data = os.read(self.master_fd, 256)
+            except OSError:
+                return
+            buf += data
+            while b"\n" in buf:
+                line, buf = buf.split(b"\n", 1)
+                # Il comando è completo solo dopo l'ultimo byte, al baudrate corrente
+                time.sleep((len(line) + 1) * 10 / self.baudrate)
+                line = line.decode("ascii", errors="ignore").strip()
+                if line:
+                    self.commands += 1
+                    self.handle(line)
+
+    def _stream_loop(self):
+        while not self._stop.is_set():
+            period = self.stream_period
+            if period is None:
+                return
+            if self.binary:
+                self._send(_encode_frame(FRAME_SAMPLE, self.sample_payload()), droppable=False)
+            else:
+                t, mask, word, nbits, enc = struct.unpack("<IIHBH", self.sample_payload())
+                self._send(f"SMP:{t};{mask};{word};{nbits};{enc}", droppable=False)
+            time.sleep(period)
+
+    # --- Comandi del firmware ---
+    def handle(self, line):
+        cmd, _, arg = line.partition(" ")
+        rig = self.rig
+        if cmd == "GET_ADDRESS":
+            self._send(f"ADDRESS:{self.address}")
+        elif cmd == "START_NOISE":
+            self.noise = True
+            self._send("ACK:Noise AVVIATO")
+        elif cmd == "STOP_NOISE":
+            self.noise = False
+            self._send("ACK:Noise FERMATO")
+        elif cmd == "START_ENCODER":
+            rig.encoder_running = True
+            self._send("ACK:Encoder AVVIATO")
+        elif cmd == "STOP_ENCODER":
+            rig.frozen_pos = rig.encoder_pos()
+            rig.encoder_running = False
+            self._send("ACK:Encoder FERMATO")
+        elif cmd == "GET_ENCODER_POS":
+            if self.binary:
+                self._send(_encode_frame(FRAME_ENC, struct.pack("<H", rig.encoder_pos())))
+            else:
+                self._send(f"ENC:{rig.encoder_pos()}")
+        elif cmd == "GET_INPUT_PINS":
+            mask = self.input_mask()
+            if self.binary:
+                self._send(_encode_frame(FRAME_PINS, struct.pack("<I", mask)))
+            else:
+                inputs = [mask >> i & 1 for i in range(32)]
+                self._send("INPUT:" + json.dumps({"inputs": inputs}, separators=(",", ":")))
+        elif cmd == "SET_OUTPUT":
+            self.outputs |= 1 << int(arg)
+        elif cmd == "RESET_OUTS":
+            self.outputs = 0
+        elif cmd == "START_SPI":
+            self.spi = True
+            self._send("ACK:SPI AVVIATO")
+        elif cmd == "STOP_SPI":
+            self.spi = False
+            self._send("ACKSPI FERMATO")
+        elif cmd == "GET_ANGLES":
+            word, nbits = self.spi_word()
+            if self.binary:
+                self._send(_encode_frame(FRAME_ANGLES, struct.pack("<HB", word, nbits)))
+            else:
+                self._send("ANGLES:" + (format(word, "016b") if nbits else "NULL"))
+        elif cmd == "GET_SNAPSHOT":
+            if self.binary:
+                self._send(_encode_frame(FRAME_SNAPSHOT, self.sample_payload()))
+            else:
+                t, mask, word, nbits, enc = struct.unpack("<IIHBH", self.sample_payload())
+                self._send(f"SNAP:{t};{mask};{word};{nbits};{enc}")
+        elif cmd == "GET_MISSING_CFG":
+            self._send(f"MISSING_CFG:{rig.bus['missing_cfg']}")
+        elif cmd in ("GET_RUN_GALVO", "GET_RUN_PULSE", "GET_RUN_CAMERA"):
+            name = cmd[len("GET_"):]
+            self._send(f"{name}:{rig.bus[name.lower()]}")
+        elif cmd == "GET_BUS_EVENTS":
+            self._send("BUS:" + json.dumps(rig.bus_events))
+        elif cmd == "GET_BUS_STATE":
+            with rig.lock:
+                state = dict(rig.bus, events=dict(rig.bus_events))
+            self._send("BUS_STATE:" + json.dumps(state))
+        elif cmd == "START_BUS_WATCH":
+            rig.bus_watchers.add(self)
+            self._send("ACK:BUS_WATCH AVVIATO", droppable=False)
+        elif cmd == "STOP_BUS_WATCH":
+            rig.bus_watchers.discard(self)
+            self._send("ACK:BUS_WATCH FERMATO", droppable=False)
+        elif cmd == "PING":
+            self._send(f"PONG:{self.micros()}", droppable=False)
+        elif cmd == "SET_PROTO":
+            mode, _, baud = arg.partition(" ")
+            self.binary = mode == "BIN"
+            self._send(f"ACK:PROTO {mode}", droppable=False)
+            if baud:
+                self.baudrate = int(baud)
+            elif mode == "TEXT":
+                self.baudrate = TEXT_BAUDRATE
+        elif cmd == "START_STREAM":
+            period_ms = int(arg) if arg else 5
+            self._send("ACK:STREAM AVVIATO", droppable=False)
+            if self.stream_period is None:
+                self.stream_period = period_ms / 1000
+                threading.Thread(target=self._stream_loop, daemon=True).start()
+            self.stream_period = period_ms / 1000
+        elif cmd == "STOP_STREAM":
+            self.stream_period = None
+            self._send("ACK:STREAM FERMATO", droppable=False)
+        # Comandi sconosciuti: il firmware non risponde
+
+    def unplug(self):
+        # Adattatore USB staccato: la porta sparisce e chi la usa riceve un errore
+        self.close()
+        if self.link and os.path.lexists(self.link):
+            os.remove(self.link)
+
+    def replug(self):
+        # Adattatore ricollegato: nuova porta sullo stesso link, scheda appena resettata
+        self.baudrate = TEXT_BAUDRATE
+        self.binary = False
+        self.noise = self.spi = False
+        self.outputs = 0
+        self.stream_period = None
+        self.t_boot = time.time()
+        self._open_pty()
+
+    def close(self):
+        self._stop.set()
+        self.stream_period = None
+        self.rig.bus_watchers.discard(self)
+        for fd in (self.master_fd, self._slave_fd):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+
+
+def start_emulated_rig(n_boards, link_dir=None, rpm=60.0, **faults):
+    # Crea il banco e n_boards schede con indirizzi 0..n-1 (0 = master).
+    # Con link_dir crea i link <link_dir>/ttyUSB<n> da usare con ARDUINO_PORT_GLOB
+    rig = EmulatedRig(rpm=rpm)
+    if link_dir:
+        os.makedirs(link_dir, exist_ok=True)
+    boards = []
+    for address in range(n_boards):
+        link = os.path.join(link_dir, f"ttyUSB{address}") if link_dir else None
+        board = EmulatedArduino(rig, address, link=link)
+        for name, value in faults.items():
+            setattr(board, name, value)
+        boards.append(board)
+    return rig, boards
+
+
+def _parse_pairs(values):
+    # "1:5" -> (1, 5)
+    return [tuple(int(v) for v in value.split(":")) for value in values]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Emulatore Arduino per i test Bucintoro")
+    parser.add_argument("--boards", type=int, default=3, help="numero di schede (address 0..N-1)")
+    parser.add_argument("--dir", default="/tmp/arduino_emu", help="cartella dei link ttyUSB*")
+    parser.add_argument("--rpm", type=float, default=60.0, help="velocità encoder simulato")
+    parser.add_argument("--lut", help="file JSON [[[start, end], pin], ...] al posto della LUT di default")
+    parser.add_argument("--short", action="append", default=[], metavar="BOARD:A:B",
+                        help="corto tra gli ingressi A e B della scheda BOARD")
+    parser.add_argument("--open", action="append", default=[], metavar="BOARD:PIN",
+                        help="ingresso PIN della scheda BOARD sempre a 0")
+    parser.add_argument("--latency", type=float, default=0.0, help="ritardo (s) prima di ogni risposta")
+    parser.add_argument("--drop-rate", type=float, default=0.0, help="probabilità di perdere una risposta")
+    parser.add_argument("--clock-ppm", type=float, default=0.0, help="deriva del clock delle schede (ppm)")
+    args = parser.parse_args()
+
+    rig, boards = start_emulated_rig(args.boards, args.dir, rpm=args.rpm,
+                                     latency=args.latency, drop_rate=args.drop_rate,
+                                     clock_ppm=args.clock_ppm)
+    if args.lut:
+        with open(args.lut) as f:
+            lut = [(tuple(rng), pin) for rng, pin in json.load(f)]
+        for board in boards:
+            board.lut = lut
+    for board_addr, a, b in _parse_pairs(args.short):
+        boards[board_addr].shorts.append((a, b))
+    for board_addr, pin in _parse_pairs(args.open):
+        boards[board_addr].opens.add(pin)
+
+    for board in boards:
+        print(f"[EMU] Arduino address {board.address} su {board.port}")
+    print(f'[EMU] export ARDUINO_PORT_GLOB="{os.path.join(args.dir, "ttyUSB*")}"')
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for board in boards:
+            board.close()
@@ -25,6 +25,8 @@ import numpy as np
 import sys
 import serial
 from plc_simulator import go2Run, send_stop_request
+from ArduinoController_v3 import PinState
+from test_events import report
 
 sys.stdout.reconfigure(encoding='utf-8')  # To print special characters
 URL_API = sys.argv[3] 
@@ -71,27 +73,32 @@ galvo_lut = [
     #{"enc": [365, 379], "galvo": 32767},
 ] 
 
+# Intervallo della LUT per ogni pin (per la tolleranza sul pin attivo)
+lut_by_pin = {entry["pin"]: entry["offset"] for entry in lut}
+
 # === Get expected pins from LUT based on encoder position ===
 def get_expected_pins(pos_encoder, active_dio, tolerance):
+    # active_dio e risultato sono PinState
 
     # 1. Match esatto per encoder
-    exact = [entry["pin"] for entry in lut
-             if entry["offset"][0] <= pos_encoder <= entry["offset"][1]]
+    exact = 0
+    for entry in lut:
+        if entry["offset"][0] <= pos_encoder <= entry["offset"][1]:
+            exact |= 1 << entry["pin"]
     if exact:
-        return exact
+        return PinState(exact)
 
     # 2. Nessun match esatto e nessun pin attivo → nessun expected
     if not active_dio:
-        return []
+        return PinState()
 
     # 3. Se c'è un solo pin attivo, usiamo quello come riferimento
-    pin = active_dio[0]
+    pin = active_dio.first()
 
     # Trova la sua entry nella LUT
-    entry = next((e for e in lut if e["pin"] == pin), None)
-    if not entry:
-        return []
-    start, end = entry["offset"]
+    if pin not in lut_by_pin:
+        return PinState()
+    start, end = lut_by_pin[pin]
 
     # Distanza dell'encoder dall'intervallo del pin attivo
     if pos_encoder < start:
@@ -103,10 +110,10 @@ def get_expected_pins(pos_encoder, active_dio, tolerance):
 
     # Se è entro la tolleranza → accettiamo quel pin
     if dist <= tolerance:
-        return [pin]
+        return PinState(1 << pin)
 
     # Altrimenti nessun expected (errore reale)
-    return []
+    return PinState()
 
 
 
@@ -126,29 +133,33 @@ def check_camera(address, arduino):
     start_time = time.time()
     while time.time() - start_time < test_duration:  # Stabilization time
         time.sleep(1)
-        pin_states, pos_encoder = arduino.output_pins()                                                                              
-        active_dio = []
-        active_dio = [i for i, state in enumerate(pin_states) if state == 1]
+        # Pin ed encoder campionati nello stesso istante: la tolleranza è l'incertezza
+        # misurata sull'encoder (0 se il latch è simultaneo sulla scheda)
+        snap = arduino.get_snapshot()
+        if snap is None or snap.enc is None:
+            print("[LOG]No snapshot received from Arduino")
+            continue
+        active_dio, pos_encoder = snap.pins, snap.enc
 
-        print(f"[LOG]Active DIO: {active_dio} at encoder position: {pos_encoder}")
-        expected_dio = get_expected_pins(pos_encoder, active_dio, tolerance=1)
+        print(f"[LOG]Active DIO: {active_dio} at encoder position: {pos_encoder} (tol {snap.enc_tol})")
+        expected_dio = get_expected_pins(pos_encoder, active_dio, tolerance=snap.enc_tol)
 
-        if set(active_dio) != set(expected_dio):
+        if active_dio != expected_dio:
             test_passed = False
             errors += 1
             error_details.append(f"At position {pos_encoder}: Expected DIO {expected_dio}, but got DIO {active_dio}")
-        elif set(active_dio) == set(expected_dio) and len(active_dio) != 0 and len(expected_dio) != 0:
+        elif active_dio:
             working_details.append(f"At position {pos_encoder}: Expected DIO {expected_dio}, got DIO {active_dio}")
         
     if test_passed:
         print("[BOTH]\033[1m\033[92m[OK]\033[0m Camera Device Test \033[1m\033[92mPASSED\033[0m!\n")
-        print(f"[REPORT] Timing Controller {address} | Test: GPIO Run | Result: PASSED")
+        report(f"Timing Controller {address}", "GPIO Run", "PASSED", address=address)
         print("[BOTH]All IO pins are working correctly.\n")
         print("[BOTH]======== END OF THE CAMERA PIN TEST ========\n")
         return None, 0, working_details
     else:
         print(f"[BOTH]\033[1m\033[91mERROR\033[0m: Camera Device Test \033[1m\033[91mFAILED\033[0m!\n")
-        print(f"[REPORT] Timing Controller {address} | Test: GPIO Run | Result: FAILED")
+        report(f"Timing Controller {address}", "GPIO Run", "FAILED", address=address)
         print(f"[BOTH]Number of errors: {errors}\n")
         print(f"[LOG]Error details: {error_details}")
         print(f"[LOG]Working details: {working_details}")
@@ -188,7 +199,8 @@ def check_galvo(address_G, arduino):
 
     while time.time() - start_time < test_duration:
         time.sleep(1)  # rate limit per non saturare Arduino
-        angles, pos_encoder = arduino.get_angles()
+        snap = arduino.get_snapshot(angles=True)
+        angles, pos_encoder = (snap.angle_bits, snap.enc) if snap else ([], None)
         print(f"[LOG]Enc {pos_encoder}, Angle: {angles}")
         if pos_encoder is None or not angles:
             no_angle_counter += 1
@@ -249,11 +261,11 @@ def check_galvo(address_G, arduino):
     # --- REPORT ---
     if test_passed and received:
         print("[BOTH]\033[1m\033[92m[OK]\033[0m Galvo Device Test: \033[1m\033[92mPASSED\033[0m!\n")
-        print(f"[REPORT] Galvo Controller {address_G} | Test: Galvo Run | Result: PASSED")
+        report(f"Galvo Controller {address_G}", "Galvo Run", "PASSED", address=address_G)
         print(f"[LOG]Working details: {working_details_G}")
     else:
         print("[BOTH]\033[1m\033[91mFAILED\033[0m Galvo Device Test\n")
-        print(f"[REPORT] Galvo Controller {address_G} | Test: Galvo Run | Result: FAILED")
+        report(f"Galvo Controller {address_G}", "Galvo Run", "FAILED", address=address_G)
         print(f"[BOTH]Number of errors: {errors}\n")
         print(f"[LOG]Error details: {error_details_G}")
         print(f"[LOG]Working details: {working_details_G}")
@@ -11,6 +11,7 @@ import time
 import threading
 import sys
 from URL import get_main_status
+import test_events
 
 #URL_API = 'http://10.10.0.25/api/v2/main_status'              # API URL for REST requests
 #stop_test = False
@@ -36,6 +37,7 @@ def monitor_temperature(URL_API, stop_event):
             continue  # If temperature data is not found, skip this iteration and try again
         
         print(f"[LOG][TEMP] Current Temperature: {temperature} °C")
+        test_events.metric("dut_temperature_celsius", temperature)
         
         if temperature >= critical_temperature:
             print(f"[BOTH][TEMP]\033[1m\033[91mCRITICAL\033[0m: Temperature {temperature} °C exceeds critical limit of {critical_temperature} °C! Stopping the test.")
@@ -6,12 +6,14 @@
 # Version: 3
 
 import requests
+import test_events
 
 # === Fetch main status from Bucintoro API ===
 # This function retrieves the main status from the Bucintoro API.
 def get_main_status(URL_API):
     try:
         response = requests.get(URL_API)
+        test_events.metric("http_duration_seconds", response.elapsed.total_seconds(), endpoint="main_status")
         if response.status_code == 200:
             main_status = response.json()
             #print("Main status received:", data)
@@ -20,6 +22,7 @@ def get_main_status(URL_API):
             print(f"[BOTH]\033[1m\033[91mERROR\033[0m fetching main status: {response.status_code}")
             return None
     except requests.exceptions.RequestException as e:
+        test_events.metric("http_duration_seconds", None, endpoint="main_status")
         print(f"Request error: {e}")
         return None
     
@@ -18,6 +18,7 @@ import socketio
 #from URL import URL_BACKEND
 import sys
 from threading import Event
+from test_events import report
 #from ArduinoController_v1 import get_angles, start_spi, stop_spi #clear_angles, 
 
 galvo_started = False
@@ -128,11 +129,11 @@ def run_galvo_test(URL_BACKEND,address_G,arduino):
                 print(f"[LOG]Angle in degrees: {degrees}")
                 if value == angle_req:
                     print("[BOTH] \033[1m\033[92m[OK]\033[0m GALVO Test Result: \033[1m\033[92mPASSED\033[0m: All pins are working correctly!")
-                    print(f"[REPORT] {device_name} | Test: Galvo Static | Result: PASSED")
+                    report(device_name, "Galvo Static", "PASSED", address=address_G)
                     end_test.set()
                 else:
                     print("[BOTH]\033[1m\033[91mERROR\033[0m: GALVO Test Result: \033[1m\033[91mFAILED\033[0m. The value received is different from the one requested!")
-                    print(f"[REPORT] {device_name} | Test: Galvo Static | Result: FAILED")
+                    report(device_name, "Galvo Static", "FAILED", address=address_G)
                     end_test.set()
             else:
                 print("Value = 0")
@@ -140,7 +141,7 @@ def run_galvo_test(URL_BACKEND,address_G,arduino):
         else:
             print("[BOTH]\033[1m\033[91mERROR\033[0m: Incomplete: Not enough bits received!")
             print("[BOTH]\033[1m\033[91mERROR\033[0m: Galvo Test Result: \033[1m\033[91mFAILED\033[0m!")
-            print(f"[REPORT] {device_name} | Test: Galvo Static | Result: FAILED")
+            report(device_name, "Galvo Static", "FAILED", address=address_G)
             end_test.set()
 
         @sio.event(namespace=device_namespace)
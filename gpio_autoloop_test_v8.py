@@ -11,6 +11,8 @@ import time
 #from URL import URL_BACKEND
 #from ArduinoController_v1 import output_pins, set_input_pin, init_serial
 from itertools import zip_longest
+from ArduinoController_v3 import PinState
+from test_events import report
 
 current_pin = None
 end_test = False
@@ -19,12 +21,12 @@ single_in_mask = 0
 def gpio_autoloop_test(active_inputs, active_outputs, flag):            # Flag = True if testing the camera output pins; Flag = False if testing the camera input pins
     global errors_gpio_out
     global errors_gpio_in
-    expected_inputs = set(active_outputs)
-    set_active_inputs = set(active_inputs)
+    # active_inputs / active_outputs sono PinState: confronti direttamente sulle maschere
+    expected_inputs = active_outputs
     
     if not expected_inputs:
         return
-    elif not set_active_inputs:
+    elif not active_inputs:
         if flag:
             errors_gpio_out += 1
             print(f"[LOG] Output pin test FAILED: Camera output pin {active_outputs} is not working!")
@@ -36,7 +38,7 @@ def gpio_autoloop_test(active_inputs, active_outputs, flag):            # Flag =
         
     #expected_inputs = set(out_pin % 12 for out_pin in active_outputs)
 
-    if not expected_inputs.intersection(set_active_inputs):
+    if not expected_inputs & active_inputs:
         if flag:
             errors_gpio_out += 1
             print(f"[LOG] Continuity test FAILED for Output {active_outputs}: No active input in Arduino corresponding to the active output!\n")
@@ -45,7 +47,7 @@ def gpio_autoloop_test(active_inputs, active_outputs, flag):            # Flag =
             errors_gpio_in += 1
             print(f"[LOG] Continuity test FAILED for Input {active_inputs}: No active input on Camera module corresponding to the active output on the Arduino!\n")
             return
-    elif len(set_active_inputs) > len(expected_inputs):
+    elif active_inputs.count() > expected_inputs.count():
         if flag:
             errors_gpio_out += 1
             print(f"[LOG] Continuity test PASSED for Output: {active_outputs}. Shortcircuit test FAILED for output. Active inputs on Arduino: {active_inputs}!\n")
@@ -54,7 +56,7 @@ def gpio_autoloop_test(active_inputs, active_outputs, flag):            # Flag =
             errors_gpio_in += 1
             print(f"[LOG] Continuity test PASSED for Input: {active_inputs}. Shortcircuit test FAILED for Input. Active inputs on Camera module: {active_inputs}!\n")
             return
-    elif set_active_inputs != expected_inputs:
+    elif active_inputs != expected_inputs:
         if flag:
             errors_gpio_out += 1
             print(f"[LOG] Continuity and Shortcircuit tests PASSED for Output {active_outputs}. Correspondence test FAILED: Active inputs do not correspond to the active outputs!")
@@ -140,10 +142,10 @@ def run_gpio_test(URL_BACKEND,address, arduino):
             sio.disconnect()
             if errors_gpio_in == 0 and errors_gpio_out == 0:
                 print(f"[BOTH]\033[1m\033[92m[OK]\033[0m GPIO Test Result: \033[1m\033[92mPASSED\033[0m for CAMERA{address}\n")
-                print(f"[REPORT] {device_name} | Test: GPIO AutoLoop | Result: PASSED")
+                report(device_name, "GPIO AutoLoop", "PASSED", address=address)
             else:
                 print(f"[BOTH]\033[1m\033[91m[ERROR]\033[0m GPIO Test Result: \033[1m\033[91mFAILED\033[0m for CAMERA{address} with {errors_gpio_out} errors on output pins and {errors_gpio_in} errors on input pins\n")
-                print(f"[REPORT] {device_name} | Test: GPIO AutoLoop | Result: FAILED")
+                report(device_name, "GPIO AutoLoop", "FAILED", address=address)
             print(f"[BOTH]====== END GPIO TEST FOR CAMERA{address} ======")
 
     # Acknowledgment for mode change
@@ -180,16 +182,15 @@ def run_gpio_test(URL_BACKEND,address, arduino):
         out_status_C = data.get("out", {}).get("mask_1", 0)
         in_status_A, pos_encoder = arduino.output_pins()
         print(f"[DEBUG] output Camera: {out_status_C}, input Arduino: {in_status_A}")
-        active_outputs_C = [i for i in range(32) if (out_status_C >> i) & 1]
-        active_inputs_A = [i for i, val in enumerate(in_status_A) if val == 1]
-        gpio_autoloop_test(active_inputs_A, active_outputs_C, True)
+        active_outputs_C = PinState(out_status_C & 0xFFFFFFFF)
+        gpio_autoloop_test(in_status_A, active_outputs_C, True)
         if single_in_mask != -1:
             out_status_A = single_in_mask
             in_status_C = data.get("in", {}).get("mask_1", 0)
             print(f"out Arduino: {out_status_A:012b}\nin Camera: {in_status_C:012b}")
             time.sleep(0.5)
-            active_outputs_A = [i for i in range(12) if (out_status_A >> i) & 1]
-            active_inputs_C = [i for i in range(12) if (in_status_C >> i) & 1] 
+            active_outputs_A = PinState(out_status_A & 0xFFF)
+            active_inputs_C = PinState(in_status_C & 0xFFF)
             gpio_autoloop_test(active_inputs_C, active_outputs_A, False)  
             single_in_mask = -1
 
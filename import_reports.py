@@ -0,0 +1,164 @@
+# One-shot import of the report files written before the results database existed
+# (Bucintoro_Reports/*_test_*.txt and the PDF reports of the old web interface) into
+# bucintoro_results.db. Runs already imported, and the runs the route server stored live,
+# are skipped, so it can be launched again after copying more reports in the folder.
+#   python import_reports.py [reports folder] [database]
+# Author: Sara Alemanno
+
+import os
+import re
+import sys
+import glob
+import time
+from datetime import datetime
+import test_events
+from results_db import ResultsStore, serial_number, DB_PATH
+
+REPORTS_DIR = os.path.join("/home/pi/New/ScriptSara", "Bucintoro_Reports")
+
+# prefisso del report -> (tipo di job, prefisso del log)
+REPORT_KINDS = {
+    "Bucintoro_test": ("loop", "Bucintoro_log"),
+    "Complete_Bucintoro_test": ("complete", "Complete_Bucintoro_log"),
+    "LongRun_test": ("longrun", "LongRun_log"),
+}
+NAME_RE = re.compile(r"^(?P<prefix>\w+?_test)_(?:(?P<slot>[^_]+)_)?(?P<ts>\d{4}-\d{2}-\d{2}_\d{2}-\d{2}-\d{2})$")
+SUMMARY_RE = re.compile(r"PASS:(\d+)\s+FAIL:(\d+)")
+
+# ================== FILE ==================
+def parse_name(path):
+    # Bucintoro_test_[slot_]2026-03-04_10-15-00.txt -> (kind, log file, slot, timestamp)
+    name = os.path.splitext(os.path.basename(path))[0]
+    match = NAME_RE.match(name)
+    if match is None or match.group("prefix") not in REPORT_KINDS:
+        return None
+    kind, log_prefix = REPORT_KINDS[match.group("prefix")]
+    log_path = os.path.join(os.path.dirname(path), log_prefix + name[len(match.group("prefix")):] + ".txt")
+    started = datetime.strptime(match.group("ts"), "%Y-%m-%d_%H-%M-%S").timestamp()
+    return kind, log_path, match.group("slot"), started
+
+def read_log_header(path):
+    # Seriali dall'intestazione del log (vedi log_header() in Route_Tests_Bucintoro_v0.py)
+    params = {'mainSerial': "", 'cameraSerials': [], 'galvoSerials': []}
+    if not os.path.exists(path):
+        return params
+    with open(path, encoding="utf-8", errors="replace") as f:
+        for line in f:
+            if line.startswith("--------- Log Output"):
+                break
+            if line.startswith("Main Module Serial Number:"):
+                params['mainSerial'] = line.split(":", 1)[1].strip()
+            elif line.startswith("- Camera"):
+                params['cameraSerials'].append(line.split(":", 1)[1].strip())
+            elif line.startswith("- Galvo"):
+                params['galvoSerials'].append(line.split(":", 1)[1].strip())
+    return params
+
+def expand_summary(device, address, test, result):
+    # Riga del long run "PASS:x FAIL:y" -> x PASSED e y FAILED, come i report dei singoli cicli
+    match = SUMMARY_RE.search(result)
+    if match is None:
+        return [(device, address, test, result.upper())]
+    passed, failed = int(match.group(1)), int(match.group(2))
+    return [(device, address, test, "PASSED")] * passed + [(device, address, test, "FAILED")] * failed
+
+# ================== REPORT ==================
+def rows_from_text(path, kind):
+    # (device, address, test, result) dalle righe "Device | Test: X | Result: Y".
+    # Il report del long run ha i cicli e, dopo una riga vuota, il riepilogo: basta i cicli
+    rows = []
+    with open(path, encoding="utf-8", errors="replace") as f:
+        for line in f:
+            if not line.strip():
+                if kind == "longrun" and rows:
+                    break
+                continue
+            event = test_events.parse_line("[REPORT] " + line)
+            if event is None or event.get("device") is None:
+                continue
+            rows += expand_summary(event["device"], event["address"], event["test"], event["result"])
+    return rows
+
+def rows_from_pdf(path):
+    # Tabella del PDF: le colonne sono riconosciute dalla posizione dei titoli
+    # Device / Serial / Test / Result su ogni pagina (layout vecchio e nuovo)
+    import fitz # PyMuPDF
+    rows = []
+    with fitz.open(path) as doc:
+        for page in doc:
+            lines = {}
+            for x0, y0, x1, y1, word, *_ in page.get_text("words"):
+                lines.setdefault(round(y1), []).append((x0, word))
+            columns, header_y = None, None
+            for y in sorted(lines):
+                words = sorted(lines[y])
+                texts = [word for _, word in words]
+                if columns is None:
+                    if texts[:1] == ["Device"] and "Result" in texts:
+                        columns = [x for x, word in words if word in ("Device", "Serial", "Test", "Result")]
+                        header_y = y
+                    continue
+                if len(columns) != 4 or y <= header_y or texts[0] == "Page":
+                    continue
+                cells = ["", "", "", ""]
+                for x, word in words:
+                    col = max(i for i in range(4) if i == 0 or x >= columns[i] - 2)
+                    cells[col] = (cells[col] + " " + word).strip()
+                device, serial, test, result = cells
+                if not device or not result:
+                    continue
+                address = device.split()[-1]
+                address = int(address) if address.isdigit() else None
+                rows += [row + (serial,) for row in expand_summary(device, address, test, result)]
+    return rows
+
+# ================== IMPORT ==================
+def import_file(store, path):
+    info = parse_name(path)
+    if info is None:
+        return None
+    kind, log_path, slot, started = info
+    run_id = "import:" + os.path.splitext(os.path.basename(path))[0]
+    # Già importato, o registrato dal server durante il test (id = uuid del job, stesso report)
+    if store.has_run(run_id) or store.has_report(path) or store.has_report(path[:-4] + ".txt"):
+        return 0
+    params = read_log_header(log_path)
+    if path.endswith(".pdf"):
+        rows = rows_from_pdf(path)
+    else:
+        rows = [row + (serial_number(params, row[0], row[1]),) for row in rows_from_text(path, kind)]
+    store.start_run(run_id, kind, params, started, slot=slot, status="imported",
+                    report_path=path, log_path=log_path if os.path.exists(log_path) else None)
+    for device, address, test, result, serial in rows:
+        store.add_result(run_id, {"ts": started, "device": device, "address": address, "test": test,
+                                  "result": result}, serial)
+    store.finish_run(run_id, "imported", os.path.getmtime(path))
+    return len(rows)
+
+def import_reports(reports_dir=REPORTS_DIR, db_path=DB_PATH):
+    store = ResultsStore(db_path)
+    # Percorsi assoluti, come il report_path dei test registrati dal server
+    reports_dir = os.path.abspath(reports_dir)
+    texts = set(glob.glob(os.path.join(reports_dir, "*_test_*.txt")))
+    # PDF dei test precedenti al report .txt (vecchia interfaccia): solo se il .txt non c'è
+    pdfs = {path for path in glob.glob(os.path.join(reports_dir, "*_test_*.pdf"))
+            if path[:-4] + ".txt" not in texts}
+    runs = results = 0
+    start = time.time()
+    for path in sorted(texts | pdfs):
+        try:
+            count = import_file(store, path)
+        except Exception as e:
+            print(f"[LOG] Error importing {path}: {e}")
+            continue
+        if count:
+            runs += 1
+            results += count
+            print(f"[LOG] {os.path.basename(path)}: {count} results")
+    store.close()
+    print(f"[LOG] Imported {runs} runs, {results} results in {time.time() - start:.1f}s into {db_path}")
+
+
+if __name__ == "__main__":
+    import_reports(sys.argv[1] if len(sys.argv) > 1 else REPORTS_DIR,
+                   sys.argv[2] if len(sys.argv) > 2 else DB_PATH)
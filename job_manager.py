@@ -0,0 +1,465 @@
+# Background job manager for the Bucintoro test routes.
+# Every test run is a TestJob: the HTTP request that starts it returns the job id at once,
+# the test script runs in a Socket.IO background task and the browser follows it through
+# /jobs/<id> (polling) or the 'job_status' and 'test_output' Socket.IO events.
+# The script sends its reports and console lines as JSON events on a dedicated pipe
+# (test_events.py); stdout is only read for processes that still print prefixed text.
+# Author: Sara Alemanno
+
+import os
+import glob
+import signal
+import json
+import time
+import uuid
+import threading
+import subprocess
+from collections import OrderedDict, deque
+from ansi_to_html import ansi_to_html, remove_ansi_codes
+import test_events
+from run_files import RunFile
+from report_stats import ReportStats
+from results_db import serial_number
+
+JOB_HISTORY = 50            # finished jobs kept in memory for status/results/downloads
+
+# Console lines are sent to the browsers in batches: one 'test_output' message per job
+# every CONSOLE_BATCH_INTERVAL seconds, or as soon as CONSOLE_BATCH_LINES lines are waiting
+CONSOLE_BATCH_INTERVAL = 0.25
+CONSOLE_BATCH_LINES = 200
+CONSOLE_REPLAY_LINES = 2000 # rendered console lines kept per job for browsers that join late
+
+LOG_TAIL = 1000             # last log lines kept in memory for /jobs/<id>/results, the rest is on disk
+
+# A cancelled test gets SIGTERM and runs its stop hooks (test_events.on_stop) within
+# test_events.STOP_TIMEOUT seconds; if it is still alive CANCEL_TIMEOUT seconds after the
+# signal, its whole process group is killed
+CANCEL_TIMEOUT = test_events.STOP_TIMEOUT + 1.0
+
+# Station slots: one slot per Bucintoro under test, with the Arduino ports (paths or glob patterns)
+# and the power supply channels (24V, 8V) wired to it. The station file overrides the default
+# single slot, e.g. {"A": {"arduino_ports": ["/dev/serial/by-path/...-usb-0:1.1:1.0-port0", ...],
+# "psu_channels": [2, 3]}, "B": {...}}
+STATION_FILE = os.environ.get("BUCINTORO_STATION_FILE",
+                              os.path.join(os.path.dirname(os.path.abspath(__file__)), "station.json"))
+DEFAULT_SLOTS = {
+    "A": {"arduino_ports": [os.environ.get("ARDUINO_PORT_GLOB", "/dev/ttyUSB*")], "psu_channels": [2, 3]},
+}
+
+JOB_TITLES = {
+    "loop": "Bucintoro Auto Loop Test",
+    "complete": "Complete Simulation Test",
+    "longrun": "Long Run Test",
+}
+
+
+def load_station_slots():
+    try:
+        with open(STATION_FILE) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return dict(DEFAULT_SLOTS)
+
+def slot_patterns(slot):
+    patterns = slot.get("arduino_ports", [])
+    return [patterns] if isinstance(patterns, str) else list(patterns)
+
+
+# Assigns the station resources to the jobs: a job gets a slot (its Arduinos and PSU channels)
+# plus the shared resources it asks for (backend and PLC IP). Two jobs run together only if
+# none of their resources overlap, otherwise the second one waits in the queue.
+class ResourceAllocator:
+    def __init__(self, slots=None):
+        self.slots = slots if slots is not None else load_station_slots()
+        self.owner = {}                     # resource -> job id
+
+    def _slot_resources(self, name):
+        # Ports present now (the same adapter may appear under more names, e.g. by-path links)
+        # plus the patterns themselves, so that two slots with the same pattern always overlap
+        slot = self.slots[name]
+        patterns = slot_patterns(slot)
+        resources = {f"slot:{name}"}
+        resources.update(f"arduino:{pattern}" for pattern in patterns)
+        resources.update(f"arduino:{os.path.realpath(port)}" for pattern in patterns for port in glob.glob(pattern))
+        resources.update(f"psu:{ch}" for ch in slot.get("psu_channels", []))
+        return resources, patterns
+
+    def try_acquire(self, job):
+        names = [job.slot] if job.slot else list(self.slots)
+        for name in names:
+            resources, patterns = self._slot_resources(name)
+            resources.update(job.needs)
+            if any(res in self.owner for res in resources):
+                continue
+            for res in resources:
+                self.owner[res] = job.id
+            job.slot = name
+            job.resources = resources
+            job.env["ARDUINO_PORTS"] = ",".join(patterns)
+            channels = self.slots[name].get("psu_channels")
+            if channels:
+                job.env["PSU_CHANNELS"] = ",".join(str(ch) for ch in channels)
+                # The test leaves the PSU output on at the end only if another slot is wired to it
+                if any(other != name and slot.get("psu_channels") for other, slot in self.slots.items()):
+                    job.env["PSU_SHARED"] = "1"
+            return True
+        return False
+
+    def release(self, job):
+        for res in job.resources:
+            if self.owner.get(res) == job.id:
+                del self.owner[res]
+        job.resources = set()
+
+    def usage(self):
+        return {name: self.owner.get(f"slot:{name}") for name in self.slots}
+
+
+# Collects the console lines of the jobs and emits them as
+# {'job': id, 'seq': number of the first line, 'lines': [...]}: the sequence numbers
+# let the browser notice lost batches (e.g. after a Socket.IO reconnection).
+# The last rendered lines of each job stay in job.console_ring, so a browser that
+# connects (or reconnects) during the test gets them back with replay().
+class ConsoleBatcher:
+    def __init__(self, socketio, interval=CONSOLE_BATCH_INTERVAL, max_lines=CONSOLE_BATCH_LINES):
+        self.socketio = socketio
+        self.interval = interval
+        self.max_lines = max_lines
+        self.pending = {}                   # job id -> batch not yet sent
+        self._lock = threading.Lock()
+        self._started = False
+
+    def add(self, job, line):
+        with self._lock:
+            seq = job.console_seq
+            job.console_seq += 1
+            job.console_ring.append(line)
+            batch = self.pending.setdefault(job.id, {'job': job.id, 'seq': seq, 'lines': []})
+            batch['lines'].append(line)
+            full = len(batch['lines']) >= self.max_lines
+            if full:
+                del self.pending[job.id]
+            if not self._started:
+                self._started = True
+                self.socketio.start_background_task(self._loop)
+        if full:
+            self.socketio.emit('test_output', batch)
+
+    def flush(self, job_id=None):
+        with self._lock:
+            if job_id is None:
+                batches = list(self.pending.values())
+                self.pending.clear()
+            else:
+                batch = self.pending.pop(job_id, None)
+                batches = [batch] if batch else []
+        for batch in batches:
+            self.socketio.emit('test_output', batch)
+
+    def replay(self, job, since=0):
+        # Lines from sequence number since on that are still in the ring (the batches not
+        # yet sent included: the browser drops what it receives twice)
+        with self._lock:
+            first = job.console_seq - len(job.console_ring)
+            start = max(since, first)
+            lines = list(job.console_ring)[start - first:]
+        return {'job': job.id, 'seq': start, 'lines': lines, 'replay': True}
+
+    def _loop(self):
+        while True:
+            self.socketio.sleep(self.interval)
+            self.flush()
+
+
+class TestJob:
+    def __init__(self, kind, script, args, report_path, log_path, params=None, env=None, summarize=None,
+                 slot=None, needs=(), log_header=""):
+        self.id = uuid.uuid4().hex[:12]
+        self.kind = kind
+        self.title = JOB_TITLES.get(kind, kind)
+        self.script = script
+        self.args = [str(arg) for arg in args]
+        self.env = env or {}
+        self.params = params or {}              # serial numbers, number of modules, environment
+        self.report_path = report_path
+        self.log_path = log_path
+        self.log_header = log_header
+        self.report_file = None                 # RunFile, open while the job runs
+        self.pdf_path = None                    # PDF report, rendered once at the end of the job
+        self.log_file = None
+        self.summarize = summarize              # ReportStats -> report events at the end of the job
+        self.slot = slot                        # requested station slot, None = first free one
+        self.needs = set(needs)                 # shared resources, e.g. "backend:10.10.0.25"
+        self.resources = set()                  # resources held while running
+        self.status = "queued"                  # queued, running, finished, failed, cancelled
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.returncode = None
+        self.output = ""                        # messages for the web interface (errors, stop)
+        # Report events (device, address, test, result). A job with summarize (long run) keeps
+        # only the statistics while it runs: its single reports are in the report file
+        self.reports = []
+        self.report_lines = []
+        self.stats = ReportStats()
+        self.log_tail = deque(maxlen=LOG_TAIL)
+        self.log_count = 0                      # log lines written so far
+        self.console_ring = deque(maxlen=CONSOLE_REPLAY_LINES)  # rendered console lines (HTML)
+        self.console_seq = 0                    # sequence number of the next console line
+        self.metrics = {}
+        self.progress = {"lines": 0, "reports": 0, "passed": 0, "failed": 0, "last_step": ""}
+        self.cancel_requested = False
+        self.process = None
+
+    def log(self, line):
+        if self.log_file is not None:
+            self.log_file.write_line(line)
+        self.log_tail.append(line)
+        self.log_count += 1
+
+    def log_since(self, index):
+        # Log lines from number index on that are still in memory, and the number of the first one
+        first = self.log_count - len(self.log_tail)
+        start = max(index, first)
+        return start, list(self.log_tail)[start - first:]
+
+    @property
+    def active(self):
+        return self.status in ("queued", "running")
+
+    def as_dict(self):
+        end = self.finished or time.time()
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "title": self.title,
+            "status": self.status,
+            "created": self.created,
+            "started": self.started,
+            "finished": self.finished,
+            "elapsed": round(end - self.started, 1) if self.started else 0,
+            "returncode": self.returncode,
+            "slot": self.slot,
+            "progress": dict(self.progress),
+            "output": self.output,
+            "reportPath": self.report_path,
+            "logPath": self.log_path,
+        }
+
+
+class JobManager:
+    def __init__(self, socketio, allocator=None, on_finish=None, store=None, metrics=None):
+        self.socketio = socketio
+        self.on_finish = on_finish              # job -> None, once per job after the test (e.g. PDF report)
+        self.store = store                      # ResultsStore: every run and report saved in the results database
+        self.metrics = metrics                  # StationMetrics: counters and histograms served on /metrics
+        self.allocator = allocator or ResourceAllocator()
+        self.console = ConsoleBatcher(socketio)
+        self.jobs = OrderedDict()               # id -> TestJob, oldest first
+        self._lock = threading.Lock()
+        self._released = threading.Condition()
+
+    def submit(self, job):
+        # The job waits in the queue (status "queued") until its resources are free
+        if job.slot is not None and job.slot not in self.allocator.slots:
+            raise ValueError(f"Unknown station slot {job.slot}")
+        with self._lock:
+            self.jobs[job.id] = job
+            finished = [j for j in self.jobs.values() if not j.active]
+            for old in finished[:max(0, len(finished) - JOB_HISTORY)]:
+                del self.jobs[old.id]
+        self._emit_status(job)
+        self.socketio.start_background_task(self._run, job)
+        return job
+
+    def get(self, job_id):
+        return self.jobs.get(job_id)
+
+    def list(self):
+        return list(self.jobs.values())
+
+    def latest(self, kind=None, active=None):
+        for job in reversed(self.jobs.values()):
+            if kind is not None and job.kind != kind:
+                continue
+            if active is not None and job.active != active:
+                continue
+            return job
+        return None
+
+    def cancel(self, job_id):
+        job = self.jobs.get(job_id)
+        if job is not None and job.active:
+            job.cancel_requested = True
+            # Signal sent now, not at the next poll of _run
+            if job.process is not None and job.process.poll() is None:
+                self._signal(job, signal.SIGTERM)
+        return job
+
+    @staticmethod
+    def _signal(job, sig):
+        # To the whole process group of the test: the script and the ones it launched
+        # (e.g. Complete_Test of the long run) run their stop hooks at the same time
+        try:
+            os.killpg(job.process.pid, sig)
+        except ProcessLookupError:
+            pass
+
+    def _emit_status(self, job):
+        self.socketio.emit('job_status', job.as_dict())
+
+    def _acquire(self, job):
+        with self._released:
+            while not self.allocator.try_acquire(job):
+                if job.cancel_requested:
+                    return False
+                self._released.wait(0.5)
+        return True
+
+    def _release(self, job):
+        with self._released:
+            self.allocator.release(job)
+            self._released.notify_all()
+
+    def _run(self, job):
+        if not self._acquire(job):
+            job.output += f"⚠ {job.title} cancelled before start.\n"
+            job.status = "cancelled"
+            job.finished = time.time()
+            self._emit_status(job)
+            return
+        job.status = "running"
+        job.started = time.time()
+        self._emit_status(job)
+        self._store("start_run", job.id, job.kind, job.params, job.started, slot=job.slot,
+                    report_path=job.report_path, log_path=job.log_path)
+        events_reader = None
+        try:
+            job.log_file = RunFile(job.log_path, header=job.log_header)
+            job.report_file = RunFile(job.report_path)
+            job.process, events_reader = test_events.spawn(
+                ['python', '-u', job.script, *job.args],
+                lambda event: self._handle_event(job, event),
+                env=dict(os.environ, **job.env),
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                text=True,
+                start_new_session=True          # own process group: a kill also reaches the scripts it launched
+            )
+            stdout_reader = threading.Thread(target=self._read_stdout, args=(job,), daemon=True)
+            stdout_reader.start()
+            kill_at = None
+            while job.process.poll() is None:
+                if job.cancel_requested and kill_at is None:
+                    self._signal(job, signal.SIGTERM)
+                    kill_at = time.time() + CANCEL_TIMEOUT
+                elif kill_at is not None and time.time() >= kill_at:
+                    job.log(f"{job.title} did not stop in {CANCEL_TIMEOUT:.0f}s, killed.")
+                    self._signal(job, signal.SIGKILL)
+                    job.process.wait()
+                    break
+                self.socketio.sleep(0.05 if kill_at else 0.2)
+            if job.cancel_requested:
+                self._signal(job, signal.SIGKILL)   # what is left of the group would hold the pipes open
+                job.output += f"⚠ {job.title} stopped by user.\n"
+                job.log(f"{job.title} stopped by user.")
+                job.status = "cancelled"
+            stdout_reader.join(timeout=5)
+        except Exception as e:
+            job.output += f"Error during execution of the {job.title}: {str(e)}\n"
+            job.status = "failed"
+            print(job.output)
+        finally:
+            if events_reader is not None:
+                events_reader.join(timeout=5)
+            if job.process is not None:
+                job.returncode = job.process.poll()
+            if job.summarize is not None:
+                job.reports = job.summarize(job.stats)
+                job.report_lines = [test_events.format_report(event) for event in job.reports]
+                if job.report_file is not None:
+                    job.report_file.write_line("")
+                    for line in job.report_lines:
+                        job.report_file.write_line(line)
+            for run_file in (job.log_file, job.report_file):
+                if run_file is not None:
+                    run_file.close()
+            if self.on_finish is not None:
+                try:
+                    self.on_finish(job)
+                except Exception as e:
+                    print(f"Error at the end of the {job.title}: {str(e)}")
+            if job.status == "running":
+                job.status = "finished"
+            job.finished = time.time()
+            self._store("finish_run", job.id, job.status, job.finished)
+            self._observe("job_finished", job)
+            self._release(job)
+            self.console.flush(job.id)          # every console line before the final status
+            self._emit_status(job)
+
+    def _store(self, method, *args, **kwargs):
+        # A database error is printed and the test goes on: the report files are still written
+        if self.store is None:
+            return
+        try:
+            getattr(self.store, method)(*args, **kwargs)
+        except Exception as e:
+            print(f"Error writing the results database ({method}): {str(e)}")
+
+    def _observe(self, method, *args):
+        # Same for the station metrics: a malformed metric event must not stop the event reader
+        if self.metrics is None:
+            return
+        try:
+            getattr(self.metrics, method)(*args)
+        except Exception as e:
+            print(f"Error updating the station metrics ({method}): {str(e)}")
+
+    def _read_stdout(self, job):
+        # Lines without prefix go to the server console; prefixed ones come from processes
+        # without the event channel (e.g. launched by the test script with subprocess.run)
+        for line in job.process.stdout:
+            event = test_events.parse_line(line)
+            if event is None:
+                print(line.rstrip())
+            else:
+                self._handle_event(job, event)
+
+    def _handle_event(self, job, event):
+        kind = event.get("type")
+        if kind == "report":
+            line = test_events.format_report(event)
+            job.report_file.write_line(line)
+            if job.summarize is None:
+                job.reports.append(event)
+                job.report_lines.append(line)
+            job.progress["reports"] += 1
+            if event.get("device") is not None:
+                self._store("add_result", job.id, event,
+                            serial_number(job.params, event["device"], event.get("address")))
+            self._observe("report", job, event)
+            stats = job.stats.add(event)
+            if stats is not None:
+                self.socketio.emit('job_stats', {'job': job.id, 'device': event["device"], 'address': event.get("address"),
+                                                 'test': event["test"], **stats.as_dict()})
+            if event.get("result") == "FAILED":
+                job.progress["failed"] += 1
+            elif event.get("result") == "PASSED":
+                job.progress["passed"] += 1
+        elif kind == "console":
+            text = event.get("text", "")
+            cleaned_line = remove_ansi_codes(text)
+            job.log(cleaned_line)
+            job.progress["lines"] += 1
+            if event.get("level") == "both":
+                display_line = ansi_to_html(text)
+                if cleaned_line.strip():
+                    job.progress["last_step"] = cleaned_line.strip()
+                print(display_line)
+                self.console.add(job, display_line)
+        elif kind == "metric":
+            job.metrics[event.get("name")] = event.get("value")
+            if event.get("name") == "step_duration_seconds":
+                self._store("set_step_duration", job.id, event.get("step", ""), event.get("ts"), event.get("value"))
+            self._observe("metric", job, event)
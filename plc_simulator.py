@@ -9,6 +9,7 @@ import requests
 #import URL
 from URL import get_main_status
 import sys
+import test_events
 
 errors = 0
 URL_API = sys.argv[3] 
@@ -20,6 +21,7 @@ def send_start_request():
     global errors
     try:
         response = requests.get(f"{URL_BACKEND}:5000/api/v2/change_mode/start")
+        test_events.metric("http_duration_seconds", response.elapsed.total_seconds(), endpoint="change_mode/start")
         if response.status_code == 200:
             print("[LOG][PLC] Start command sent successfully.")
             return response #.json()
@@ -28,6 +30,7 @@ def send_start_request():
             errors += 1
             return errors
     except Exception as e:
+        test_events.metric("http_duration_seconds", None, endpoint="change_mode/start")
         print(f"[BOTH]\033[1m\033[91mERROR\033[0m: [PLC] Exception occurred while sending start command: {e}")
         errors += 1
         return errors
@@ -37,6 +40,7 @@ def send_homing_request():
     global errors
     try:
         response = requests.get(f"{URL_BACKEND}:5000/api/v2/homing_request")
+        test_events.metric("http_duration_seconds", response.elapsed.total_seconds(), endpoint="homing_request")
         if response.status_code == 200:
             print("[LOG][PLC] Homing command sent successfully.")
             print(response.json())
@@ -46,6 +50,7 @@ def send_homing_request():
             errors += 1
             return errors
     except Exception as e:
+        test_events.metric("http_duration_seconds", None, endpoint="homing_request")
         print(f"[BOTH]\033[1m\033[91mERROR\033[0m: [PLC] Exception occurred while sending homing command: {e}")
         errors += 1
         return errors
@@ -56,6 +61,7 @@ def send_protocol_version():
     try:
         payload = {"protocol": 1}
         response = requests.post(f"{URL_BACKEND}:5000/api/v2/main_status/protocol", json=payload)
+        test_events.metric("http_duration_seconds", response.elapsed.total_seconds(), endpoint="main_status/protocol")
         if response.status_code == 200:
             print("[LOG][PLC] Protocol version sent successfully.")
             print(response.json())
@@ -65,6 +71,7 @@ def send_protocol_version():
             errors += 1
             return errors
     except Exception as e:
+        test_events.metric("http_duration_seconds", None, endpoint="main_status/protocol")
         print(f"[BOTH]\033[1m\033[91mERROR\033[0m: [PLC] Exception occurred while sending protocol version: {e}")
         errors += 1
         return errors
@@ -74,6 +81,7 @@ def send_stop_request():
     global errors
     try:
         response = requests.get(f"{URL_BACKEND}:5000/api/v2/change_mode/stop")
+        test_events.metric("http_duration_seconds", response.elapsed.total_seconds(), endpoint="change_mode/stop")
         if response.status_code == 200:
             print("[LOG][PLC] Stop command sent successfully.")
             return response.json()
@@ -82,6 +90,7 @@ def send_stop_request():
             errors += 1
             return errors
     except Exception as e:
+        test_events.metric("http_duration_seconds", None, endpoint="change_mode/stop")
         print(f"[BOTH]\033[1m\033[91mERROR\033[0m: [PLC] Exception occurred while sending stop command: {e}")
         errors += 1
         return errors
@@ -0,0 +1,72 @@
+# PDF report of a Bucintoro test job, rendered once when the job ends.
+# Table Device / Serial Number / Test / Result over as many A4 pages as needed,
+# with the column titles repeated on every page and the page number in the footer.
+# Author: Sara Alemanno
+
+import os
+import time
+import fitz # PyMuPDF
+from results_db import serial_number
+
+PAGE_WIDTH, PAGE_HEIGHT = fitz.paper_size("a4")
+MARGIN = 50
+FONT_SIZE = 10
+LINE_HEIGHT = 15
+COL_WIDTHS = [150, 110, 150, 85]  # Widths for Device, Serial Number, Test, Result columns
+COL_TITLES = ["Device", "Serial Number", "Test", "Result"]
+RESULT_COLORS = {"PASSED": (0, 0.5, 0), "FAILED": (0.8, 0, 0)}
+
+def _fit(text, width):
+    # Cuts the text so that it stays inside its column
+    text = str(text)
+    while text and fitz.get_text_length(text, fontsize=FONT_SIZE) > width - 6:
+        text = text[:-1]
+    return text
+
+def _new_page(doc, title):
+    page = doc.new_page(width=PAGE_WIDTH, height=PAGE_HEIGHT)
+    y = MARGIN
+    page.insert_text((MARGIN, y), title, fontsize=FONT_SIZE + 4)
+    y += LINE_HEIGHT * 1.5
+    x = MARGIN
+    for i, col_title in enumerate(COL_TITLES):
+        page.insert_text((x, y), col_title, fontsize=FONT_SIZE)
+        x += COL_WIDTHS[i]
+    y += LINE_HEIGHT / 2
+    page.draw_line((MARGIN, y), (MARGIN + sum(COL_WIDTHS), y))
+    return page, y + LINE_HEIGHT
+
+def render_report(job):
+    rows = []
+    for event in job.reports:
+        if event.get("device") is None:
+            continue
+        serial = serial_number(job.params, event["device"], event.get("address"))
+        rows.append([event["device"], str(serial), event["test"], str(event["result"])])
+    if not rows:
+        return None
+    rows.sort(key=lambda x: x[0])
+
+    started = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(job.started or job.created))
+    title = f"Bucintoro Test Report - {job.title} - {started}"
+    doc = fitz.open()
+    page, y = _new_page(doc, title)
+    for row_data in rows:
+        if y > PAGE_HEIGHT - MARGIN - LINE_HEIGHT:
+            page, y = _new_page(doc, title)
+        x = MARGIN
+        for i, data in enumerate(row_data):
+            color = RESULT_COLORS.get(data.upper(), (0, 0, 0)) if i == 3 else (0, 0, 0)
+            page.insert_text((x, y), _fit(data, COL_WIDTHS[i]), fontsize=FONT_SIZE, color=color)
+            x += COL_WIDTHS[i]
+        y += LINE_HEIGHT
+
+    pages = len(doc)
+    for number, page in enumerate(doc, start=1):
+        page.insert_text((MARGIN, PAGE_HEIGHT - MARGIN / 2), f"Page {number} / {pages}", fontsize=FONT_SIZE - 2)
+
+    pdf_path = job.report_path.replace('.txt', '.pdf')
+    os.makedirs(os.path.dirname(pdf_path), exist_ok=True)
+    doc.save(pdf_path)
+    doc.close()
+    return pdf_path
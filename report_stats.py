@@ -0,0 +1,86 @@
+# Per-device / per-test statistics of a test job, updated at every report event.
+# The memory used depends on the number of devices and tests, not on the number of
+# cycles: a 12 h long run keeps the same counters as a single complete test.
+# Author: Sara Alemanno
+
+from collections import deque
+
+FAILURE_HISTORY = 20        # timestamps of the last failures kept per test
+
+
+class TestStats:
+    __slots__ = ("passed", "failed", "streak", "longest_fail_streak", "last_result",
+                 "first_ts", "last_ts", "failures")
+
+    def __init__(self):
+        self.passed = 0
+        self.failed = 0
+        self.streak = 0                     # > 0: consecutive PASSED, < 0: consecutive FAILED
+        self.longest_fail_streak = 0
+        self.last_result = None
+        self.first_ts = None
+        self.last_ts = None
+        self.failures = deque(maxlen=FAILURE_HISTORY)
+
+    def add(self, result, ts):
+        if self.first_ts is None:
+            self.first_ts = ts
+        self.last_ts = ts
+        self.last_result = result
+        if result == "PASSED":
+            self.passed += 1
+            self.streak = self.streak + 1 if self.streak > 0 else 1
+        else:
+            self.failed += 1
+            self.streak = self.streak - 1 if self.streak < 0 else -1
+            self.longest_fail_streak = max(self.longest_fail_streak, -self.streak)
+            self.failures.append(ts)
+
+    @property
+    def total(self):
+        return self.passed + self.failed
+
+    @property
+    def pass_rate(self):
+        return self.passed / self.total if self.total else None
+
+    def as_dict(self):
+        return {
+            "passed": self.passed,
+            "failed": self.failed,
+            "total": self.total,
+            "passRate": round(self.pass_rate, 4) if self.total else None,
+            "streak": self.streak,
+            "longestFailStreak": self.longest_fail_streak,
+            "lastResult": self.last_result,
+            "firstTs": self.first_ts,
+            "lastTs": self.last_ts,
+            "failures": list(self.failures),
+        }
+
+
+class ReportStats:
+    def __init__(self):
+        self.devices = {}                   # device -> {test -> TestStats}
+        self.addresses = {}                 # device -> address
+
+    def add(self, event):
+        # Report event -> updated TestStats, None for the reports without PASSED/FAILED result
+        result = str(event.get("result", "")).upper()
+        if event.get("device") is None or result not in ("PASSED", "FAILED"):
+            return None
+        device, test = event["device"], event["test"]
+        self.addresses[device] = event.get("address")
+        stats = self.devices.setdefault(device, {}).setdefault(test, TestStats())
+        stats.add(result, event.get("ts"))
+        return stats
+
+    def rows(self):
+        # (device, address, test, TestStats) ordered by device and test
+        for device in sorted(self.devices):
+            for test in sorted(self.devices[device]):
+                yield device, self.addresses.get(device), test, self.devices[device][test]
+
+    def as_dict(self):
+        return [{"device": device, "address": address, "test": test, **stats.as_dict()}
+                for device, address, test, stats in self.rows()]
@@ -0,0 +1,230 @@
+# SQLite store of every test run of the station: runs, serial numbers of the modules
+# and the result of each test step, with the indexes needed by the query routes
+# (history, lookup by serial number, failure trends).
+# The route server writes the results while the job runs; import_reports.py loads the
+# report files written before the database existed.
+# Author: Sara Alemanno
+
+import os
+import json
+import time
+import sqlite3
+import threading
+
+DB_PATH = os.environ.get("BUCINTORO_RESULTS_DB",
+                         os.path.join("/home/pi/New/ScriptSara", "Bucintoro_Reports", "bucintoro_results.db"))
+COMMIT_INTERVAL = 2.0           # seconds: results are committed in groups, not one fsync per report
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id TEXT PRIMARY KEY,
+    kind TEXT,
+    slot TEXT,
+    env TEXT,
+    status TEXT,
+    started REAL,
+    finished REAL,
+    main_serial TEXT,
+    report_path TEXT,
+    log_path TEXT
+);
+CREATE TABLE IF NOT EXISTS run_modules (
+    run_id TEXT REFERENCES runs(id),
+    module TEXT,                -- main / camera / galvo
+    position INTEGER,
+    serial TEXT
+);
+CREATE TABLE IF NOT EXISTS results (
+    id INTEGER PRIMARY KEY,
+    run_id TEXT REFERENCES runs(id),
+    ts REAL,
+    device TEXT,
+    address INTEGER,
+    serial TEXT,
+    test TEXT,
+    result TEXT,
+    duration REAL,
+    metrics TEXT
+);
+CREATE INDEX IF NOT EXISTS runs_started ON runs(started);
+CREATE INDEX IF NOT EXISTS runs_report ON runs(report_path);
+CREATE INDEX IF NOT EXISTS run_modules_serial ON run_modules(serial);
+CREATE INDEX IF NOT EXISTS results_run ON results(run_id);
+CREATE INDEX IF NOT EXISTS results_serial ON results(serial, ts);
+CREATE INDEX IF NOT EXISTS results_device_test ON results(device, test, ts);
+CREATE INDEX IF NOT EXISTS results_failed ON results(result, ts);
+"""
+
+
+# Serial number of the module that produced a report: Timing Controller 20.. and Galvo 30..
+# map on the serials typed in the web interface, the reports without address (Pulse,
+# Shared Bus...) belong to the main module
+def serial_number(params, device, address):
+    if address is None:
+        return params.get('mainSerial', "")
+    if "Timing Controller" in device:
+        idx = int(address) - 20
+        serial_list = params.get('cameraSerials', [])
+    else:
+        idx = int(address) - 30
+        serial_list = params.get('galvoSerials', [])
+    # Se l’indice NON è valido, NON assegnare nulla
+    return serial_list[idx] if 0 <= idx < len(serial_list) else ""
+
+
+class ResultsStore:
+    def __init__(self, path=DB_PATH):
+        self.path = path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # One connection shared by the job threads, guarded by the lock; WAL lets the
+        # query routes read while a job is writing
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(SCHEMA)
+        self._lock = threading.Lock()
+        self._last_commit = time.time()
+
+    def close(self):
+        with self._lock:
+            self._db.commit()
+            self._db.close()
+
+    # ================== SCRITTURA ==================
+    def start_run(self, run_id, kind, params, started, slot=None, status="running",
+                  report_path=None, log_path=None):
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO runs (id, kind, slot, env, status, started, main_serial, report_path, log_path) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (run_id, kind, slot, params.get('env'), status, started, str(params.get('mainSerial', "")),
+                 report_path, log_path))
+            self._db.execute("DELETE FROM run_modules WHERE run_id = ?", (run_id,))
+            modules = [("main", 0, params.get('mainSerial', ""))]
+            modules += [("camera", i, serial) for i, serial in enumerate(params.get('cameraSerials', []))]
+            modules += [("galvo", i, serial) for i, serial in enumerate(params.get('galvoSerials', []))]
+            self._db.executemany("INSERT INTO run_modules (run_id, module, position, serial) VALUES (?, ?, ?, ?)",
+                                 [(run_id, module, position, str(serial)) for module, position, serial in modules])
+            self._db.commit()
+            self._last_commit = time.time()
+
+    def add_result(self, run_id, event, serial):
+        metrics = dict(event.get("metrics") or {})
+        duration = metrics.pop("duration_s", None)
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO results (run_id, ts, device, address, serial, test, result, duration, metrics) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (run_id, event.get("ts"), event["device"], event.get("address"), str(serial), event["test"],
+                 str(event["result"]).upper(), duration, json.dumps(metrics) if metrics else None))
+            if time.time() - self._last_commit >= COMMIT_INTERVAL:
+                self._db.commit()
+                self._last_commit = time.time()
+
+    def set_step_duration(self, run_id, step, ended, duration):
+        # The step_duration_seconds metric arrives when the step ends, after its reports:
+        # it goes on the results of the run written since the step started, unless they
+        # already carry their own duration (duration_s in the report, or an inner step)
+        duration = float(duration)
+        since = float(ended) - duration
+        with self._lock:
+            self._db.execute(
+                "UPDATE results SET duration = ?, metrics = json_set(COALESCE(metrics, '{}'), '$.step', ?) "
+                "WHERE run_id = ? AND ts >= ? AND duration IS NULL",
+                (duration, step, run_id, since))
+
+    def finish_run(self, run_id, status, finished):
+        with self._lock:
+            self._db.execute("UPDATE runs SET status = ?, finished = ? WHERE id = ?", (status, finished, run_id))
+            self._db.commit()
+            self._last_commit = time.time()
+
+    def has_run(self, run_id):
+        with self._lock:
+            return self._db.execute("SELECT 1 FROM runs WHERE id = ?", (run_id,)).fetchone() is not None
+
+    def has_report(self, path):
+        # Live runs are stored under the job id: the report path tells whether a file is already in
+        with self._lock:
+            return self._db.execute("SELECT 1 FROM runs WHERE report_path = ?", (path,)).fetchone() is not None
+
+    # ================== QUERY ==================
+    def _query(self, sql, args=()):
+        with self._lock:
+            return [dict(row) for row in self._db.execute(sql, args).fetchall()]
+
+    def history(self, kind=None, serial=None, since=None, until=None, limit=50, offset=0):
+        # Runs, newest first, with the number of passed and failed steps
+        where, args = [], []
+        if kind:
+            where.append("r.kind = ?")
+            args.append(kind)
+        if serial:
+            where.append("r.id IN (SELECT run_id FROM run_modules WHERE serial = ?)")
+            args.append(serial)
+        if since is not None:
+            where.append("r.started >= ?")
+            args.append(since)
+        if until is not None:
+            where.append("r.started < ?")
+            args.append(until)
+        sql = ("SELECT r.*, "
+               "(SELECT COUNT(*) FROM results s WHERE s.run_id = r.id AND s.result = 'PASSED') AS passed, "
+               "(SELECT COUNT(*) FROM results s WHERE s.run_id = r.id AND s.result = 'FAILED') AS failed "
+               "FROM runs r")
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY r.started DESC LIMIT ? OFFSET ?"
+        return self._query(sql, args + [limit, offset])
+
+    def run(self, run_id):
+        runs = self._query("SELECT * FROM runs WHERE id = ?", (run_id,))
+        if not runs:
+            return None
+        run = runs[0]
+        run["modules"] = self._query("SELECT module, position, serial FROM run_modules WHERE run_id = ? "
+                                     "ORDER BY module, position", (run_id,))
+        run["results"] = self._query("SELECT ts, device, address, serial, test, result, duration, metrics "
+                                     "FROM results WHERE run_id = ? ORDER BY id", (run_id,))
+        return run
+
+    def serial(self, serial, since=None):
+        # Per-test counters and last result of one module serial number
+        args = [serial]
+        sql = ("SELECT device, test, COUNT(*) AS total, "
+               "SUM(result = 'PASSED') AS passed, SUM(result = 'FAILED') AS failed, "
+               "MAX(ts) AS last_ts, "
+               "(SELECT result FROM results l WHERE l.serial = r.serial AND l.device = r.device AND l.test = r.test "
+               " ORDER BY l.ts DESC LIMIT 1) AS last_result "
+               "FROM results r WHERE serial = ?")
+        if since is not None:
+            sql += " AND ts >= ?"
+            args.append(since)
+        sql += " GROUP BY device, test ORDER BY device, test"
+        return self._query(sql, args)
+
+    def failure_trend(self, device=None, test=None, serial=None, since=None, bucket=86400):
+        # Failed / total steps and mean step duration per time bucket (default: one day).
+        # Buckets follow the local time of the station (days start at local midnight, also
+        # across DST changes): each ts is bucketed on its local clock time and the start of
+        # the bucket is returned as epoch seconds
+        where, args = [], [bucket, bucket]
+        if device:
+            where.append("device = ?")
+            args.append(device)
+        if test:
+            where.append("test = ?")
+            args.append(test)
+        if serial:
+            where.append("serial = ?")
+            args.append(serial)
+        if since is not None:
+            where.append("ts >= ?")
+            args.append(since)
+        sql = ("SELECT CAST(strftime('%s', local / ? * ?, 'unixepoch', 'utc') AS INTEGER) AS bucket, "
+               "device, test, COUNT(*) AS total, SUM(result = 'FAILED') AS failed, AVG(duration) AS avg_duration "
+               "FROM (SELECT *, CAST(strftime('%s', ts, 'unixepoch', 'localtime') AS INTEGER) AS local FROM results")
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += ") GROUP BY bucket, device, test ORDER BY bucket, device, test"
+        return self._query(sql, args)
@@ -0,0 +1,116 @@
+# Log and report files of the test jobs, written line by line while the test runs.
+# The lines reach the OS at once (line buffering) and the file is fsync'ed every
+# FSYNC_INTERVAL seconds, so a crash of the server or a power cut loses at most a few
+# seconds of log. Above MAX_BYTES the file is rotated: the full part becomes
+# <name>.<n>.txt(.gz) and writing starts again on <name>.txt.
+# Author: Sara Alemanno
+
+import os
+import gzip
+import zlib
+import time
+import shutil
+import threading
+
+FSYNC_INTERVAL = 5.0                                # seconds between two fsync
+MAX_BYTES = int(os.environ.get("BUCINTORO_LOG_MAX_BYTES", 50 * 1024 * 1024))
+COMPRESS = os.environ.get("BUCINTORO_LOG_COMPRESS", "1") == "1"    # gzip the rotated parts
+
+
+class RunFile:
+    def __init__(self, path, header="", max_bytes=MAX_BYTES, compress=COMPRESS):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.compress = compress
+        self.parts = []                     # rotated parts, oldest first
+        self._lock = threading.Lock()
+        self._compressing = []
+        self._last_sync = time.time()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._file = open(path, "w", buffering=1, encoding="utf-8")
+        if header:
+            self._file.write(header)
+
+    def write_line(self, line):
+        with self._lock:
+            if self._file is None:
+                return
+            self._file.write(line + "\n")
+            if self._file.tell() >= self.max_bytes:
+                self._rotate()
+            elif time.time() - self._last_sync >= FSYNC_INTERVAL:
+                self._sync()
+
+    def _sync(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._last_sync = time.time()
+
+    def _rotate(self):
+        self._sync()
+        self._file.close()
+        base, ext = os.path.splitext(self.path)
+        part = f"{base}.{len(self.parts) + 1}{ext}"
+        os.replace(self.path, part)
+        if self.compress:
+            # Compression in background: the event reader must not stop for seconds
+            self.parts.append(part + ".gz")
+            worker = threading.Thread(target=self._gzip, args=(part,), daemon=True)
+            worker.start()
+            self._compressing.append(worker)
+        else:
+            self.parts.append(part)
+        self._file = open(self.path, "w", buffering=1, encoding="utf-8")
+
+    @staticmethod
+    def _gzip(part):
+        with open(part, "rb") as src, gzip.open(part + ".gz", "wb") as dst:
+            shutil.copyfileobj(src, dst)
+        os.remove(part)
+
+    def close(self):
+        with self._lock:
+            if self._file is None:
+                return
+            self._sync()
+            self._file.close()
+            self._file = None
+        for worker in self._compressing:
+            worker.join()
+
+    def flush(self):
+        with self._lock:
+            if self._file is not None:
+                self._sync()
+
+    def stream(self, chunk_size=64 * 1024):
+        # Whole content as one stream: plain text if nothing was rotated (or compression is
+        # off), otherwise gzip: the rotated .gz parts followed by the current part compressed
+        # on the fly (concatenated gzip members are a valid gzip file)
+        self.flush()
+        for worker in list(self._compressing):
+            worker.join()
+        for part in self.parts:
+            yield from self._read(part, chunk_size)
+        if self.gzipped:
+            packer = zlib.compressobj(wbits=31)         # wbits=31: gzip member
+            for chunk in self._read(self.path, chunk_size):
+                data = packer.compress(chunk)
+                if data:
+                    yield data
+            yield packer.flush()
+        else:
+            yield from self._read(self.path, chunk_size)
+
+    @staticmethod
+    def _read(path, chunk_size):
+        with open(path, "rb") as f:
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+
+    @property
+    def gzipped(self):
+        return any(part.endswith(".gz") for part in self.parts)
@@ -1,61 +1,43 @@
 #!/usr/bin/env python3
-import serial
-import glob
-import time
-from ArduinoController_v3 import ArduinoDevice
+# Scansione completa delle porte USB: ricostruisce e stampa la cache porta -> address
+# usata da detect_devices() per riconoscere subito le schede del banco.
+# Uso: python scan_arduinos.py            (scansione + nuova cache)
+#      python scan_arduinos.py --show     (stampa solo la cache attuale)
+import sys
+from ArduinoController_v3 import detect_devices, load_port_cache, PORT_CACHE_FILE, NOT_ARDUINO_AFTER
+
+def print_port_cache():
+    cache = load_port_cache()
+    print(f"\n======== CACHE PORTE ({PORT_CACHE_FILE}) ========\n")
+    if not cache:
+        print("Cache vuota.")
+    for identity, entry in sorted(cache.items(), key=lambda item: item[1]["port"]):
+        if entry["address"] is not None:
+            address = entry["address"]
+        elif entry.get("silent", 0) < NOT_ARDUINO_AFTER:
+            address = f"-- (muta {entry.get('silent', 0)}/{NOT_ARDUINO_AFTER})"
+        else:
+            address = "-- (non Arduino)"
+        print(f"{entry['port']:<20} address {address:<18} {identity}")
+    print("\n=====================================\n")
 
 def scan_arduinos():
     print("\n======== SCANSIONE ARDUINO ========\n")
 
-    ports = glob.glob("/dev/ttyUSB*")
-    print(f"[SCAN] Porte trovate: {ports}\n")
-
-    arduinos = {}
-
-    for port in ports:
-        print(f"[SCAN] Tento apertura {port}...")
-
-        try:
-            # Apertura temporanea solo per leggere l'indirizzo
-            ser = serial.Serial(port=port, baudrate=9600, timeout=1)
-            time.sleep(2)
-            ser.reset_input_buffer()
-
-            # Chiedo l'indirizzo
-            ser.write(b"GET_ADDRESS\n")
-            time.sleep(0.2)
-
-            line = ser.readline().decode(errors="ignore").strip()
-
-            if line.startswith("ADDRESS:"):
-                addr = int(line.split(":")[1])
-                print(f"[SCAN]  ✔ Arduino address {addr} risponde su {port}")
-
-                # Creo l'oggetto ArduinoDevice definitivo
-                arduinos[addr] = ArduinoDevice(port=port, address=addr)
-
-            else:
-                print(f"[SCAN]  ⚠ Nessuna risposta valida da {port}: '{line}'")
-
-            ser.close()
-
-        except Exception as e:
-            print(f"[SCAN]  ❌ Errore apertura {port}: {e}")
+    # Scansione completa, senza usare la cache: il risultato diventa la nuova cache
+    arduinos = detect_devices(use_cache=False)
 
     print("\n======== RISULTATO SCANSIONE ========\n")
     print(f"Arduino trovati: {len(arduinos)}")
     print(f"Indirizzi rilevati: {list(arduinos.keys())}")
 
-    # Controllo duplicati
-    if len(arduinos) != len(set(arduinos.keys())):
-        print("\n[ERROR] Indirizzi duplicati rilevati!")
-    else:
-        print("\n[OK] Tutti gli indirizzi sono unici.")
-
-    print("\n=====================================\n")
+    print_port_cache()
 
     return arduinos
 
 
 if __name__ == "__main__":
-    scan_arduinos()
+    if "--show" in sys.argv:
+        print_port_cache()
+    else:
+        scan_arduinos()
@@ -0,0 +1,181 @@
+# Station metrics in the Prometheus text format, served by /metrics of the route server.
+# Fed by the jobs of the JobManager: job status, report events and the metric events the
+# test scripts send on their event channel (test_events.metric / test_events.step):
+#   step_duration_seconds   {"step": "i2c"}            duration of a test step
+#   http_duration_seconds   {"endpoint": "go2run"}     backend / device API call
+#   dut_temperature_celsius                            temperature read by check_temperature
+#   serial_link_stats                                  Arduino link statistics at the end of the script
+# The counters live in memory and start from zero when the server restarts, as Prometheus expects.
+# Author: Sara Alemanno
+
+import threading
+
+STEP_BUCKETS = (1, 2, 5, 10, 20, 30, 60, 120, 300, 600)
+HTTP_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+JOB_BUCKETS = (60, 300, 600, 1200, 1800, 3600, 7200, 14400, 43200)
+# Same bounds as LATENCY_BUCKETS_MS of ArduinoController_v3: the histograms of the scripts add up exactly
+SERIAL_BUCKETS = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self.values = {}                    # label values -> value
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.label_names)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            for key, value in sorted(self.values.items()):
+                lines += self._samples(key, value)
+        return lines
+
+    def _samples(self, key, value):
+        return [f"{self.name}{_labels(self.label_names, key)} {_number(value)}"]
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        with self._lock:
+            self.values[self._key(labels)] = value
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=STEP_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def _entry(self, key):
+        entry = self.values.get(key)
+        if entry is None:
+            entry = self.values[key] = {"buckets": [0] * (len(self.buckets) + 1), "sum": 0.0, "count": 0}
+        return entry
+
+    def observe(self, value, **labels):
+        with self._lock:
+            entry = self._entry(self._key(labels))
+            entry["buckets"][sum(1 for bound in self.buckets if value > bound)] += 1
+            entry["sum"] += value
+            entry["count"] += 1
+
+    def merge(self, counts, total, **labels):
+        # Adds a histogram already counted elsewhere (counts per bucket, not cumulative)
+        with self._lock:
+            entry = self._entry(self._key(labels))
+            for i, count in enumerate(counts[:len(entry["buckets"])]):
+                entry["buckets"][i] += count
+            entry["sum"] += total
+            entry["count"] += sum(counts)
+
+    def _samples(self, key, entry):
+        lines, cumulative = [], 0
+        for bound, count in zip(self.buckets + (float("inf"),), entry["buckets"]):
+            cumulative += count
+            lines.append(f"{self.name}_bucket{_labels(self.label_names, key, [('le', _number(bound))])} {cumulative}")
+        lines.append(f"{self.name}_sum{_labels(self.label_names, key)} {_number(entry['sum'])}")
+        lines.append(f"{self.name}_count{_labels(self.label_names, key)} {entry['count']}")
+        return lines
+
+
+class StationMetrics:
+    def __init__(self):
+        self.jobs = Counter("bucintoro_jobs_total", "Test jobs ended, by kind and final status",
+                            ("kind", "status"))
+        self.job_duration = Histogram("bucintoro_job_duration_seconds", "Duration of the test jobs",
+                                      ("kind",), JOB_BUCKETS)
+        self.results = Counter("bucintoro_test_results_total", "Test step results reported by the scripts",
+                               ("device", "test", "result"))
+        self.steps = Histogram("bucintoro_step_duration_seconds", "Duration of the test steps",
+                               ("step",), STEP_BUCKETS)
+        self.http = Histogram("bucintoro_http_duration_seconds", "Latency of the backend and device API calls",
+                              ("endpoint",), HTTP_BUCKETS)
+        self.http_errors = Counter("bucintoro_http_errors_total", "Backend and device API calls failed",
+                                   ("endpoint",))
+        self.serial = Histogram("bucintoro_serial_latency_seconds", "Latency of the Arduino serial commands",
+                                ("address", "command"), SERIAL_BUCKETS)
+        self.serial_timeouts = Counter("bucintoro_serial_timeouts_total", "Arduino serial commands without answer",
+                                       ("address", "command"))
+        self.temperature = Gauge("bucintoro_dut_temperature_celsius", "Last temperature read from the device under test",
+                                 ("slot",))
+        self.queued = Gauge("bucintoro_jobs_queued", "Jobs waiting for their station resources")
+        self.running = Gauge("bucintoro_jobs_running", "Jobs running")
+        self.slots_busy = Gauge("bucintoro_station_slots_busy", "Station slots held by a job")
+        self.all = [self.jobs, self.job_duration, self.results, self.steps, self.http, self.http_errors,
+                    self.serial, self.serial_timeouts, self.temperature, self.queued, self.running, self.slots_busy]
+
+    # ================== EVENTS ==================
+    def report(self, job, event):
+        result = str(event.get("result", "")).upper()
+        if event.get("device") is not None and result in ("PASSED", "FAILED"):
+            self.results.inc(device=event["device"], test=event["test"], result=result)
+
+    def metric(self, job, event):
+        name, value = event.get("name"), event.get("value")
+        if name == "step_duration_seconds":
+            self.steps.observe(float(value), step=event.get("step", ""))
+        elif name == "http_duration_seconds":
+            if value is None:
+                self.http_errors.inc(endpoint=event.get("endpoint", ""))
+            else:
+                self.http.observe(float(value), endpoint=event.get("endpoint", ""))
+        elif name == "dut_temperature_celsius":
+            self.temperature.set(float(value), slot=job.slot or "")
+        elif name == "serial_link_stats":
+            for link in (value or {}).values():
+                for command, entry in link.get("commands", {}).items():
+                    labels = {"address": link.get("address"), "command": command}
+                    self.serial.merge(entry.get("buckets", []), entry.get("sum_ms", 0.0) / 1000, **labels)
+                    if entry.get("timeouts"):
+                        self.serial_timeouts.inc(entry["timeouts"], **labels)
+
+    def job_finished(self, job):
+        self.jobs.inc(kind=job.kind, status=job.status)
+        if job.started is not None:
+            self.job_duration.observe(job.finished - job.started, kind=job.kind)
+
+    # ================== EXPOSITION ==================
+    def render(self, jobs=()):
+        # Text format 0.0.4; the queue gauges are read from the jobs at every scrape
+        jobs = list(jobs)
+        self.queued.set(sum(1 for job in jobs if job.status == "queued"))
+        self.running.set(sum(1 for job in jobs if job.status == "running"))
+        self.slots_busy.set(sum(1 for job in jobs if job.status == "running" and job.slot is not None))
+        lines = []
+        for metric in self.all:
+            lines += metric.render()
+        return "\n".join(lines) + "\n"
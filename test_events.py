@@ -0,0 +1,252 @@
+# Canale eventi tra gli script di test e il server (Route_Tests_Bucintoro_v0.py)
+# Ogni evento è una riga JSON scritta su una pipe dedicata (fd in BUCINTORO_EVENT_FD):
+#   {"ts": ..., "type": "report", "device": "Galvo Controller 30", "address": 30, "test": "Galvo Static", "result": "PASSED"}
+#   {"ts": ..., "type": "console", "level": "both", "text": "..."}
+#   {"ts": ..., "type": "metric", "name": "step_duration_seconds", "value": 12.3, "step": "i2c"}
+# Il server legge i campi degli eventi senza dover interpretare il testo, e la console
+# della pagina web è costruita dagli stessi eventi.
+# Senza server (script lanciato a mano) gli eventi sono stampati nel vecchio formato
+# [REPORT]/[LOG]/[BOTH], quindi l'uscita a terminale non cambia.
+# Lo stop dal server arriva come SIGTERM: lo script esegue gli hook registrati con
+# on_stop() (noise, pin, backend, alimentatore) ed esce entro STOP_TIMEOUT secondi.
+# Author: Sara Alemanno
+
+import os
+import sys
+import json
+import time
+import atexit
+import signal
+import threading
+import contextlib
+import subprocess
+
+EVENT_FD_VAR = "BUCINTORO_EVENT_FD"
+STOP_TIMEOUT_VAR = "BUCINTORO_STOP_TIMEOUT"
+STOP_TIMEOUT = float(os.environ.get(STOP_TIMEOUT_VAR, 2.0))    # secondi per gli hook di stop, poi si esce comunque
+STOP_EXIT_CODE = 128 + signal.SIGTERM
+
+PREFIXES = (("[REPORT]", "report"), ("[LOG]", "log"), ("[BOTH]", "both"))
+
+_lock = threading.Lock()
+_stdout = sys.stdout            # stream reale, anche dopo install()
+
+def _open_channel():
+    fd = os.environ.get(EVENT_FD_VAR)
+    if not fd:
+        return None
+    try:
+        os.fstat(int(fd))       # fd non ereditato (es. nipote lanciato senza pass_fds)
+    except (OSError, ValueError):
+        return None
+    return int(fd)
+
+_channel = _open_channel()
+
+# ================== EVENTI ==================
+def send(event):
+    event.setdefault("ts", time.time())
+    if _channel is None:
+        with _lock:
+            _stdout.write(format_line(event) + "\n")
+            _stdout.flush()
+        return
+    data = (json.dumps(event, ensure_ascii=False) + "\n").encode("utf-8")
+    with _lock:
+        os.write(_channel, data)
+
+def report(device, test, result, address=None, **metrics):
+    event = {"type": "report", "device": device, "address": address, "test": test, "result": result}
+    if metrics:
+        event["metrics"] = metrics
+    send(event)
+
+def console(text, level="both"):
+    send({"type": "console", "level": level, "text": text})
+
+def metric(name, value, **fields):
+    # Solo verso il server (metriche della postazione, /metrics): a mano non si stampano
+    if _channel is not None:
+        send({"type": "metric", "name": name, "value": value, **fields})
+
+@contextlib.contextmanager
+def step(name):
+    # with step("i2c"): ...  -> durata della fase in step_duration_seconds
+    start = time.monotonic()
+    try:
+        yield
+    finally:
+        metric("step_duration_seconds", time.monotonic() - start, step=name)
+
+# ================== FORMATO TESTO ==================
+def format_report(event):
+    if event.get("device") is None:
+        return event.get("text", "")
+    return f"{event['device']} | Test: {event['test']} | Result: {event['result']}"
+
+def format_line(event):
+    # Evento -> riga nel vecchio formato a prefissi
+    kind = event.get("type")
+    if kind == "report":
+        return "[REPORT] " + format_report(event)
+    if kind == "console":
+        return ("[LOG]" if event.get("level") == "log" else "[BOTH]") + event.get("text", "")
+    return "[LOG]" + json.dumps(event, ensure_ascii=False)
+
+def parse_line(line):
+    # Riga a prefissi -> evento (None per le righe senza prefisso). Serve per i print()
+    # esistenti negli script e per i processi che scrivono ancora solo su stdout.
+    line = line.rstrip("\r\n")
+    for prefix, level in PREFIXES:
+        if not line.strip().startswith(prefix):
+            continue
+        text = line.strip()[len(prefix):]
+        if level != "report":
+            return {"type": "console", "level": level, "text": text}
+        parts = [part.strip() for part in text.split("|")]
+        if len(parts) != 3:
+            return {"type": "report", "text": text.strip()}
+        device = parts[0]
+        address = device.split()[-1] if device else ""
+        return {
+            "type": "report",
+            "device": device,
+            "address": int(address) if address.isdigit() else None,
+            "test": parts[1].replace("Test:", "").strip(),
+            "result": parts[2].replace("Result:", "").strip().upper(),
+        }
+    return None
+
+# ================== STDOUT ==================
+# Con install() i print("[BOTH]...") degli script diventano eventi; le righe senza
+# prefisso restano su stdout. Buffer per thread: print() scrive testo e "\n" separati
+# e più thread (monitor temperatura, lettura seriali) stampano insieme.
+class _EventStdout:
+    def __init__(self, stream):
+        self._stream = stream
+        self._local = threading.local()
+
+    def write(self, text):
+        buf = getattr(self._local, "buf", "") + text
+        while "\n" in buf:
+            line, buf = buf.split("\n", 1)
+            event = parse_line(line)
+            if event is None:
+                with _lock:
+                    self._stream.write(line + "\n")
+                    self._stream.flush()
+            else:
+                send(event)
+        self._local.buf = buf
+        return len(text)
+
+    def flush(self):
+        self._stream.flush()
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+
+def install():
+    global _stdout
+    if threading.current_thread() is threading.main_thread():
+        signal.signal(signal.SIGTERM, _on_signal)
+        sys.excepthook = _excepthook
+    if _channel is not None and not isinstance(sys.stdout, _EventStdout):
+        _stdout = sys.stdout
+        sys.stdout = _EventStdout(sys.stdout)
+
+# ================== STOP ==================
+# Gli hook girano in parallelo, ognuno nel suo thread: un comando bloccato (es. backend
+# che non risponde) non impedisce di fermare le schede e l'alimentatore.
+# TestCancelled è una BaseException: gli "except Exception" degli script non la fermano.
+class TestCancelled(BaseException):
+    pass
+
+stop_requested = threading.Event()
+_stop_hooks = []
+
+def on_stop(func, *args, **kwargs):
+    _stop_hooks.append((func, args, kwargs))
+
+def _run_hook(func, args, kwargs):
+    try:
+        func(*args, **kwargs)
+    except Exception as e:
+        print(f"[LOG][STOP] {getattr(func, '__name__', func)}: {e}")
+
+def _stop():
+    print("[BOTH]Stop requested: stopping the test...")
+    deadline = time.monotonic() + STOP_TIMEOUT
+    workers = [threading.Thread(target=_run_hook, args=hook, daemon=True) for hook in _stop_hooks]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join(max(0, deadline - time.monotonic()))
+    late = [getattr(func, '__name__', str(func)) for worker, (func, _, _) in zip(workers, _stop_hooks)
+            if worker.is_alive()]
+    if late:
+        print(f"[BOTH]\033[1m\033[93mWARNING\033[0m: stop not completed in {STOP_TIMEOUT}s: {', '.join(late)}")
+    # Gli atexit (es. statistiche seriali di ArduinoController) con os._exit non girerebbero
+    exit_funcs = threading.Thread(target=atexit._run_exitfuncs, daemon=True)
+    exit_funcs.start()
+    exit_funcs.join(max(0.2, deadline - time.monotonic()))
+    try:
+        sys.stdout.flush()
+    except Exception:
+        pass
+    # os._exit: non si aspettano i thread dei test (lettura seriali, check LUT...) ancora vivi
+    os._exit(STOP_EXIT_CODE)
+
+def _on_signal(signum, frame):
+    if stop_requested.is_set():
+        return
+    stop_requested.set()
+    # Gli hook partono in un thread (non si stampa dal gestore del segnale: il thread principale
+    # può essere dentro send() con il lock preso), il thread principale smette di lavorare
+    threading.Thread(target=_stop, name="test-stop").start()
+    raise TestCancelled()
+
+def _excepthook(kind, value, tb):
+    if issubclass(kind, TestCancelled):
+        return                  # il thread "test-stop" termina il processo
+    _excepthook_default(kind, value, tb)
+
+_excepthook_default = sys.excepthook
+
+def stop_process(process, timeout=None):
+    # SIGTERM a un figlio lanciato con spawn(): esegue i suoi hook di stop, kill se non esce in tempo
+    if process.poll() is None:
+        process.terminate()
+        try:
+            process.wait(timeout)
+        except subprocess.TimeoutExpired:
+            process.kill()
+    return process.wait()
+
+# ================== PROCESSI FIGLI ==================
+def _read_channel(fd, on_event):
+    with os.fdopen(fd, "r", encoding="utf-8", errors="replace") as channel:
+        for line in channel:
+            try:
+                event = json.loads(line)
+            except ValueError:
+                continue
+            on_event(event)
+
+def spawn(cmd, on_event, env=None, **popen_args):
+    # Lancia cmd con un proprio canale eventi; on_event è chiamata dal thread di lettura.
+    # Restituisce (process, thread): il thread termina quando il figlio chiude la pipe.
+    read_fd, write_fd = os.pipe()
+    env = dict(os.environ if env is None else env)
+    env[EVENT_FD_VAR] = str(write_fd)
+    try:
+        process = subprocess.Popen(cmd, env=env, pass_fds=(write_fd,), **popen_args)
+    except Exception:
+        os.close(read_fd)
+        raise
+    finally:
+        os.close(write_fd)
+    reader = threading.Thread(target=_read_channel, args=(read_fd, on_event), daemon=True,
+                              name="test-events")
+    reader.start()
+    return process, reader
@@ -0,0 +1,52 @@
+# Import dei report su un database che contiene già i test registrati dal server:
+# i run live (id = uuid del job) non devono essere importati una seconda volta.
+#   python -m pytest -q test_import_reports.py
+
+import os
+import time
+from flask import Flask
+from flask_socketio import SocketIO
+import job_manager
+from results_db import ResultsStore
+import import_reports
+
+CHILD = """
+import sys
+sys.path.insert(0, {repo!r})
+from test_events import report
+report("Timing Controller 20", "LUT", "PASSED", address=20)
+report("Pulse", "Go2Run", "FAILED")
+"""
+
+
+def test_import_skips_live_runs(tmp_path):
+    reports_dir = tmp_path / "Bucintoro_Reports"
+    reports_dir.mkdir()
+    db_path = str(reports_dir / "bucintoro_results.db")
+    script = tmp_path / "child.py"
+    script.write_text(CHILD.format(repo=os.path.dirname(os.path.abspath(__file__))))
+
+    # Run live: il JobManager scrive il report e lo registra nel database
+    store = ResultsStore(db_path)
+    manager = job_manager.JobManager(SocketIO(Flask(__name__), async_mode="threading"), store=store)
+    job = job_manager.TestJob("loop", str(script), [], str(reports_dir / "Bucintoro_test_2026-03-04_10-15-00.txt"),
+                              str(reports_dir / "Bucintoro_log_2026-03-04_10-15-00.txt"), params={'mainSerial': "M1"})
+    manager.submit(job)
+    deadline = time.time() + 30
+    while job.active and time.time() < deadline:
+        time.sleep(0.05)
+    assert job.status == "finished"
+    store.close()
+
+    # Un report precedente al database, da importare
+    (reports_dir / "Bucintoro_test_2026-03-01_09-00-00.txt").write_text(
+        "Galvo Controller 30 | Test: Galvo Static | Result: PASSED\n")
+
+    import_reports.import_reports(str(reports_dir), db_path)
+    import_reports.import_reports(str(reports_dir), db_path)
+
+    store = ResultsStore(db_path)
+    runs = {run['id']: run for run in store.history()}
+    store.close()
+    assert set(runs) == {job.id, "import:Bucintoro_test_2026-03-01_09-00-00"}
+    assert (runs[job.id]['passed'], runs[job.id]['failed']) == (1, 1)
@@ -0,0 +1,72 @@
+# Durata dei passi e trend dei fallimenti nel database dei risultati.
+#   python -m pytest -q test_results_db.py
+
+import os
+import time
+from datetime import datetime
+from flask import Flask
+from flask_socketio import SocketIO
+import job_manager
+from results_db import ResultsStore
+
+CHILD = """
+import sys, time
+sys.path.insert(0, {repo!r})
+import test_events
+from test_events import report
+with test_events.step("i2c"):
+    time.sleep(0.2)
+    report("Pulse", "I2C Test", "PASSED")
+report("Galvo Controller 30", "Galvo Static", "FAILED", address=30, duration_s=1.5)
+"""
+
+
+def test_duration_round_trip(tmp_path):
+    store = ResultsStore(str(tmp_path / "results.db"))
+    store.start_run("r1", "loop", {'mainSerial': "M1"}, time.time())
+    store.add_result("r1", {"ts": time.time(), "device": "Pulse", "test": "I2C Test", "result": "PASSED",
+                            "metrics": {"duration_s": 2.5, "current_ma": 120}}, "M1")
+    store.finish_run("r1", "finished", time.time())
+    assert [run['id'] for run in store.history()] == ["r1"]
+    result = store.run("r1")["results"][0]
+    assert result["duration"] == 2.5
+    assert result["metrics"] == '{"current_ma": 120}'
+    assert store.failure_trend(device="Pulse")[0]["avg_duration"] == 2.5
+    store.close()
+
+
+def test_step_duration_from_live_run(tmp_path):
+    script = tmp_path / "child.py"
+    script.write_text(CHILD.format(repo=os.path.dirname(os.path.abspath(__file__))))
+    store = ResultsStore(str(tmp_path / "results.db"))
+    manager = job_manager.JobManager(SocketIO(Flask(__name__), async_mode="threading"), store=store)
+    job = job_manager.TestJob("loop", str(script), [], str(tmp_path / "report.txt"), str(tmp_path / "log.txt"))
+    manager.submit(job)
+    deadline = time.time() + 30
+    while job.active and time.time() < deadline:
+        time.sleep(0.05)
+    assert job.status == "finished"
+    assert [run['id'] for run in store.history()] == [job.id]
+    results = {row["test"]: row for row in store.run(job.id)["results"]}
+    assert 0.2 <= results["I2C Test"]["duration"] < 5
+    assert results["I2C Test"]["metrics"] == '{"step":"i2c"}'
+    assert results["Galvo Static"]["duration"] == 1.5
+    store.close()
+
+
+def test_failure_trend_local_days(tmp_path, monkeypatch):
+    monkeypatch.setenv("TZ", "Europe/Rome")
+    time.tzset()
+    try:
+        store = ResultsStore(str(tmp_path / "results.db"))
+        store.start_run("r1", "loop", {}, 0)
+        late = datetime(2026, 3, 4, 23, 30).timestamp()
+        early = datetime(2026, 3, 5, 0, 30).timestamp()
+        for ts in (late, early):
+            store.add_result("r1", {"ts": ts, "device": "Pulse", "test": "I2C Test", "result": "FAILED"}, "")
+        buckets = [row["bucket"] for row in store.failure_trend()]
+        store.close()
+        assert buckets == [datetime(2026, 3, 4).timestamp(), datetime(2026, 3, 5).timestamp()]
+    finally:
+        monkeypatch.delenv("TZ")
+        time.tzset()